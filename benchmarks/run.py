@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+''' Benchmarks of SPKM hot paths against synthetic repos served by a local mirror. '''
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + '/../src')
+
+# pylint: disable=wrong-import-position
+
+from operations.upgrade import (add_pkg, del_pkg, get_ops, solve_pkg_deps, sync_repo,
+                                update_pkgs)
+from utils.db import get_pkg_data, repo_indexes, write_index_data
+from utils.logger import get_logger
+from utils.transaction import Transaction
+
+from synthetic import gen_repo, pkg_name
+from server import Mirror
+
+REPO_NAME = 'bench'
+
+def make_config(workdir: str, url: str, threads: int) -> dict:
+    '''
+    Builds the SPKM configuration of a benchmark.
+
+    :param str workdir: Working directory of the benchmark
+    :param str url: Mirror URL
+    :param int threads: Number of threads
+
+    :return: SPKM Configuration
+    :rtype: dict
+    '''
+
+    config = {
+        'general': {
+            'dbpath': workdir + '/db',
+            'cache': workdir + '/cache',
+            'root': workdir + '/root',
+            'colors': False,
+            'threads': threads
+        },
+        'repos': [{'name': REPO_NAME, 'url': url}]
+    }
+
+    os.makedirs(config['general']['dbpath'], exist_ok=True)
+
+    for index in ('local', 'world'):
+        with open(config['general']['dbpath'] + '/' + index, 'w', encoding='utf-8') as f:
+            f.close()
+
+    return config
+
+def timed(results: dict, name: str, func, *args):
+    '''
+    Runs a function silently and records its duration.
+
+    :param dict results: Results of the current size
+    :param str name: Benchmark name
+    :param func: Function to run
+    :param args: Function arguments
+
+    :return: Result of the function
+    '''
+
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        start_time = time.perf_counter()
+        result = func(*args)
+        results[name] = time.perf_counter() - start_time
+
+    print(f'  {name:<16} {results[name]:10.4f}s', file=sys.stderr)
+
+    return result
+
+def write_world(config: dict, names: list[str]):
+    '''
+    Writes the `world.new` file requesting the given packages.
+
+    :param dict config: SPKM Configuration
+    :param list[str] names: Requested packages
+
+    :return: None
+    '''
+
+    write_index_data(
+        {name: {'version': '1.0', 'release': '1'} for name in names},
+        config['general']['dbpath'] + '/world.new'
+    )
+
+def bench_size(count: int, args: argparse.Namespace) -> dict:
+    '''
+    Runs the benchmarks against a repo of the given size.
+
+    :param int count: Number of packages in the repo
+    :param argparse.Namespace args: Command line arguments
+
+    :return: Durations, indexed by benchmark name
+    :rtype: dict
+    '''
+
+    results: dict = {}
+    rand = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix=f'spkm-bench-{count}-') as workdir:
+        repo_dir = workdir + '/mirror'
+        os.makedirs(repo_dir)
+
+        print(f'Generating a repo of {count} packages...', file=sys.stderr)
+        gen_repo(repo_dir, REPO_NAME, count, args.seed)
+
+        # Operations log through the logger, which keeps its own stream
+
+        with Mirror(repo_dir) as mirror, open(os.devnull, 'w', encoding='utf-8') as devnull:
+            config = make_config(workdir, mirror.url, args.threads)
+            logger = get_logger(config, devnull)
+
+            print(f'{count} packages:', file=sys.stderr)
+
+            repo_indexes.clear()
+            timed(results, 'sync_repo', sync_repo, config, config['repos'][0])
+
+            # Request a few leaf packages, their dependencies make the install set
+
+            requested = rand.sample(range(count // 2, count), max(1, min(args.install, count) // 8))
+            write_world(config, [pkg_name(i) for i in requested])
+
+            ops, local_data = timed(results, 'get_ops', get_ops, config)
+
+            samples = [pkg_name(i) for i in rand.sample(range(count), min(args.samples, count))]
+            timed(results, 'solve_pkg_deps',
+                    lambda: [solve_pkg_deps(config, pkg) for pkg in samples])
+
+            os.rename(
+                config['general']['dbpath'] + '/world.new',
+                config['general']['dbpath'] + '/world'
+            )
+            timed(results, 'add_pkg', add_pkg, config, logger, local_data, ops['adds'])
+            write_index_data(local_data, config['general']['dbpath'] + '/local')
+
+            results['installed'] = len(local_data)
+
+            # Publish a new version of some installed packages
+
+            installed = sorted(int(name[3:]) for name in local_data)
+            bumped = frozenset(rand.sample(installed, max(1, len(installed) * args.bump // 100)))
+            gen_repo(repo_dir, REPO_NAME, count, args.seed, bumped)
+
+            repo_indexes.clear()
+            sync_repo(config, config['repos'][0])
+
+            with (open(os.devnull, 'w', encoding='utf-8') as devnull,
+                    contextlib.redirect_stdout(devnull)):
+                ops, local_data = get_ops(config)
+
+            transaction = Transaction(config)
+            transaction.begin()
+
+            timed(results, 'update_pkgs', update_pkgs, config, logger, local_data, ops['up'],
+                    transaction)
+            results['updated'] = len(ops['up'])
+
+            dels = [
+                get_pkg_data(config, name).with_version(
+                    local_data[name]['version'],
+                    local_data[name]['release']
+                )
+                for name in local_data
+            ]
+            timed(results, 'del_pkg', del_pkg, config, logger, local_data, dels, transaction)
+
+            logger.flush()
+
+    return results
+
+def main():
+    '''
+    Runs the benchmarks and stores their results.
+
+    :return: None
+    '''
+
+    parser = argparse.ArgumentParser(description='Benchmarks SPKM hot paths.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='Repo sizes (number of packages)')
+    parser.add_argument('--install', type=int, default=500,
+                        help='Approximate number of packages to install')
+    parser.add_argument('--bump', type=int, default=5,
+                        help='Percentage of installed packages getting a new version')
+    parser.add_argument('--samples', type=int, default=100,
+                        help='Number of packages whose dependencies are solved')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1,
+                        help='Number of threads')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--output', type=str,
+                        default=os.path.dirname(os.path.abspath(__file__)) + '/results',
+                        help='Directory where results are stored')
+
+    args = parser.parse_args()
+
+    run = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'threads': args.threads,
+        'results': {}
+    }
+
+    for count in args.sizes:
+        run['results'][str(count)] = bench_size(count, args)
+
+    os.makedirs(args.output, exist_ok=True)
+    output = args.output + '/' + run['date'].replace(':', '-') + '.json'
+
+    with open(output, 'w', encoding='utf-8') as output_file:
+        json.dump(run, output_file, indent=4)
+
+    print(f'Results stored in {output}', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
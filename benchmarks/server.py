@@ -0,0 +1,38 @@
+''' This module is a local HTTP server acting as a fake mirror for the benchmarks. '''
+
+import functools
+import threading
+
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    ''' A request handler which does not log each request. '''
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+class Mirror:
+    '''
+    A fake mirror serving a directory on a random local port.
+
+    Attributes:
+        server (ThreadingHTTPServer): HTTP server
+        thread (threading.Thread): Thread running the server
+        url (str): URL of the mirror
+    '''
+
+    def __init__(self, directory: str):
+        self.server = ThreadingHTTPServer(
+            ('127.0.0.1', 0),
+            functools.partial(QuietHandler, directory=directory)
+        )
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,231 @@
+''' This module generates synthetic SPKM repos, used by the benchmarks. '''
+
+import os
+import io
+import random
+import shutil
+import hashlib
+import tarfile
+import subprocess
+
+GROUPS = ('base', 'libs', 'devel', 'apps', 'x11', 'games')
+
+def pkg_name(i: int) -> str:
+    '''
+    Gets the name of the i-th synthetic package.
+
+    :param int i: Package number
+
+    :return: Package name
+    :rtype: str
+    '''
+
+    return f'pkg{i:05d}'
+
+def pkg_files(name: str, version: str) -> dict[str, bytes]:
+    '''
+    Gets the files shipped by a synthetic package.
+
+    :param str name: Package name
+    :param str version: Package version
+
+    :return: File contents, indexed by path
+    :rtype: dict[str, bytes]
+    '''
+
+    content = f'{name}-{version}\n'.encode()
+
+    files = {
+        f'usr/bin/{name}': content * 64,
+        f'usr/lib/lib{name}.so': content * 256,
+    }
+
+    for i in range(len(name) % 4 + 1):
+        files[f'usr/share/{name}/data{i}'] = content * 16
+
+    return files
+
+def make_archive(path: str, name: str, version: str) -> bytes:
+    '''
+    Builds the archive of a synthetic package, with its `.PKGTREE`.
+
+    :param str path: Archive path
+    :param str name: Package name
+    :param str version: Package version
+
+    :return: Archive content
+    :rtype: bytes
+    '''
+
+    files = pkg_files(name, version)
+
+    dirs = set()
+    for file in files:
+        parts = file.split('/')
+        for i in range(1, len(parts)):
+            dirs.add('/'.join(parts[:i]))
+
+    tree = [directory + '/' for directory in sorted(dirs)] + sorted(files)
+
+    buffer = io.BytesIO()
+
+    with tarfile.open(fileobj=buffer, mode='w') as archive:
+        for directory in sorted(dirs):
+            info = tarfile.TarInfo(directory)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            archive.addfile(info)
+
+        for file in sorted(files):
+            info = tarfile.TarInfo(file)
+            info.size = len(files[file])
+            info.mode = 0o644
+            archive.addfile(info, io.BytesIO(files[file]))
+
+        tree_data = ('\n'.join(tree) + '\n').encode()
+        info = tarfile.TarInfo('.PKGTREE')
+        info.size = len(tree_data)
+        archive.addfile(info, io.BytesIO(tree_data))
+
+    data = buffer.getvalue()
+
+    # Compress with zstd when available, tar detects uncompressed archives anyway
+
+    if shutil.which('zstd') is not None:
+        data = subprocess.run(['zstd', '-q', '-c'], input=data, check=True,
+                                capture_output=True).stdout
+
+    with open(path, 'wb') as archive_file:
+        archive_file.write(data)
+
+    return data
+
+def gen_deps(count: int, seed: int) -> list[list[int]]:
+    '''
+    Generates a dependency DAG with a realistic fan-out: a few dependencies per
+    package, mostly on a small set of popular low-level packages.
+
+    :param int count: Number of packages
+    :param int seed: Random seed
+
+    :return: Dependencies of each package
+    :rtype: list[list[int]]
+    '''
+
+    rand = random.Random(seed)
+    deps = []
+
+    for i in range(count):
+        pkg_deps: set[int] = set()
+
+        if i > 0:
+            fan_out = min(i, rand.choices(range(9), weights=(10, 20, 20, 15, 12, 9, 6, 5, 3))[0])
+
+            while len(pkg_deps) < fan_out:
+                pkg_deps.add(int(i * rand.random() ** 2))
+
+        deps.append(sorted(pkg_deps))
+
+    return deps
+
+def write_meta(meta_dir: str, name: str, version: str, deps: list[str], reverse_deps: list[str],
+    archive: bytes):
+    '''
+    Writes the `package.toml` and `infos.toml` files of a synthetic package.
+
+    :param str meta_dir: Package metadata directory
+    :param str name: Package name
+    :param str version: Package version
+    :param list[str] deps: Runtime dependencies
+    :param list[str] reverse_deps: Packages depending on this one
+    :param bytes archive: Archive content
+
+    :return: None
+    '''
+
+    os.makedirs(meta_dir, exist_ok=True)
+
+    with open(meta_dir + '/package.toml', 'w', encoding='utf-8') as package:
+        package.write(
+            f"name = '{name}'\n"
+            f"version = '{version}'\n"
+            'release = 1\n'
+            f"description = 'Synthetic package {name}'\n"
+            "packager = 'Benchmark'\n"
+        )
+
+    with open(meta_dir + '/infos.toml', 'w', encoding='utf-8') as infos:
+        infos.write(
+            f'size = {len(archive)}\n'
+            f"md5 = '{hashlib.md5(archive).hexdigest()}'\n"
+            f"sha256 = '{hashlib.sha256(archive).hexdigest()}'\n"
+        )
+
+        for dep in deps:
+            infos.write(f"\n[[run]]\nname = '{dep}'\n")
+
+        for reverse_dep in reverse_deps:
+            infos.write(f"\n[[reverse-deps]]\nname = '{reverse_dep}'\n")
+
+def gen_repo(path: str, repo_name: str, count: int, seed: int = 0,
+    bumped: frozenset[int] = frozenset()) -> list[list[int]]:
+    '''
+    Generates a synthetic repo in the layout served by SPKM mirrors:
+    `<group>/<pkg>/<pkg>-<version>.tar.zst` archives and a `<repo>.db` tarball
+    of `<group>/<pkg>/{package,infos}.toml` files.
+
+    :param str path: Repo directory
+    :param str repo_name: Repo name
+    :param int count: Number of packages
+    :param int seed: Random seed
+    :param frozenset[int] bumped: Packages published with a newer version
+
+    :return: Dependencies of each package
+    :rtype: list[list[int]]
+    '''
+
+    deps = gen_deps(count, seed)
+
+    reverse_deps: list[list[int]] = [[] for _ in range(count)]
+    for i, pkg_deps in enumerate(deps):
+        for dep in pkg_deps:
+            reverse_deps[dep].append(i)
+
+    meta_root = path + '/.meta'
+
+    if os.path.exists(meta_root):
+        shutil.rmtree(meta_root)
+
+    for i in range(count):
+        name = pkg_name(i)
+        group = GROUPS[i % len(GROUPS)]
+        version = '1.1' if i in bumped else '1.0'
+
+        pkg_dir = f'{path}/{group}/{name}'
+        os.makedirs(pkg_dir, exist_ok=True)
+
+        archive_path = f'{pkg_dir}/{name}-{version}.tar.zst'
+
+        if os.path.exists(archive_path):
+            with open(archive_path, 'rb') as archive_file:
+                archive = archive_file.read()
+        else:
+            archive = make_archive(archive_path, name, version)
+
+        write_meta(
+            f'{meta_root}/{group}/{name}',
+            name,
+            version,
+            [pkg_name(dep) for dep in deps[i]],
+            [pkg_name(reverse_dep) for reverse_dep in reverse_deps[i]],
+            archive
+        )
+
+    with tarfile.open(f'{path}/{repo_name}.db', 'w') as database:
+        for group in GROUPS:
+            if os.path.exists(meta_root + '/' + group):
+                database.add(meta_root + '/' + group, arcname=group)
+
+    shutil.rmtree(meta_root)
+
+    return deps
@@ -2,16 +2,44 @@
 
 ''' Main module handling arguments. '''
 
+import sys
 import argparse
 import operations
 
 from utils.config import get_config
+from utils.exceptions import DbLockedError
+from utils.lock import DbLock
+from utils.logger import LEVELS, get_logger
+
+# Operations changing the system, which hold the database lock
+
+MUTATING_OPERATIONS = ('add', 'del', 'up', 'apply', 'rollback')
 
 parser = argparse.ArgumentParser(
             prog='spkm',
             description='Stock PacKage Manager',
         )
 
+parser.add_argument(
+    '--wait',
+    type=float,
+    default=0,
+    metavar='SECONDS',
+    help='Wait for another SPKM instance to release the database (`inf` to wait forever)'
+)
+
+parser.add_argument(
+    '--output',
+    choices=('text', 'json'),
+    help='Output format, `json` writing one event per line'
+)
+
+parser.add_argument(
+    '--log-level',
+    choices=tuple(LEVELS),
+    help='Minimum level of the logged messages'
+)
+
 subparsers = parser.add_subparsers(dest='operation')
 
 add_parser = subparsers.add_parser(
@@ -38,6 +66,45 @@ up_parser = subparsers.add_parser(
     description='Upgrades your system.'
 )
 
+apply_parser = subparsers.add_parser(
+    'apply',
+    help='Brings your system to the state described by a world file.',
+    description='Brings your system to the state described by a world file, '
+                'without asking for confirmation.'
+)
+
+verify_parser = subparsers.add_parser(
+    'verify',
+    help='Checks that the installed files were not changed.',
+    description='Checks that the installed files of the given packages (all by default) '
+                'were not changed.'
+)
+
+search_parser = subparsers.add_parser(
+    'search',
+    help='Searches packages by name, description, group or packager.',
+    description='Searches packages by name, description, group or packager.'
+)
+
+outdated_parser = subparsers.add_parser(
+    'outdated',
+    help='Lists the packages having a newer version in the repos.',
+    description='Lists the installed packages having a newer version in the synced repos.'
+)
+
+graph_parser = subparsers.add_parser(
+    'graph',
+    help='Exports the dependency graph, or shows what changing the world would do.',
+    description='Exports the dependency graph of the given packages (all by default), '
+                'or shows what adding or dropping packages from the world would change.'
+)
+
+rollback_parser = subparsers.add_parser(
+    'rollback',
+    help='Reverts the last upgrade.',
+    description='Reverts the last upgrade.'
+)
+
 conf_parser = subparsers.add_parser(
     'conf',
     help='Displays your SPKM configuration.',
@@ -65,10 +132,122 @@ info_parser.add_argument(
     help='Package to display'
 )
 
+apply_parser.add_argument(
+    'world',
+    type=str,
+    help='World file to apply, `-` to read it from the standard input'
+)
+
+apply_parser.add_argument(
+    '--dry-run',
+    action='store_true',
+    help='Only display the operations'
+)
+
+up_parser.add_argument(
+    '--download-only',
+    action='store_true',
+    help='Only fetch the archives of the upgrade into the cache'
+)
+
+up_parser.add_argument(
+    '--prefetch',
+    action='store_true',
+    help='Like --download-only, with a low priority and `prefetch_bandwidth_limit`'
+)
+
+up_parser.add_argument(
+    '--roots',
+    action='store_true',
+    help='Upgrade every root of the `[[roots]]` list, sharing the repos and the cache'
+)
+
+up_parser.add_argument(
+    '--no-sync',
+    action='store_true',
+    help='Use the repos synced by the last run'
+)
+
+verify_parser.add_argument(
+    'packages',
+    type=str,
+    nargs='*',
+    help='Packages to verify'
+)
+
+search_parser.add_argument(
+    'terms',
+    type=str,
+    nargs='+',
+    help='Search terms'
+)
+
+search_parser.add_argument(
+    '--limit',
+    type=int,
+    default=20,
+    help='Maximum number of results (0 for no limit)'
+)
+
+graph_parser.add_argument(
+    'packages',
+    type=str,
+    nargs='*',
+    help='Packages whose dependencies are exported'
+)
+
+graph_parser.add_argument(
+    '--format',
+    choices=('dot', 'json'),
+    default='dot',
+    help='Export format'
+)
+
+graph_parser.add_argument(
+    '--reverse',
+    action='store_true',
+    help='Export the packages depending on the given ones'
+)
+
+graph_parser.add_argument(
+    '--add',
+    type=str,
+    nargs='+',
+    metavar='PACKAGE',
+    help='Show what adding these packages to the world would install'
+)
+
+graph_parser.add_argument(
+    '--drop',
+    type=str,
+    nargs='+',
+    metavar='PACKAGE',
+    help='Show what dropping these packages from the world would delete'
+)
 
 args = parser.parse_args()
 config = get_config()
 
+if args.output is not None:
+    config['general']['output'] = args.output
+
+if args.log_level is not None:
+    config['general']['log_level'] = args.log_level
+
+config['general']['lock_wait'] = args.wait
+
+# Downloading the archives of the next upgrade only takes the lock around the sync
+# and the plan records, not during the transfers
+
+background = args.operation == 'up' and (args.download_only or args.prefetch)
+
+if args.operation in MUTATING_OPERATIONS and not background:
+    try:
+        DbLock(config, args.wait).acquire()
+    except DbLockedError as err:
+        get_logger(config).log_err(str(err))
+        sys.exit(1)
+
 if args.operation == 'add':
     operations.add(config, args.packages)
 elif args.operation == 'del':
@@ -76,6 +255,18 @@ elif args.operation == 'del':
 elif args.operation == 'info':
     operations.info(config, args.package)
 elif args.operation == 'up':
-    operations.up(config)
+    operations.up(config, args.download_only, args.prefetch, not args.no_sync, args.roots)
+elif args.operation == 'apply':
+    operations.apply(config, args.world, args.dry_run)
+elif args.operation == 'verify':
+    operations.verify(config, args.packages)
+elif args.operation == 'search':
+    operations.search(config, args.terms, args.limit)
+elif args.operation == 'outdated':
+    operations.outdated(config)
+elif args.operation == 'graph':
+    operations.graph(config, args.packages, args.format, args.reverse, args.add, args.drop)
+elif args.operation == 'rollback':
+    operations.rollback(config)
 elif args.operation == 'conf':
     operations.display_config(config)
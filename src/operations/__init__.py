@@ -5,3 +5,9 @@ from .delete import *
 from .info import *
 from .up import *
 from .config import *
+from .rollback import *
+from .search import *
+from .apply import *
+from .verify import *
+from .outdated import *
+from .graph import *
@@ -4,7 +4,7 @@ import tomllib
 import os
 import sys
 
-from utils.logger import Logger
+from utils.logger import get_logger
 from utils.db import get_pkg_data, write_index_data
 
 def add(config: dict, pkgs: list[str]):
@@ -16,7 +16,7 @@ def add(config: dict, pkgs: list[str]):
     :return: None
     '''
 
-    logger = Logger(config)
+    logger = get_logger(config)
 
     not_found_pkgs = []
     to_add = []
@@ -26,7 +26,7 @@ def add(config: dict, pkgs: list[str]):
 
         if pkg_data is False:
             not_found_pkgs.append(pkg)
-        elif isinstance(pkg_data, dict):
+        else:
             to_add.append(pkg_data)
 
     if len(not_found_pkgs) > 0:
@@ -45,9 +45,9 @@ def add(config: dict, pkgs: list[str]):
         world_data = tomllib.load(world)
 
     for pkg_data in to_add:
-        world_data[pkg_data['pkg_info']['name']] = {
-            'version': pkg_data['pkg_info']['version'],
-            'release': pkg_data['pkg_info']['release']
+        world_data[pkg_data.name] = {
+            'version': pkg_data.version,
+            'release': pkg_data.release
         }
 
     write_index_data(world_data, config['general']['dbpath'] + '/world.new')
@@ -0,0 +1,92 @@
+''' This module is a simple function running the "apply" operation. '''
+
+import os
+import sys
+import tomllib
+
+from operations.upgrade import apply_ops, get_ops, has_ops, log_ops, sync_repos
+from utils.logger import get_logger
+from utils.db import get_pkg_data, save_seen_versions, write_index_data
+
+def read_world_file(path: str) -> dict:
+    '''Reads a world file, from the standard input if the path is `-`.
+
+    :param str path: World file path
+
+    :return: World data
+    :rtype: dict
+    '''
+
+    if path == '-':
+        return tomllib.loads(sys.stdin.read())
+
+    with open(path, 'rb') as world:
+        return tomllib.load(world)
+
+def apply(config: dict, world_path: str, dry_run: bool = False):
+    '''
+    Brings the system to the state described by a world file, in a single transaction.
+
+    :param dict config: SPKM Configuration
+    :param str world_path: World file path, `-` for the standard input
+    :param bool dry_run: Should the operations only be displayed?
+
+    :return: None
+    '''
+
+    logger = get_logger(config)
+
+    try:
+        desired = read_world_file(world_path)
+    except (OSError, tomllib.TOMLDecodeError) as err:
+        logger.log_err(f'Could not read the world file: {err}')
+        sys.exit(1)
+
+    sync_repos(config, logger)
+
+    # Resolve every package at once, the world versions are the repo ones
+
+    world_data = {}
+    not_found_pkgs = []
+
+    for pkg in desired:
+        pkg_data = get_pkg_data(config, pkg)
+
+        if pkg_data is False:
+            not_found_pkgs.append(pkg)
+        else:
+            world_data[pkg] = {
+                'version': pkg_data.version,
+                'release': pkg_data.release
+            }
+
+    if len(not_found_pkgs) > 0:
+        logger.log_err('The following package(s) were not found:')
+        for pkg in not_found_pkgs:
+            logger.log_err(pkg, err_content=True)
+
+        sys.exit(1)
+
+    ops, local_data = get_ops(config, world_data)
+
+    if not has_ops(ops):
+        logger.log_event('plan', 'No change to apply.')
+
+        if not dry_run:
+            write_index_data(world_data, config['general']['dbpath'] + '/world')
+
+            if os.path.exists(config['general']['dbpath'] + '/world.new'):
+                os.remove(config['general']['dbpath'] + '/world.new')
+
+            save_seen_versions(config)
+
+        return
+
+    log_ops(logger, ops)
+
+    if dry_run:
+        return
+
+    apply_ops(config, logger, ops, local_data, world_data)
+
+    logger.log_success('The world file was successfully applied !')
@@ -2,7 +2,7 @@
 
 import os
 
-from utils.logger import Logger
+from utils.logger import get_logger
 
 def display_config(config: dict):
     '''
@@ -13,7 +13,7 @@ def display_config(config: dict):
     :return: None
     '''
 
-    logger = Logger(config)
+    logger = get_logger(config)
 
     logger.log_header('Configuration')
     with open(os.environ['SPKM_CONF'], 'r', encoding='utf-8') as conf:
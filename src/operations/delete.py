@@ -4,7 +4,7 @@ import tomllib
 import os
 import sys
 
-from utils.logger import Logger
+from utils.logger import get_logger
 from utils.db import write_index_data
 
 def delete(config: dict, pkgs: list[str]):
@@ -25,7 +25,7 @@ def delete(config: dict, pkgs: list[str]):
     with open(world_path, 'rb') as world:
         world_data = tomllib.load(world)
 
-    logger = Logger(config)
+    logger = get_logger(config)
 
     to_delete = []
     not_installed_pkgs = []
@@ -0,0 +1,97 @@
+''' This module is a simple function running the "graph" operation. '''
+
+import os
+import json
+import tomllib
+
+from utils.db import get_graph
+from utils.graph import DepGraph, what_if
+from utils.logger import Logger, get_logger
+
+def export_graph(logger: Logger, dep_graph: DepGraph, names: list[str], output_format: str):
+    '''Writes a part of the dependency graph. With the `json` output, it is a single
+    `graph` event whatever the format.
+
+    :param Logger logger: SPKM Logger
+    :param DepGraph dep_graph: Dependency graph
+    :param list[str] names: Packages to export
+    :param str output_format: Either `dot` or `json`
+
+    :return: None
+    '''
+
+    exported = set(names)
+    edges = [
+        (name, dep) for name in names for dep in dep_graph.get_deps(name) if dep in exported
+    ]
+
+    if logger.json:
+        logger.log_event('graph', nodes=names, edges=edges)
+        return
+
+    if output_format == 'json':
+        logger.write(json.dumps({'nodes': names, 'edges': edges}, indent=2) + '\n')
+        return
+
+    logger.write('digraph spkm {\n')
+
+    for name in names:
+        logger.write(f'    "{name}";\n')
+
+    for name, dep in edges:
+        logger.write(f'    "{name}" -> "{dep}";\n')
+
+    logger.write('}\n')
+
+def graph(config: dict, pkgs: list[str], output_format: str = 'dot', reverse: bool = False,
+    adds: list[str] | None = None, drops: list[str] | None = None):
+    '''Exports the dependency graph, or displays what adding or dropping packages
+    from the world would change.
+
+    :param dict config: SPKM Configuration
+    :param list[str] pkgs: Packages whose dependencies are exported (all by default)
+    :param str output_format: Either `dot` or `json`
+    :param bool reverse: Export the packages depending on the given ones instead?
+    :param list[str] adds: Packages to add to the world
+    :param list[str] drops: Packages to drop from the world
+
+    :return: None
+    '''
+
+    logger = get_logger(config)
+    dep_graph = get_graph(config)
+
+    if adds is None and drops is None:
+        names = dep_graph.get_closure(pkgs, reverse) if len(pkgs) > 0 else dep_graph.get_names()
+        export_graph(logger, dep_graph, names, output_format)
+        return
+
+    dbpath = config['general']['dbpath']
+    world_path = dbpath + '/world'
+
+    if os.path.exists(dbpath + '/world.new'):
+        world_path = dbpath + '/world.new'
+
+    with open(dbpath + '/local', 'rb') as local, open(world_path, 'rb') as world:
+        local_data = tomllib.load(local)
+        world_data = tomllib.load(world)
+
+    with logger.timed('what-if'):
+        changes = what_if(dep_graph, local_data, world_data, adds or [], drops or [])
+
+    if len(changes['missing']) > 0:
+        logger.log_err('The following package(s) were not found:')
+        for pkg in changes['missing']:
+            logger.log_err(pkg, err_content=True)
+
+    if len(changes['add']) == 0 and len(changes['del']) == 0:
+        logger.log_event('plan', 'No change to apply.')
+        return
+
+    logger.log_header('What if')
+
+    for pkg in changes['del']:
+        logger.log_del(pkg)
+
+    for pkg in changes['add']:
+        logger.log_add(pkg)
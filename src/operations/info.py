@@ -1,7 +1,7 @@
 ''' This module is a simple function running the "delete" operation. '''
 
 from utils.db import get_pkg_data, is_pkg_installed
-from utils.logger import Logger
+from utils.logger import get_logger
 
 def info(config: dict, pkg: str):
     '''Displays information about a given package.
@@ -12,30 +12,38 @@ def info(config: dict, pkg: str):
     :return: None
     '''
 
-    logger = Logger(config)
+    logger = get_logger(config)
 
     pkg_data = get_pkg_data(config, pkg)
 
-    if isinstance(pkg_data, dict):
-        pkg_info = pkg_data['pkg_info']
-
-        logger.log_header('Package info')
-
+    if pkg_data is not False:
         pkg_ver = is_pkg_installed(config, pkg)
 
-        print('name:', pkg_info['name'])
-        print('version:', pkg_info['version'], (f'({pkg_ver} installed)' if pkg_ver else ''))
-        print('description:', pkg_info['description'])
-        print('packager:', pkg_info['packager'])
+        if logger.json:
+            logger.log_event(
+                'package',
+                name=pkg_data.name,
+                version=pkg_data.version,
+                installed=pkg_ver if pkg_ver else None,
+                description=pkg_data.description,
+                packager=pkg_data.packager,
+                dependencies=list(pkg_data.dependencies),
+                group=pkg_data.group
+            )
+            return
+
+        logger.log_header('Package info')
 
-        deps_names = []
-        if 'dependencies' in pkg_info:
-            for dep in pkg_info['dependencies']:
-                deps_names.append(dep['name'])
+        logger.write(f'name: {pkg_data.name}\n')
+        logger.write(
+            f'version: {pkg_data.version} ' + (f'({pkg_ver} installed)' if pkg_ver else '') + '\n'
+        )
+        logger.write(f'description: {pkg_data.description}\n')
+        logger.write(f'packager: {pkg_data.packager}\n')
 
-        if len(deps_names) > 0:
-            print('dependencies:', ','.join(deps_names))
+        if len(pkg_data.dependencies) > 0:
+            logger.write('dependencies: ' + ','.join(pkg_data.dependencies) + '\n')
 
-        print('group:', pkg_data['group'])
+        logger.write(f'group: {pkg_data.group}\n')
     else:
         logger.log_err('Package not found.')
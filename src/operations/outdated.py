@@ -0,0 +1,43 @@
+''' This module is a simple function running the "outdated" operation. '''
+
+import tomllib
+
+from utils.db import get_newer_pkgs
+from utils.logger import get_logger
+from utils.version import version_key
+
+def outdated(config: dict):
+    '''Displays the installed packages having a newer version in the synced repos.
+
+    :param dict config: SPKM Configuration
+
+    :return: None
+    '''
+
+    logger = get_logger(config)
+
+    with open(config['general']['dbpath'] + '/local', 'rb') as local:
+        local_data = tomllib.load(local)
+
+    newer = get_newer_pkgs(
+        config,
+        {pkg: version_key(data['version'], data['release']) for pkg, data in local_data.items()}
+    )
+
+    for pkg in sorted(newer):
+        installed = f'{local_data[pkg]["version"]}-{local_data[pkg]["release"]}'
+        available = f'{newer[pkg]["version"]}-{newer[pkg]["release"]}'
+
+        if logger.json:
+            logger.log_event(
+                'outdated',
+                name=pkg,
+                installed=installed,
+                available=available,
+                repo=newer[pkg]['repo']
+            )
+        else:
+            logger.write(f'{pkg} {installed} => {available}\n')
+
+    if len(newer) == 0:
+        logger.log_event('outdated', 'All the packages are up to date.')
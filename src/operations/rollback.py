@@ -0,0 +1,45 @@
+''' This module is a simple function running the "rollback" operation. '''
+
+from utils.logger import get_logger
+from utils.transaction import Transaction
+from utils.triggers import run_rollback_triggers
+
+def rollback(config: dict):
+    '''
+    Reverts the last transaction.
+
+    :param dict config: SPKM Configuration
+
+    :return: None
+    '''
+
+    logger = get_logger(config)
+
+    transaction = Transaction.load(config)
+
+    if transaction is False or transaction.is_reverted():
+        logger.log_err('There is no transaction to revert.')
+        return
+
+    logger.log_header('Rollback Summary')
+
+    for entry in transaction.entries:
+        if entry['action'] == 'add':
+            logger.log_del(entry['name'])
+        elif entry['action'] == 'del':
+            logger.log_add(entry['name'])
+        elif entry['action'] == 'up':
+            logger.log_up(entry['name'])
+
+    logger.newline()
+
+    if not logger.confirm('Do you really want to revert these changes ?'):
+        return
+
+    with logger.timed('rollback', entries=len(transaction.entries)):
+        files = transaction.rollback()
+
+    logger.log_success('The last transaction was successfully reverted !')
+
+    if run_rollback_triggers(config, logger, files) > 0:
+        logger.log_err('Some triggers failed, the transaction was reverted anyway.')
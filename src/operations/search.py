@@ -0,0 +1,44 @@
+''' This module is a simple function running the "search" operation. '''
+
+from utils.db import get_repo_index
+from utils.logger import get_logger
+from utils.search import search as search_pkgs
+
+def search(config: dict, terms: list[str], limit: int = 20):
+    '''
+    Searches packages by name, description, group and packager. With the `json` output,
+    every result is written as a JSON event.
+
+    :param dict config: SPKM Configuration
+    :param list[str] terms: Search terms
+    :param int limit: Maximum number of results (0 for no limit)
+
+    :return: None
+    '''
+
+    logger = get_logger(config)
+
+    # Makes sure the search indexes of repos synced by older versions exist
+
+    for repo in config['repos']:
+        get_repo_index(config, repo)
+
+    results = search_pkgs(config, terms, limit=limit)
+
+    if logger.json:
+        for result in results:
+            logger.log_event('result', **result)
+
+        return
+
+    if len(results) == 0:
+        logger.log_err('No package found.')
+        return
+
+    logger.log_header('Search results')
+
+    for result in results:
+        logger.write(f'{result["repo"]}/{result["name"]} {result["version"]} ({result["group"]})\n')
+
+        if result['description'] != '':
+            logger.write('    ' + result['description'] + '\n')
@@ -1,14 +1,69 @@
 ''' This module is a simple function running the "up" operation. '''
 
-from operations.upgrade import upgrade_local
+import os
+import sys
+import shutil
+import subprocess
 
-def up(config: dict):
+from operations.upgrade import prefetch_pkgs, upgrade_local, upgrade_roots
+from utils.exceptions import DbLockedError, PkgDownloadError
+from utils.logger import get_logger
+
+def lower_priority():
+    '''
+    Lowers the CPU and I/O priorities of the process, so that a background prefetch
+    does not slow the system down.
+
+    :return: None
+    '''
+
+    os.nice(19)
+
+    if hasattr(os, 'SCHED_IDLE'):
+        try:
+            os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+        except OSError:
+            pass
+
+    if shutil.which('ionice') is not None:
+        subprocess.call(
+            ['ionice', '-c', '3', '-p', str(os.getpid())],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+def up(config: dict, download_only: bool = False, prefetch: bool = False, sync: bool = True,
+    roots: bool = False):
     '''
     Updates the system with the new changes in `world.new`.
 
     :param dict config: SPKM Configuration
+    :param bool download_only: Should the archives only be fetched?
+    :param bool prefetch: Should the archives only be fetched in the background?
+    :param bool sync: Do we have to sync the repos first?
+    :param bool roots: Should the roots of the `[[roots]]` list be upgraded instead?
 
     :return: None
     '''
 
-    upgrade_local(config)
+    if prefetch:
+        lower_priority()
+
+        if 'prefetch_bandwidth_limit' in config['general']:
+            config['general']['bandwidth_limit'] = config['general']['prefetch_bandwidth_limit']
+
+    try:
+        if roots:
+            upgrade_roots(config, sync, download_only or prefetch)
+            return
+
+        if download_only or prefetch:
+            if prefetch_pkgs(config, sync) != 0:
+                raise PkgDownloadError
+
+            return
+    except DbLockedError as err:
+        get_logger(config).log_err(str(err))
+        sys.exit(1)
+
+    upgrade_local(config, sync)
@@ -1,15 +1,33 @@
 ''' This module is the core of SPKM, handling all updates to `world` file. '''
 
 import os
+import time
 import shutil
+import asyncio
 import tomllib
-import multiprocessing
-import copy
 
-from utils.download import download
-from utils.logger import Logger
-from utils.exceptions import PkgNotFoundException, PkgDownloadError, PkgExtractionError
-from utils.db import get_pkg_data, write_index_data
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing.pool import ThreadPool
+
+from utils.mirrors import fetch
+from utils.config import get_shared_dbpath
+from utils.logger import Logger, get_logger
+from utils.exceptions import (DbLockedError, PkgNotFoundException, PkgDownloadError,
+                                PkgExtractionError, TransactionPendingError)
+from utils.lock import DbLock
+from utils.db import (build_repo_index, get_graph, get_pkg_data, get_repo_index,
+                        load_seen_versions, save_seen_versions, write_index_data)
+from utils.aio import IOScheduler
+from utils.checksum import DigestCache, get_pkg_digest
+from utils.delta import apply_delta, get_delta, get_delta_filename
+from utils.download import ProgressGroup
+from utils.files import is_dir, link_file, move_file, prune_dirs, read_tree, replace_file
+from utils.transaction import Transaction
+from utils.triggers import get_transaction_files, run_rollback_triggers, run_triggers
+from utils.version import version_key
+from utils.verify import MANIFEST, write_manifest
+from utils.plan import drop_plan, get_cached_ops, get_fingerprint, save_plan
+from utils.package import Package
 
 def get_adds(config: dict, local_data: dict, world_data: dict) -> list:
     '''
@@ -23,15 +41,26 @@ def get_adds(config: dict, local_data: dict, world_data: dict) -> list:
     :rtype: list
     '''
 
-    adds = []
+    adds: dict[str, Package] = {}
+    graph = get_graph(config)
+
+    # Only the packages which are not installed yet are loaded
 
     for package in world_data:
         if package not in local_data:
-            for dep in solve_pkg_deps(config, package):
-                if dep not in adds and dep['pkg_info']['name'] not in local_data:
-                    adds.append(dep)
+            if package not in graph:
+                raise PkgNotFoundException
+
+            for dep in graph.get_deps(package) + [package]:
+                if dep not in local_data and dep not in adds:
+                    dep_data = get_pkg_data(config, dep)
+
+                    if dep_data is False:
+                        raise PkgNotFoundException
+
+                    adds[dep] = dep_data
 
-    return adds
+    return list(adds.values())
 
 def get_dels(config: dict, local_data: dict, world_data: dict) -> list:
     '''
@@ -46,32 +75,87 @@ def get_dels(config: dict, local_data: dict, world_data: dict) -> list:
     '''
 
     dels = []
+    graph = get_graph(config)
 
-    for package in local_data:
-        pkg_data = get_pkg_data(config, package)
-
-        if pkg_data is False:
-            raise PkgNotFoundException
+    # Only the packages which are deleted are loaded
 
+    for package in local_data:
         if package not in world_data:
-            can_del = True
+            if package not in graph:
+                raise PkgNotFoundException
 
-            if 'reverse-deps' in pkg_data['pkg_info']:
-                for reverse_dep in pkg_data['pkg_info']['reverse-deps']:
-                    if reverse_dep['name'] in world_data:
-                        can_del = False
+            reverse_deps = graph.get_reverse_deps(package)
 
-            if can_del:
-                data = {'name': package}
-                data.update(local_data[package])
+            if not any(reverse_dep in world_data for reverse_dep in reverse_deps):
+                pkg_data = get_pkg_data(config, package)
 
-                dels.append(data)
+                if pkg_data is False:
+                    raise PkgNotFoundException
+
+                dels.append(
+                    pkg_data.with_version(
+                        local_data[package]['version'],
+                        local_data[package]['release']
+                    )
+                )
 
     return dels
 
+def get_changed_pkgs(config: dict, local_data: dict) -> list[str]:
+    '''
+    Gets the installed packages whose repo entry changed since the last upgrade.
+
+    :param dict config: SPKM Configuration
+    :param dict local_data: `local` index file data
+
+    :return: Package names
+    :rtype: list[str]
+    '''
+
+    seen = load_seen_versions(config)
+    changed = []
+    found = set()
+
+    # Packages kept newer than in the repos are only seen again when downgrades are allowed
+
+    allow_downgrade = config['general'].get('allow_downgrade', False)
+
+    for repo in config['repos']:
+        index = get_repo_index(config, repo)
+        repo_seen = seen.get(repo['name'], {})
+
+        # Join the repo index with the local index, starting from the smallest one
+
+        if len(local_data) < len(index):
+            names = [package for package in local_data if package in index]
+        else:
+            names = [package for package in index if package in local_data]
+
+        for package in names:
+            if package in found:
+                continue
+
+            found.add(package)
+
+            entry = index[package]
+            version = entry['version'] + '-' + entry['release']
+
+            if repo_seen.get(package) != version or (
+                    allow_downgrade and version != (
+                        local_data[package]['version'] + '-' + str(local_data[package]['release'])
+                    )
+                ):
+                changed.append(package)
+
+    if len(found) != len(local_data):
+        raise PkgNotFoundException
+
+    return changed
+
 def get_ups(config: dict, local_data: dict, dels: list) -> tuple:
     '''
-    Gets incoming updates.
+    Gets incoming updates. Packages are only downgraded when `allow_downgrade` is set,
+    for example after a repo rollback.
 
     :param dict config: SPKM Configuration
     :param dict local_data: `local` index file data
@@ -84,41 +168,51 @@ def get_ups(config: dict, local_data: dict, dels: list) -> tuple:
     new_adds = []
     ups = []
 
-    for package in local_data:
+    del_names = {deletion.name for deletion in dels}
+
+    for package in get_changed_pkgs(config, local_data):
+        if package in del_names:
+            continue
+
         pkg_data = get_pkg_data(config, package)
 
         if pkg_data is False:
             raise PkgNotFoundException
 
-        del_data = {
-            'name': package
-        }
-        del_data.update(local_data[package])
-
-        if (del_data not in dels
-                and local_data[package]['version'] != pkg_data['pkg_info']['version']
-                or local_data[package]['release'] != pkg_data['pkg_info']['release']):
-            for dep in solve_pkg_deps(config, package):
-                if dep['pkg_info']['name'] not in local_data:
-                    new_adds.append(dep)
-
-            old_pkg_data = copy.deepcopy(pkg_data)
-            old_pkg_data['pkg_info']['version'] = local_data[package]['version']
-            old_pkg_data['pkg_info']['release'] = local_data[package]['release']
-
-            ups.append(
-                (
-                    old_pkg_data,
-                    pkg_data
-                )
+        local_key = version_key(local_data[package]['version'], local_data[package]['release'])
+
+        if pkg_data.key == local_key:
+            continue
+
+        if pkg_data.key < local_key and not config['general'].get('allow_downgrade', False):
+            get_logger(config).log_warning(
+                f'Package `{package}` is newer than in the repos '
+                f'({local_data[package]["version"]}-{local_data[package]["release"]} > '
+                f'{pkg_data.version}-{pkg_data.release}), it is kept.'
+            )
+            continue
+
+        for dep in solve_pkg_deps(config, package):
+            if dep.name not in local_data:
+                new_adds.append(dep)
+
+        ups.append(
+            (
+                pkg_data.with_version(
+                    local_data[package]['version'],
+                    local_data[package]['release']
+                ),
+                pkg_data
             )
+        )
 
     return new_adds, ups
 
-def get_ops(config: dict) -> tuple:
+def get_ops(config: dict, world_data: dict | None = None) -> tuple:
     '''Gets incoming operations based on the comparison between the local index and the world.
 
     :param dict config: SPKM Configuration.
+    :param dict world_data: Desired world, `world.new` (or `world`) if not given
 
     :return: Incoming operations and local index data.
     :rtype: tuple
@@ -129,10 +223,13 @@ def get_ops(config: dict) -> tuple:
     with open(config['general']['dbpath'] + '/local', 'rb') as local:
         local_data = tomllib.load(local)
 
-    if not os.path.exists(config['general']['dbpath'] + '/world.new'):
-        world_data = {}
-    else:
-        with open(config['general']['dbpath'] + '/world.new', 'rb') as world:
+    if world_data is None:
+        world_path = config['general']['dbpath'] + '/world'
+
+        if os.path.exists(config['general']['dbpath'] + '/world.new'):
+            world_path = config['general']['dbpath'] + '/world.new'
+
+        with open(world_path, 'rb') as world:
             world_data = tomllib.load(world)
 
     ops['adds'].extend(get_adds(config, local_data, world_data))
@@ -140,19 +237,19 @@ def get_ops(config: dict) -> tuple:
     ops['dels'] = get_dels(config, local_data, world_data)
 
     new_adds, ups = get_ups(config, local_data, ops['dels'])
-    ops['adds'].extend(new_adds)
+    ops['adds'] = list({add.name: add for add in ops['adds'] + new_adds}.values())
     ops['up'] = ups
 
     return ops, local_data
 
-def solve_pkg_deps(config: dict, pkg: str) -> list[dict]:
+def solve_pkg_deps(config: dict, pkg: str) -> list[Package]:
     '''Finds the dependency tree of a given package.
 
     :param dict config: SPKM Configuration
     :param str pkg: Package name
 
     :return: Package list
-    :rtype: list[dict]
+    :rtype: list[Package]
     '''
 
     pkg_adds = []
@@ -162,15 +259,14 @@ def solve_pkg_deps(config: dict, pkg: str) -> list[dict]:
 
     if pkg_data is False:
         not_found_pkgs.append(pkg)
-    elif isinstance(pkg_data, dict):
-        if 'dependencies' in pkg_data['pkg_info']:
-            for dep in pkg_data['pkg_info']['dependencies']:
-                dep_data = get_pkg_data(config, dep['name'])
+    else:
+        for dep in pkg_data.dependencies:
+            dep_data = get_pkg_data(config, dep)
 
-                if dep_data is False:
-                    not_found_pkgs.append(dep['name'])
-                elif isinstance(dep_data, dict):
-                    pkg_adds.append(dep_data)
+            if dep_data is False:
+                not_found_pkgs.append(dep)
+            else:
+                pkg_adds.append(dep_data)
 
         pkg_adds.append(pkg_data)
 
@@ -179,383 +275,1370 @@ def solve_pkg_deps(config: dict, pkg: str) -> list[dict]:
 
     return pkg_adds
 
-extracted_pkgs: list = []
-fails: list = []
+def get_staging_dir(config: dict, pkg_name: str) -> str:
+    '''Gets the staging directory of a package, on the same filesystem as the root.
 
-def extract_pkg_archive(config: dict, archive: str, pkg_data: dict, logger: Logger,
-    log: bool = True):
-    '''Extracts a package archive into the root directory.
+    :param dict config: SPKM Configuration
+    :param str pkg_name: Package name
+
+    :return: Staging directory
+    :rtype: str
+    '''
+
+    return config['general']['root'] + '/.spkm-staging/' + pkg_name
+
+def stage_pkg_archive(config: dict, archive: str, pkg_name: str):
+    '''Extracts a package archive into its staging directory.
 
     :param dict config: SPKM Configuration
     :param str archive: Archive path
-    :param dict pkg_data: Package data
-    :param Logger logger: SPKM Logger
-    :param bool log: Do we have to log infos?
+    :param str pkg_name: Package name
 
     :return: None
     '''
 
-    root = config['general']['root']
-    os.makedirs(root, exist_ok=True)
+    staging_dir = get_staging_dir(config, pkg_name)
+
+    if os.path.exists(staging_dir):
+        shutil.rmtree(staging_dir)
+
+    os.makedirs(staging_dir)
+
+    ret_code = os.system(f'tar -xpf {archive} -C {staging_dir}')
+
+    if ret_code != 0 or not os.path.exists(staging_dir + '/.PKGTREE'):
+        raise PkgExtractionError
+
+    # Record the files as extracted, to verify them later
+
+    with open(staging_dir + '/.PKGTREE', 'r', encoding='utf-8') as tree:
+        write_manifest(staging_dir, [line.strip() for line in tree if line.strip() != ''])
+
+def find_conflicts(config: dict, staged: dict[str, list[str]]) -> list[tuple[str, str, str]]:
+    '''Finds the staged files which are already owned by another package. The installed
+    versions of the staged packages are about to be replaced, so they own nothing.
+
+    :param dict config: SPKM Configuration
+    :param dict staged: Staged files, indexed by package name
+
+    :return: (file, package, owner) tuples
+    :rtype: list[tuple[str, str, str]]
+    '''
+
+    owners = {}
+    trees_dir = config['general']['dbpath'] + '/trees/'
+
+    for tree in os.listdir(trees_dir):
+        if tree.endswith('.tree') and tree[:-len('.tree')] not in staged:
+            for file in read_tree(config, tree[:-len('.tree')]):
+                owners[file.rstrip('/')] = tree[:-len('.tree')]
+
+    conflicts = []
+
+    for pkg_name, files in staged.items():
+        staging_dir = get_staging_dir(config, pkg_name)
+
+        for file in files:
+            if is_dir(staging_dir + '/' + file):
+                continue
+
+            owner = owners.setdefault(file.rstrip('/'), pkg_name)
+
+            if owner != pkg_name:
+                conflicts.append((file, pkg_name, owner))
+
+    return conflicts
 
-    ret_code = os.system(f'tar -xhpf {archive} -C {root}')
+def commit_pkg_archive(config: dict, pkg_name: str, files: list[str]):
+    '''Moves the staged files of a package into the root directory.
 
-    pkg_name = pkg_data['pkg_info']['name']
+    :param dict config: SPKM Configuration
+    :param str pkg_name: Package name
+    :param list[str] files: Staged files
+
+    :return: None
+    '''
 
-    shutil.move(
-        root +
-        '/' + 
-        '.PKGTREE',
+    root = config['general']['root']
+    staging_dir = get_staging_dir(config, pkg_name)
+
+    # The tree is moved first, so that a rollback finds the files moved before an error
 
-        config['general']['dbpath'] +
-        '/trees/' +
-        pkg_name +
-        '.tree'
+    move_file(
+        staging_dir + '/' + MANIFEST,
+        config['general']['dbpath'] + '/trees/' + pkg_name + '.hashes'
     )
 
-    if ret_code != 0:
-        raise PkgExtractionError
+    move_file(
+        staging_dir + '/.PKGTREE',
+        config['general']['dbpath'] + '/trees/' + pkg_name + '.tree'
+    )
+
+    for file in files:
+        file = file.rstrip('/')
+        staged_path = staging_dir + '/' + file
+
+        if is_dir(staged_path):
+            if not os.path.isdir(root + '/' + file):
+                os.makedirs(root + '/' + file, exist_ok=True)
+                shutil.copymode(staged_path, root + '/' + file)
+            continue
+
+        # Directories of the root may be mount points of other filesystems
+
+        os.makedirs(os.path.dirname(root + '/' + file), exist_ok=True)
+        replace_file(staged_path, root + '/' + file)
+
+    shutil.rmtree(staging_dir)
+
+def stage_pkg_archives(config: dict, logger: Logger,
+    archives: list[tuple[str, str]]) -> tuple[int, dict[str, list[str]]]:
+    '''Extracts package archives into staging directories and checks them for conflicts
+    with the installed packages. The root directory is left untouched.
 
-    if log:
-        logger.log_success(f'Package `{pkg_name}` was successfully added !')
+    Archives are extracted by a process pool. The staging directories are removed by
+    `clear_staging`.
 
-def exec_processes(threads: int, processes: list) -> int:
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM Logger
+    :param list archives: (package name, archive path) tuples
+
+    :return: Status and staged files, indexed by package name
+    :rtype: tuple[int, dict[str, list[str]]]
+    '''
+
+    os.makedirs(config['general']['root'] + '/.spkm-staging', exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=max(config['general']['threads'], 1)) as pool:
+        futures = [
+            pool.submit(stage_pkg_archive, config, archive, pkg_name)
+            for pkg_name, archive in archives
+        ]
+
+        if not all(future.exception() is None for future in futures):
+            return 1, {}
+
+    staged = {}
+
+    for pkg_name, _ in archives:
+        with open(get_staging_dir(config, pkg_name) + '/.PKGTREE', 'r', encoding='utf-8') as tree:
+            staged[pkg_name] = [line.strip() for line in tree if line.strip() != '']
+
+    conflicts = find_conflicts(config, staged)
+
+    if len(conflicts) > 0:
+        logger.log_err('The following file(s) would be overwritten:')
+        for file, pkg_name, owner in conflicts:
+            logger.log_err(f'{file} ({pkg_name}, owned by {owner})', err_content=True)
+
+        return 1, {}
+
+    return 0, staged
+
+def commit_pkg_archives(config: dict, logger: Logger, staged: dict[str, list[str]],
+    log: bool = True):
+    '''Moves the staged files of packages into the root directory.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM Logger
+    :param dict staged: Staged files, indexed by package name
+    :param bool log: Do we have to log infos?
+
+    :return: None
+    '''
+
+    for pkg_name, files in staged.items():
+        commit_pkg_archive(config, pkg_name, files)
+
+        if log:
+            logger.log_success(f'Package `{pkg_name}` was successfully added !')
+
+def clear_staging(config: dict):
+    '''Removes the staging directories.
+
+    :param dict config: SPKM Configuration
+
+    :return: None
     '''
-    Starts each process of the given list.
 
-    :param int threads: Number of threads
-    :param list processes: List of processes to start
+    shutil.rmtree(config['general']['root'] + '/.spkm-staging', ignore_errors=True)
+
+def extract_pkg_archives(config: dict, logger: Logger, archives: list[tuple[str, str]],
+    log: bool = True) -> int:
+    '''Extracts package archives into the root directory: they are all staged first
+    (see `stage_pkg_archives`), then renamed into place.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM Logger
+    :param list archives: (package name, archive path) tuples
+    :param bool log: Do we have to log infos?
 
     :return: Status
     :rtype: int
     '''
 
-    for i in range(len(processes)):
-        if (i + 1) % threads == 0:
-            i_start = i - threads + 1
-            i_end = i + 1
-        elif i + 1 == len(processes):
-            i_start = i - ((i + 1) % threads) + 1
-            i_end = len(processes)
-        else:
-            continue
+    try:
+        status, staged = stage_pkg_archives(config, logger, archives)
 
-        for process in processes[i_start:i_end]:
-            process.start()
+        if status == 0:
+            commit_pkg_archives(config, logger, staged, log)
+    finally:
+        clear_staging(config)
 
-        for process in processes[i_start:i_end]:
-            process.join()
+    return status
 
-    for process in processes:
-        if process.exitcode != 0:
-            return 1
+def get_cache_path(config: dict, pkg: Package) -> str:
+    '''Gets the path of a package archive in the cache. Unlike the archives of the repos,
+    it includes the release, so that a release update does not reuse the previous archive.
 
-    return 0
+    :param dict config: SPKM Configuration
+    :param Package pkg: Package record
 
-def add_pkg(config: dict, logger: Logger, local_data: dict, adds: list, log: bool = True):
-    '''Adds a package (and its dependencies) to the system.
+    :return: Archive path in the cache
+    :rtype: str
+    '''
+
+    return (config['general']['cache'] + '/' + pkg.repo['name'] + '/' + pkg.group + '/' +
+            pkg.name + '/' + pkg.name + '-' + pkg.version + '-' + str(pkg.release) + '.tar.zst')
+
+def fetch_pkg_delta(config: dict, logger: Logger, digests: DigestCache, add: Package,
+    old: Package, dest_path: str, render: bool = True, group: ProgressGroup | None = None) -> bool:
+    '''Rebuilds a package archive from the cached previous one and a delta.
 
     :param dict config: SPKM Configuration
     :param Logger logger: SPKM logger
-    :param dict local_data: local index data
-    :param list adds: List of packages to add
-    :param bool log: Do we have to log infos?
+    :param DigestCache digests: Digest cache
+    :param Package add: Package record
+    :param Package old: Installed package record
+    :param str dest_path: Archive path in the cache
+    :param bool render: Should the progress bar be rendered on a terminal?
+    :param ProgressGroup group: Progress of the concurrent downloads, rendered instead
+
+    :return: Was the archive rebuilt and verified?
+    :rtype: bool
     '''
 
-    extract_processes = []
+    pkg_name = add.name
+    old_version = old.version
 
-    for add in adds:
-        # Get the useful package infos
+    delta = get_delta(add, old)
 
-        pkg_name = add['pkg_info']['name']
-        pkg_version = add['pkg_info']['version']
-        pkg_release = add['pkg_info']['release']
+    old_path = get_cache_path(config, old)
 
-        filename = (add['group'] +
-                    '/' +
-                    add['pkg_info']['name'] +
-                    '/' +
-                    add['pkg_info']['name'] +
-                    '-' +
-                    add['pkg_info']['version'] +
-                    '.tar.zst')
+    if delta is False or not os.path.exists(old_path):
+        return False
 
-        src_path = add['repo']['url'] + '/' + filename
-        dest_path = config['general']['cache']  + '/' + add['repo']['name'] + '/' + filename
+    delta_filename = get_delta_filename(add, old_version)
+    delta_path = dest_path + '.delta'
 
-        if log:
-            logger.log_info(f'Adding package `{pkg_name}`...')
+    delta_digest = get_pkg_digest(delta)
+    delta_algo, delta_expected = delta_digest if delta_digest else ('md5', '')
 
-        # Create the cache directory as it can be inexistant
+    try:
+        file_digest = fetch(
+            config,
+            add.repo,
+            add.group + '/' + pkg_name + '/' + delta_filename,
+            delta_path,
+            delta['size'],
+            delta_filename,
+            delta_algo,
+            render,
+            group
+        )
+    except PkgDownloadError:
+        file_digest = ''
 
-        os.makedirs('/'.join(dest_path.split('/')[:-1]), exist_ok=True)
+    rebuilt = ((delta_digest is False or file_digest == delta_expected)
+                and apply_delta(old_path, delta_path, dest_path))
 
-        local_data[pkg_name] = {
-            'version': pkg_version,
-            'release': pkg_release
-        }
+    if os.path.exists(delta_path):
+        os.remove(delta_path)
 
-        extract_processes.append(
-            multiprocessing.Process(
-                target=extract_pkg_archive,
-                args=(config, dest_path, add, logger, log)
-            )
-        )
+    if not rebuilt:
+        logger.log_err(f'Could not use the delta of `{pkg_name}`, fetching the full archive.')
+        return False
 
-        if os.path.exists(dest_path):
-            continue
+    pkg_digest = get_pkg_digest(add.digests)
+    algo, expected = pkg_digest if pkg_digest else ('md5', '')
 
-        if os.path.exists(add['repo']['url']):
-            # No need to download a file, just need to copy it
+    if digests.get(dest_path, algo) != expected:
+        logger.log_err(f'Rebuilt `{pkg_name}` archive is invalid, fetching the full archive.')
+        digests.forget(dest_path)
+        os.remove(dest_path)
+        return False
 
-            shutil.copy(src_path, dest_path)
-            continue
+    return True
 
-        hash_md5 = download(
-            src_path,
-            dest_path,
-            add['pkg_info']['size'],
-            f'{pkg_name}-{pkg_version}'
-        )
+def fetch_pkg_archive(config: dict, logger: Logger, digests: DigestCache, add: Package,
+    filename: str, dest_path: str, old: Package | None = None, render: bool = True,
+    group: ProgressGroup | None = None) -> bool:
+    '''Fetches a package archive into the cache and verifies it.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM logger
+    :param DigestCache digests: Digest cache
+    :param Package add: Package record
+    :param str filename: Archive path, relative to the repo root
+    :param str dest_path: Archive path in the cache
+    :param Package old: Installed package record, when updating a package
+    :param bool render: Should the progress bar be rendered on a terminal?
+    :param ProgressGroup group: Progress of the concurrent downloads, rendered instead
+
+    :return: Is the archive valid?
+    :rtype: bool
+    '''
+
+    pkg_name = add.name
+    pkg_version = add.version
 
-        print()
+    if old is not None and fetch_pkg_delta(
+            config, logger, digests, add, old, dest_path, render, group
+        ):
+        return True
 
-        # Incorrect md5, we raise an error
+    pkg_digest = get_pkg_digest(add.digests)
+    algo, expected = pkg_digest if pkg_digest else ('md5', '')
 
-        if hash_md5 != add['pkg_info']['md5']:
-            logger.log_err(f'File {filename} has an incorrect md5 !!! Stopping everything.')
+    try:
+        file_digest = fetch(
+            config,
+            add.repo,
+            filename,
+            dest_path,
+            add.size,
+            f'{pkg_name}-{pkg_version}',
+            algo,
+            render,
+            group
+        )
+    except PkgDownloadError:
+        logger.log_err(
+            f'File {filename} could not be fetched from any mirror !!! Stopping everything.'
+        )
+        if os.path.exists(dest_path):
             os.remove(dest_path)
-            status = 2
-            return status
+        return False
 
-    os.makedirs(config['general']['dbpath'] + '/trees/', exist_ok=True)
-    status = exec_processes(config['general']['threads'], extract_processes)
+    digests.store(dest_path, algo, file_digest)
 
-    return status
+    # Incorrect digest, we raise an error
 
-def del_files_and_dirs(config: dict, files: list):
-    '''
-    Deletes files and directories given in the files list.
+    if file_digest != expected:
+        logger.log_err(
+            f'File {dest_path} has an incorrect {algo} digest !!! Stopping everything.'
+        )
+        digests.forget(dest_path)
+        os.remove(dest_path)
+        return False
 
-    :param dict config: SPKM Configuration
-    :param list files: Files and directories to delete
+    return True
 
-    :return: None
+async def verify_pkg_archive(config: dict, logger: Logger, io: IOScheduler,
+    digests: DigestCache, add: Package, filename: str, dest_path: str,
+    group: ProgressGroup | None = None) -> bool:
+    '''Verifies a cached package archive, fetching it again if it is corrupted.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM logger
+    :param IOScheduler io: I/O scheduler
+    :param DigestCache digests: Digest cache
+    :param Package add: Package record
+    :param str filename: Archive path, relative to the repo root
+    :param str dest_path: Archive path in the cache
+    :param ProgressGroup group: Progress of the concurrent downloads, rendered instead
+
+    :return: Is the archive valid?
+    :rtype: bool
     '''
 
-    dirs_to_remove = []
+    pkg_digest = get_pkg_digest(add.digests)
+    algo, expected = pkg_digest if pkg_digest else ('md5', '')
 
-    for line in files:
-        line = line.strip()
+    if await io.run(digests.get, dest_path, algo) == expected:
+        return True
 
-        if not os.path.exists(config['general']['root'] + '/' + line):
-            continue
+    logger.log_info(f'Cached file {dest_path} does not match the repo, fetching it again.')
+    digests.forget(dest_path)
+    os.remove(dest_path)
 
-        if (not os.path.isdir(config['general']['root'] + '/' + line)
-                and not os.path.islink(config['general']['root'] + '/' + line)):
-            os.remove(config['general']['root'] + '/' + line)
-        else:
-            dirs_to_remove.append(line)
+    return await io.run(
+        fetch_pkg_archive, config, logger, digests, add, filename, dest_path,
+        render = group is None,
+        group = group
+    )
 
-    for directory in dirs_to_remove:
-        if len(os.listdir(config['general']['root'] + '/' + directory)) == 0:
-            os.removedirs(config['general']['root'] + '/' + directory)
+async def fetch_pkgs_async(config: dict, logger: Logger, io: IOScheduler, local_data: dict,
+    adds: list, log: bool = True, olds: dict | None = None) -> tuple[int, list[tuple[str, str]]]:
+    '''Fetches and verifies the archives of the given packages concurrently: missing
+    archives are downloaded while the cached ones are verified.
 
-def del_pkg(config: dict, local_data: dict, dels: list):
-    ''' Deletes a package (and its dependencies) from the system.
+    A progress bar is rendered for each download when they do not overlap, otherwise
+    a single one is rendered for all of them.
 
     :param dict config: SPKM Configuration
+    :param Logger logger: SPKM logger
+    :param IOScheduler io: I/O scheduler
     :param dict local_data: local index data
-    :param str pkg: Package name
+    :param list adds: List of packages to fetch
+    :param bool log: Do we have to log infos?
+    :param dict olds: Installed package records, indexed by name, when updating packages
 
-    :return: None
+    :return: Status and (package name, archive path) tuples
+    :rtype: tuple[int, list[tuple[str, str]]]
     '''
 
-    logger = Logger(config)
+    if olds is None:
+        olds = {}
 
-    for deletion in dels:
-        pkg_name = deletion['name']
+    archives = []
+    tasks = []
+
+    digests = DigestCache(config)
+    group = ProgressGroup('Downloading', not logger.json) if io.limit > 1 else None
+
+    for add in adds:
+        filename = add.group + '/' + add.name + '/' + add.name + '-' + add.version + '.tar.zst'
+        dest_path = get_cache_path(config, add)
 
-        logger.log_info(f'Deleting package `{pkg_name}`...')
+        if log:
+            logger.log_info(f'Adding package `{add.name}`...')
 
-        with open(
-                config['general']['dbpath'] + '/trees/' + pkg_name + '.tree', 'r',
-                encoding='utf-8'
-            ) as tree:
-            files = tree.readlines()
+        # Create the cache directory as it can be inexistant
 
-        del_files_and_dirs(config, files)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
 
-        del local_data[pkg_name]
-        os.remove(config['general']['dbpath'] + '/trees/' + pkg_name + '.tree')
+        local_data[add.name] = {
+            'version': add.version,
+            'release': add.release
+        }
 
-        logger.log_success(f'Package `{pkg_name}` was successfully deleted !')
+        archives.append((add.name, dest_path))
 
-def update_pkgs(config: dict, logger: Logger, local_data: dict, ups: list, revert: bool = False):
-    '''
-    Updates the list of given packages.
+        if os.path.exists(dest_path):
+            tasks.append(verify_pkg_archive(
+                config, logger, io, digests, add, filename, dest_path, group
+            ))
+        else:
+            tasks.append(io.run(
+                fetch_pkg_archive, config, logger, digests, add, filename, dest_path,
+                olds.get(add.name), group is None, group
+            ))
+
+    results = await asyncio.gather(*tasks)
+
+    if group is not None:
+        group.finish()
+
+    digests.save()
+
+    return (0 if all(results) else 2), archives
+
+def fetch_pkgs(config: dict, logger: Logger, local_data: dict, adds: list, log: bool = True,
+    olds: dict | None = None) -> tuple[int, list[tuple[str, str]]]:
+    '''Fetches and verifies the archives of the given packages (see `fetch_pkgs_async`).
 
     :param dict config: SPKM Configuration
-    :param Logger logger: SPKM Logger
+    :param Logger logger: SPKM logger
     :param dict local_data: local index data
-    :param list ups: List of packages to update
-    :param bool revert: Is this a revert of a previous update ?
+    :param list adds: List of packages to fetch
+    :param bool log: Do we have to log infos?
+    :param dict olds: Installed package records, indexed by name, when updating packages
+
+    :return: Status and (package name, archive path) tuples
+    :rtype: tuple[int, list[tuple[str, str]]]
     '''
 
-    processed_ups = []
-    for up in ups:
-        processed_ups.append(up)
+    return asyncio.run(
+        fetch_pkgs_async(config, logger, IOScheduler(config), local_data, adds, log, olds)
+    )
 
-        pkg_name = up[1]['pkg_info']['name']
+def add_pkg(config: dict, logger: Logger, local_data: dict, adds: list, log: bool = True,
+    olds: dict | None = None, transaction: Transaction | None = None):
+    '''Adds a package (and its dependencies) to the system.
 
-        logger.log_info(f'Updating package `{pkg_name}`...')
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM logger
+    :param dict local_data: local index data
+    :param list adds: List of packages to add
+    :param bool log: Do we have to log infos?
+    :param dict olds: Installed package records, indexed by name, when updating packages
+    :param Transaction transaction: Current transaction, recording the additions
+    '''
 
-        shutil.copy(
-            config['general']['dbpath'] + '/trees/' + pkg_name + '.tree',
-            config['general']['dbpath'] + '/trees/' + pkg_name + '.tree.old'
-        )
+    status, archives = fetch_pkgs(config, logger, local_data, adds, log, olds)
 
-        add_status = add_pkg(config, logger, local_data, [up[1] if not revert else up[0]],
-                                log = False)
-        if add_status == 1:
-            update_pkgs(config, logger, local_data, processed_ups, revert=True)
-            return 1
+    if status != 0:
+        return status
 
-        with open(
-            config['general']['dbpath'] + '/trees/' + pkg_name + '.tree.old',
-            'r',
-            encoding='utf-8'
-        ) as old_tree:
-            old_tree_files = old_tree.readlines()
+    if transaction is not None:
+        for add in adds:
+            transaction.added(add.name)
 
-        with open(
-            config['general']['dbpath'] + '/trees/' + pkg_name + '.tree',
-            'r',
-            encoding='utf-8'
-        ) as new_tree:
-            new_tree_files = new_tree.readlines()
+        transaction.sync()
 
-        files_to_del = []
-        for file in old_tree_files:
-            if file not in new_tree_files:
-                files_to_del.append(file)
+    os.makedirs(config['general']['dbpath'] + '/trees/', exist_ok=True)
+    status = extract_pkg_archives(config, logger, archives, log)
 
-        del_files_and_dirs(config, files_to_del)
-        os.remove(config['general']['dbpath'] + '/trees/' + pkg_name + '.tree.old')
+    return status
 
-        logger.log_success(f'Successfully updated package `{pkg_name}` !')
+def del_pkg_files(logger: Logger, transaction: Transaction, entry: dict) -> list[str]:
+    '''
+    Deletes the files of a package (moving them into the transaction backup area),
+    leaving its directories in place.
 
-    return 0
+    :param Logger logger: SPKM logger
+    :param Transaction transaction: Current transaction
+    :param dict entry: Journal entry of the deletion (see `Transaction.record_backup`)
 
-def sync_repo(config: dict, repo: dict):
+    :return: Directories to remove once empty
+    :rtype: list[str]
     '''
-    Syncs the local "repos" with the remote ones.
 
-    :param dict config: SPKM Configuration
-    :param dict repo: The repo to sync
+    pkg_name = entry['name']
 
-    :return: None
-    '''
+    logger.log_info(f'Deleting package `{pkg_name}`...')
 
-    os.makedirs(config['general']['dbpath'] + '/dist/' + repo['name'] + '/' , exist_ok=True)
+    with logger.timed('delete', package=pkg_name):
+        dirs = transaction.backup_pkg(entry)
 
-    download(
-        repo['url'] + '/' + repo['name'] + '.db',
-        config['general']['dbpath'] + '/dist/' + repo['name'] + '/' + repo['name'] + '.db'
-    )
+    logger.log_success(f'Package `{pkg_name}` was successfully deleted !')
 
-    os.system('tar -xf ' +
-                config['general']['dbpath'] + '/dist/' + repo['name'] + '/' + repo['name'] + '.db' +
-                ' -C ' + config['general']['dbpath'] + '/dist/' + repo['name'] + '/')
-    os.remove(config['general']['dbpath'] + '/dist/' + repo['name'] + '/' + repo['name'] + '.db')
+    return dirs
 
-def upgrade_local(config: dict):
-    '''
-    Upgrades the local system by applying the correct operations.
+def del_pkg(config: dict, logger: Logger, local_data: dict, dels: list, transaction: Transaction):
+    ''' Deletes a package (and its dependencies) from the system.
 
-    :param dict config: SPKM Configuration.
+    Packages are deleted in parallel, each one only once all the packages depending
+    on it are deleted. Shared directories are pruned once at the end.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM logger
+    :param dict local_data: local index data
+    :param list dels: List of packages to delete
+    :param Transaction transaction: Current transaction
 
     :return: None
     '''
 
-    logger = Logger(config)
+    if len(dels) == 0:
+        return
 
-    for repo in config['repos']:
-        logger.log_info('Syncing repo `' + repo['name'] + '`...')
-        sync_repo(config, repo)
-        logger.log_success('Successfully synced repo `' + repo['name'] + '` !')
-        print()
+    names = {deletion.name for deletion in dels}
 
-    with open(config['general']['dbpath'] + '/local', 'w', encoding='utf-8') as f:
-        f.close()
+    # Count, for each package, the packages to delete depending on it
 
-    with open(config['general']['dbpath'] + '/world', 'w', encoding='utf-8') as f:
-        f.close()
+    dependents: dict[str, int] = {name: 0 for name in names}
+    deps: dict[str, list[str]] = {}
 
-    ops, local_data = get_ops(config)
+    for deletion in dels:
+        if deletion.name in deps:
+            continue
 
-    if len(ops['dels']) == 0 and len(ops['adds']) == 0 and len(ops['up']) == 0:
-        print('No change to apply.')
-        return
+        deps[deletion.name] = []
 
-    logger.log_header('Operations Summary')
+        for dep in deletion.dependencies:
+            if dep in names and dep != deletion.name and dep not in deps[deletion.name]:
+                deps[deletion.name].append(dep)
+                dependents[dep] += 1
 
-    for deletion in ops['dels']:
-        logger.log_del(deletion['name'] +  '-' + deletion['version'])
+    # Every deletion is journaled before the first file is moved, with a single sync
 
-    for add in ops['adds']:
-        logger.log_add(add['pkg_info']['name'] +  '-' + add['pkg_info']['version'])
+    entries = {name: transaction.record_backup(name, 'del') for name in names}
+    transaction.sync()
 
-    for up in ops['up']:
-        logger.log_up(
-            up[0]['pkg_info']['name'] +  '-' + up[0]['pkg_info']['version'] +
-            ' => ' +
-            up[1]['pkg_info']['name'] + '-' + up[1]['pkg_info']['version']
-        )
+    dirs: list[str] = []
+    started: set[str] = set()
+    ready = [name for name in names if dependents[name] == 0]
 
-    print()
+    with ThreadPoolExecutor(max_workers=max(config['general']['threads'], 1)) as executor:
+        running = {}
 
-    if input('Do you really want to apply these changes to your system ? (Y/N) ').lower() != 'y':
-        return
+        while len(names) > 0:
+            # A dependency cycle, delete the remaining packages anyway
 
-    if os.path.exists(config['general']['dbpath'] + '/world.new'):
-        shutil.copy(
-            config['general']['dbpath'] + '/world',
-            config['general']['dbpath'] + '/world.old'
-        )
+            if len(ready) == 0 and len(running) == 0:
+                ready = list(names)
 
-        shutil.copy(
-            config['general']['dbpath'] + '/world.new',
-            config['general']['dbpath'] + '/world'
-        )
+            for name in ready:
+                started.add(name)
+                running[executor.submit(del_pkg_files, logger, transaction, entries[name])] = name
+            ready = []
 
-        os.remove(config['general']['dbpath'] + '/world.new')
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
 
-    del_pkg(config, local_data, ops['dels'])
-    add_status = add_pkg(config, logger, local_data, ops['adds'])
+            for future in done:
+                name = running.pop(future)
+                dirs.extend(future.result())
 
-    if add_status == 1:
-        write_index_data(local_data, config['general']['dbpath'] + '/local')
+                del local_data[name]
+                names.discard(name)
 
-        shutil.copy(
-            config['general']['dbpath'] + '/world.old',
-            config['general']['dbpath'] + '/world.new'
-        )
-        upgrade_local(config)
+                for dep in deps[name]:
+                    dependents[dep] -= 1
 
-        raise PkgExtractionError
+                    if dependents[dep] == 0 and dep not in started:
+                        ready.append(dep)
 
-    if add_status == 2:
-        shutil.copy(
-            config['general']['dbpath'] + '/world',
-            config['general']['dbpath'] + '/world.new'
-        )
-        shutil.copy(
-            config['general']['dbpath'] + '/world.old',
-            config['general']['dbpath'] + '/world'
-        )
+    prune_dirs(config, dirs)
 
-        raise PkgDownloadError
+    transaction.set_index('local', local_data)
+
+def install_pkgs(config: dict, logger: Logger, local_data: dict, adds: list, ups: list,
+    transaction: Transaction) -> int:
+    '''
+    Adds and updates packages with a single download phase and a single extraction phase.
+
+    All the archives are fetched, then staged and checked for conflicts first, so that
+    a failure leaves the system untouched, and the tools used to extract the archives
+    are still installed while they run. The files of the installed versions are then
+    moved into the transaction backup area and the staged files renamed into place.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM Logger
+    :param dict local_data: local index data
+    :param list adds: List of packages to add
+    :param list ups: List of (installed, new) packages to update
+    :param Transaction transaction: Current transaction
+
+    :return: Status
+    :rtype: int
+    '''
+
+    for add in adds:
+        logger.log_info(f'Adding package `{add.name}`...')
+
+    for up in ups:
+        logger.log_info(f'Updating package `{up[1].name}`...')
+
+    with logger.timed('fetch', packages=len(adds) + len(ups)) as event:
+        status, archives = fetch_pkgs(
+            config,
+            logger,
+            local_data,
+            adds + [up[1] for up in ups],
+            log = False,
+            olds = {up[0].name: up[0] for up in ups}
+        )
+        event['status'] = status
+
+    if status != 0:
+        return status
+
+    os.makedirs(config['general']['dbpath'] + '/trees/', exist_ok=True)
+
+    old_dirs = []
+
+    try:
+        with logger.timed('extract', packages=len(archives)) as event:
+            status, staged = stage_pkg_archives(config, logger, archives)
+            event['status'] = status
+
+            if status == 0:
+                # The whole batch is journaled before the first file is moved,
+                # with a single sync
+
+                entries = [transaction.record_backup(up[1].name, 'up') for up in ups]
+
+                for add in adds:
+                    transaction.added(add.name)
+
+                transaction.sync()
+
+                for entry in entries:
+                    old_dirs.extend(transaction.backup_pkg(entry))
+
+                commit_pkg_archives(config, logger, staged, log = False)
+    finally:
+        clear_staging(config)
+
+    if status != 0:
+        return status
+
+    prune_dirs(config, old_dirs)
+
+    for add in adds:
+        logger.log_success(f'Package `{add.name}` was successfully added !')
+
+    for up in ups:
+        logger.log_success(f'Successfully updated package `{up[1].name}` !')
+
+    return 0
+
+def update_pkgs(config: dict, logger: Logger, local_data: dict, ups: list,
+    transaction: Transaction) -> int:
+    '''
+    Updates the list of given packages.
+
+    The files of the installed version are moved into the transaction backup area once
+    the new version is staged, so that the update can be reverted.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM Logger
+    :param dict local_data: local index data
+    :param list ups: List of packages to update
+    :param Transaction transaction: Current transaction
+
+    :return: Status
+    :rtype: int
+    '''
+
+    return install_pkgs(config, logger, local_data, [], ups, transaction)
+
+def get_repo_generations(dist_dir: str, repo_name: str) -> list[str]:
+    '''
+    Gets the directories a repo was synced into, including the current one.
+
+    :param str dist_dir: Synced repos directory
+    :param str repo_name: Repo name
+
+    :return: Directory names
+    :rtype: list[str]
+    '''
+
+    generations = []
+
+    for entry in os.listdir(dist_dir):
+        suffix = entry[len(repo_name) + 2:]
+
+        if (entry.startswith('.' + repo_name + '.') and
+                (suffix.isdigit() or suffix in ('new', 'old', 'link'))):
+            generations.append(entry)
+
+    return generations
+
+async def sync_repo_async(config: dict, repo: dict, io: IOScheduler):
+    '''
+    Syncs the local "repos" with the remote ones.
+
+    :param dict config: SPKM Configuration
+    :param dict repo: The repo to sync
+    :param IOScheduler io: I/O scheduler
+
+    :return: None
+    '''
+
+    dist_dir = get_shared_dbpath(config) + '/dist'
+    repo_dir = dist_dir + '/' + repo['name']
+
+    # Each sync extracts the repo into a new directory, `dist/<repo>` being a link to
+    # the current one
+
+    current = os.readlink(repo_dir) if os.path.islink(repo_dir) else None
+
+    os.makedirs(dist_dir, exist_ok=True)
+
+    for entry in get_repo_generations(dist_dir, repo['name']):
+        if os.path.islink(dist_dir + '/' + entry):
+            os.remove(dist_dir + '/' + entry)
+        elif entry != current:
+            shutil.rmtree(dist_dir + '/' + entry)
+
+    new_repo_dir = dist_dir + '/.' + repo['name'] + '.' + str(time.time_ns())
+
+    os.makedirs(new_repo_dir)
+
+    await io.run(
+        fetch,
+        config,
+        repo,
+        repo['name'] + '.db',
+        new_repo_dir + '/' + repo['name'] + '.db',
+        render = io.limit == 1
+    )
+
+    ret_code = await io.exec(
+        'tar', '-xf', new_repo_dir + '/' + repo['name'] + '.db', '-C', new_repo_dir + '/'
+    )
+
+    if ret_code != 0:
+        raise PkgExtractionError(f'Could not extract the database of repo `{repo["name"]}`')
+
+    os.remove(new_repo_dir + '/' + repo['name'] + '.db')
+
+    # The indexes are built before the new repo is swapped in, so that lock-free
+    # readers never see a repo without them
+
+    await io.run(build_repo_index, config, repo, new_repo_dir)
+
+    # Repos synced by older versions are directories, moved aside once
+
+    if os.path.isdir(repo_dir) and not os.path.islink(repo_dir):
+        os.rename(repo_dir, dist_dir + '/.' + repo['name'] + '.old')
+
+    # Swap the new repo in by replacing the link, so that readers always find a repo.
+    # The previous one is removed at the next sync, once its readers are done.
+
+    os.symlink(os.path.basename(new_repo_dir), dist_dir + '/.' + repo['name'] + '.link')
+    os.replace(dist_dir + '/.' + repo['name'] + '.link', repo_dir)
+
+def sync_repo(config: dict, repo: dict):
+    '''
+    Syncs the local "repos" with the remote ones (see `sync_repo_async`).
+
+    :param dict config: SPKM Configuration
+    :param dict repo: The repo to sync
+
+    :return: None
+    '''
+
+    asyncio.run(sync_repo_async(config, repo, IOScheduler(config)))
+
+async def sync_repos_async(config: dict, logger: Logger, io: IOScheduler):
+    '''
+    Syncs all the repos concurrently and creates the local indexes if needed.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM Logger
+    :param IOScheduler io: I/O scheduler
+
+    :return: None
+    '''
+
+    async def sync(repo: dict):
+        logger.log_info('Syncing repo `' + repo['name'] + '`...')
+
+        with logger.timed('sync', repo=repo['name']):
+            await sync_repo_async(config, repo, io)
+
+        logger.log_success('Successfully synced repo `' + repo['name'] + '` !')
+
+    await asyncio.gather(*(sync(repo) for repo in config['repos']))
+
+    logger.newline()
+
+    create_indexes(config)
+
+def sync_repos(config: dict, logger: Logger):
+    '''
+    Syncs all the repos and creates the local indexes if needed.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM Logger
+
+    :return: None
+    '''
+
+    asyncio.run(sync_repos_async(config, logger, IOScheduler(config)))
+
+def create_indexes(config: dict):
+    '''
+    Creates the local indexes if they do not exist yet.
+
+    :param dict config: SPKM Configuration
+
+    :return: None
+    '''
+
+    os.makedirs(config['general']['dbpath'], exist_ok=True)
+
+    for index in ('local', 'world'):
+        if not os.path.exists(config['general']['dbpath'] + '/' + index):
+            with open(config['general']['dbpath'] + '/' + index, 'w', encoding='utf-8') as f:
+                f.close()
+
+def log_ops(logger: Logger, ops: dict):
+    '''
+    Logs a summary of the incoming operations.
+
+    :param Logger logger: SPKM Logger
+    :param dict ops: Incoming operations
+
+    :return: None
+    '''
+
+    logger.log_header('Operations Summary')
+
+    for deletion in ops['dels']:
+        logger.log_del(deletion.name, deletion.version)
+
+    for add in ops['adds']:
+        logger.log_add(add.name, add.version)
+
+    for old, new in ops['up']:
+        logger.log_up(new.name, old.version, new.version)
+
+    logger.newline()
+
+def has_ops(ops: dict) -> bool:
+    '''
+    Checks if there is any operation to apply.
+
+    :param dict ops: Incoming operations
+
+    :return: Is there any operation?
+    :rtype: bool
+    '''
+
+    return len(ops['dels']) > 0 or len(ops['adds']) > 0 or len(ops['up']) > 0
+
+def apply_ops(config: dict, logger: Logger, ops: dict, local_data: dict,
+    world_data: dict | None = None):
+    '''
+    Applies the incoming operations in a single transaction, reverting it on failure.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM Logger
+    :param dict ops: Incoming operations
+    :param dict local_data: `local` index file data
+    :param dict world_data: New world, `world.new` if not given
+
+    :return: None
+    '''
+
+    dbpath = config['general']['dbpath']
+
+    transaction = Transaction(config)
+
+    try:
+        transaction.begin()
+    except TransactionPendingError:
+        logger.log_err('The last transaction was interrupted, run `spkm rollback` to revert it.')
+        raise
+
+    try:
+        # The indexes are replaced as a whole, so the worlds are swapped with links and
+        # renames instead of copies
+
+        if world_data is not None or os.path.exists(dbpath + '/world.new'):
+            link_file(dbpath + '/world', dbpath + '/world.old')
+
+            if world_data is not None:
+                transaction.set_index('world', world_data)
+
+                if os.path.exists(dbpath + '/world.new'):
+                    os.remove(dbpath + '/world.new')
+            else:
+                os.replace(dbpath + '/world.new', dbpath + '/world')
+
+        transaction.checkpoint()
+
+        with logger.timed('transaction', dels=len(ops['dels']), adds=len(ops['adds']),
+                            ups=len(ops['up'])) as event:
+            del_pkg(config, logger, local_data, ops['dels'], transaction)
+            status = install_pkgs(config, logger, local_data, ops['adds'], ops['up'],
+                                    transaction)
+            event['status'] = status
+
+        if status == 2:
+            raise PkgDownloadError
+
+        if status != 0:
+            raise PkgExtractionError
+
+        transaction.set_index('local', local_data)
+
+        # Only the next changes in the repos will have to be compared
+
+        save_seen_versions(config)
+        drop_plan(config)
+
+        transaction.commit()
+    except Exception:
+        logger.log_err('The upgrade failed, reverting the changes...')
+
+        if run_rollback_triggers(config, logger, transaction.rollback()) > 0:
+            logger.log_err('Some triggers failed, the changes were reverted anyway.')
+
+        raise
+
+    if run_triggers(config, logger, local_data, get_transaction_files(config, transaction)) > 0:
+        logger.log_err('Some triggers failed, the upgrade was applied anyway.')
+
+def plan_ops(config: dict) -> tuple:
+    '''
+    Gets incoming operations, reusing the recorded plan when nothing it depends on
+    changed since it was computed.
+
+    :param dict config: SPKM Configuration
+
+    :return: Incoming operations, local index data, and the plan (None if there is nothing to do)
+    :rtype: tuple
+    '''
+
+    fingerprint = get_fingerprint(config)
+    cached = get_cached_ops(config, fingerprint)
+
+    if cached is not False:
+        return cached
+
+    ops, local_data = get_ops(config)
+
+    if not has_ops(ops):
+        drop_plan(config)
+        return ops, local_data, None
+
+    return ops, local_data, save_plan(config, ops, fingerprint)
+
+def prefetch_pkgs(config: dict, sync: bool = True) -> int:
+    '''
+    Fetches and verifies the archives of the next upgrade without applying it,
+    and records its plan.
+
+    :param dict config: SPKM Configuration
+    :param bool sync: Do we have to sync the repos first?
+
+    :return: Status
+    :rtype: int
+    '''
+
+    logger = get_logger(config)
+
+    # The lock is only held while the database changes: the archives are written
+    # atomically into the cache, so the download does not block other instances
+
+    with DbLock(config, config['general'].get('lock_wait', 0)):
+        if sync:
+            sync_repos(config, logger)
+
+        ops, local_data, plan = plan_ops(config)
+
+    if plan is None:
+        logger.log_event('plan', 'No change to apply.')
+        return 0
+
+    log_ops(logger, ops)
+
+    # The local index is only updated when the upgrade is applied
+
+    status, _ = fetch_pkgs(
+        config,
+        logger,
+        dict(local_data),
+        ops['adds'] + [up[1] for up in ops['up']],
+        log = False,
+        olds = {up[0].name: up[0] for up in ops['up']}
+    )
+
+    if status != 0:
+        return status
+
+    # Another instance may have changed the system during the download, making the plan stale
+
+    with DbLock(config, config['general'].get('lock_wait', 0)):
+        if get_fingerprint(config) == plan['fingerprint']:
+            save_plan(config, ops, plan['fingerprint'], fetched = True)
+
+    logger.log_success('The archives of the upgrade were fetched, run `spkm up` to apply it.')
+
+    return 0
+
+async def prepare_upgrade(config: dict, logger: Logger, sync: bool = True) -> tuple | None:
+    '''
+    Syncs the repos, plans the upgrade and fetches its archives once the user confirms
+    it, in a single event loop.
+
+    :param dict config: SPKM Configuration.
+    :param Logger logger: SPKM Logger
+    :param bool sync: Do we have to sync the repos first?
+
+    :return: Incoming operations and local index data, None if there is nothing to apply
+    :rtype: tuple | None
+    '''
+
+    io = IOScheduler(config)
+
+    if sync:
+        await sync_repos_async(config, logger, io)
+
+    ops, local_data, plan = plan_ops(config)
+
+    if plan is None:
+        logger.log_event('plan', 'No change to apply.')
+        save_seen_versions(config)
+        return None
+
+    log_ops(logger, ops)
+
+    if plan['fetched']:
+        created = time.strftime('%Y-%m-%d %H:%M', time.localtime(plan['created']))
+        logger.log_info(f'The archives of this upgrade were fetched on {created}.')
+        logger.newline()
+
+    # Nothing is downloaded before the user confirms, as running downloads cannot be
+    # interrupted. The local index is only updated when the upgrade is applied.
+
+    if not logger.confirm('Do you really want to apply these changes to your system ?'):
+        return None
+
+    with logger.timed('fetch', packages=len(ops['adds']) + len(ops['up'])) as event:
+        status, _ = await fetch_pkgs_async(
+            config,
+            logger,
+            io,
+            dict(local_data),
+            ops['adds'] + [up[1] for up in ops['up']],
+            log = False,
+            olds = {up[0].name: up[0] for up in ops['up']}
+        )
+        event['status'] = status
+
+    if status != 0:
+        raise PkgDownloadError
+
+    return ops, local_data
+
+def upgrade_local(config: dict, sync: bool = True):
+    '''
+    Upgrades the local system by applying the correct operations.
+
+    :param dict config: SPKM Configuration.
+    :param bool sync: Do we have to sync the repos first?
+
+    :return: None
+    '''
+
+    logger = get_logger(config)
+
+    prepared = asyncio.run(prepare_upgrade(config, logger, sync))
+
+    if prepared is None:
+        return
+
+    ops, local_data = prepared
+
+    apply_ops(config, logger, ops, local_data)
+
+def get_root_config(config: dict, root: dict, threads: int) -> dict:
+    '''
+    Gets the configuration used to upgrade one of the roots of the `[[roots]]` list.
+    Each root has its own database, the synced repos and the cache are shared.
+
+    :param dict config: SPKM Configuration
+    :param dict root: Root configuration (`name`, `root` and optionally `dbpath`)
+    :param int threads: Number of threads of the root
+
+    :return: SPKM Configuration of the root
+    :rtype: dict
+    '''
+
+    return config | {
+        'general': config['general'] | {
+            'name': root['name'],
+            'root': root['root'],
+            'dbpath': root.get('dbpath', root['root'] + '/var/lib/spkm'),
+            'shared_dbpath': get_shared_dbpath(config),
+            'threads': threads
+        }
+    }
+
+def set_root_world(config: dict, world_data: dict):
+    '''
+    Makes a world the desired world of a root, as its `world.new`.
+
+    :param dict config: SPKM Configuration of the root
+    :param dict world_data: Desired world
+
+    :return: None
+    '''
+
+    dbpath = config['general']['dbpath']
+
+    with open(dbpath + '/world', 'rb') as world:
+        if tomllib.load(world) == world_data:
+            if os.path.exists(dbpath + '/world.new'):
+                os.remove(dbpath + '/world.new')
+
+            return
+
+    write_index_data(world_data, dbpath + '/world.new')
+
+def apply_root_ops(config: dict, lock: DbLock, ops: dict, local_data: dict):
+    '''
+    Applies the incoming operations of a root, then releases its lock.
+
+    :param dict config: SPKM Configuration of the root
+    :param DbLock lock: Lock of the root database
+    :param dict ops: Incoming operations
+    :param dict local_data: `local` index file data of the root
+
+    :return: None
+    '''
+
+    try:
+        apply_ops(config, get_logger(config), ops, local_data)
+    finally:
+        lock.release()
+
+def upgrade_roots(config: dict, sync: bool = True, download_only: bool = False):
+    '''
+    Upgrades every root of the `[[roots]]` list to the world of the main system
+    (`world.new` if any), as changed by `spkm add`, `del` or `apply`.
+
+    The repos are synced and the world read once, every archive is fetched once into
+    the shared cache, then the roots are upgraded concurrently, sharing the threads
+    budget. Each root is upgraded in its own transaction, and roots locked by another
+    instance are skipped.
+
+    :param dict config: SPKM Configuration
+    :param bool sync: Do we have to sync the repos first?
+    :param bool download_only: Should the archives only be fetched?
+
+    :return: None
+    '''
+
+    logger = get_logger(config)
+
+    if len(config.get('roots', [])) == 0:
+        logger.log_err('No root is configured, add some `[[roots]]` to the configuration.')
+        return
+
+    wait = config['general'].get('lock_wait', 0)
+
+    # Downloads only take the locks while the databases change, see `prefetch_pkgs`
+
+    if sync and download_only:
+        with DbLock(config, wait):
+            sync_repos(config, logger)
+    elif sync:
+        sync_repos(config, logger)
+
+    create_indexes(config)
+
+    world_path = config['general']['dbpath'] + '/world'
+
+    if os.path.exists(config['general']['dbpath'] + '/world.new'):
+        world_path = config['general']['dbpath'] + '/world.new'
+
+    with open(world_path, 'rb') as world:
+        world_data = tomllib.load(world)
+
+    workers = min(len(config['roots']), max(config['general']['threads'], 1))
+    root_configs = [
+        get_root_config(config, root, max(config['general']['threads'] // workers, 1))
+        for root in config['roots']
+    ]
+
+    # Resolving the packages of every root shares the same package records
+
+    planned = []
+    locked = []
+
+    try:
+        for root_config in root_configs:
+            root_logger = get_logger(root_config)
+            lock = DbLock(root_config, wait)
+
+            try:
+                lock.acquire()
+            except DbLockedError as err:
+                root_logger.log_err(str(err))
+                locked.append(root_config['general']['name'])
+                continue
+
+            create_indexes(root_config)
+            set_root_world(root_config, world_data)
+
+            ops, local_data, plan = plan_ops(root_config)
+
+            if plan is None:
+                root_logger.log_event('plan', 'No change to apply.')
+
+                if not download_only:
+                    save_seen_versions(root_config)
+
+                lock.release()
+                continue
+
+            if download_only:
+                lock.release()
+
+            log_ops(root_logger, ops)
+            planned.append((root_config, lock, ops, local_data, plan))
+
+        if len(planned) > 0:
+            upgrade_planned_roots(config, logger, planned, workers, download_only)
+    finally:
+        for _, lock, _, _, _ in planned:
+            lock.release()
+
+    if len(locked) > 0:
+        raise DbLockedError(
+            f'{len(locked)} root(s) locked by another SPKM instance were not upgraded: '
+            + ', '.join(locked) + '.'
+        )
+
+def upgrade_planned_roots(config: dict, logger: Logger, planned: list[tuple], workers: int,
+    download_only: bool):
+    '''
+    Fetches the archives of the roots and upgrades them, once their upgrades are planned.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM Logger
+    :param list[tuple] planned: Configuration, lock, operations, local index data and plan
+                                of each root
+    :param int workers: Number of roots upgraded at once
+    :param bool download_only: Should the archives only be fetched?
+
+    :return: None
+    '''
+
+    if not download_only and not logger.confirm(
+            'Do you really want to apply these changes to the roots ?'
+        ):
+        return
+
+    # Fetch every archive once into the shared cache
+
+    pkgs: dict[tuple, Package] = {}
+    olds: dict[str, Package] = {}
+
+    for _, _, ops, _, _ in planned:
+        for add in ops['adds']:
+            pkgs.setdefault((add.name, add.version, add.release), add)
+
+        for old, new in ops['up']:
+            pkgs.setdefault((new.name, new.version, new.release), new)
+            olds.setdefault(new.name, old)
+
+    with logger.timed('fetch', packages=len(pkgs)) as event:
+        status, _ = fetch_pkgs(config, logger, {}, list(pkgs.values()), log = False, olds = olds)
+        event['status'] = status
+
+    if status != 0:
+        raise PkgDownloadError
+
+    if download_only:
+        for root_config, lock, ops, _, plan in planned:
+            try:
+                lock.acquire()
+            except DbLockedError as err:
+                get_logger(root_config).log_err(str(err))
+                continue
+
+            if get_fingerprint(root_config) == plan['fingerprint']:
+                save_plan(root_config, ops, plan['fingerprint'], fetched = True)
+
+            lock.release()
+
+        logger.log_success('The archives of the upgrade were fetched, run `spkm up --roots` '
+                            'to apply it.')
+        return
+
+    # The extraction forks processes, which fails from `ThreadPoolExecutor` threads
+    # as their exit handler tries to join the forking thread in the child
+
+    failed = []
+
+    with ThreadPool(workers) as pool:
+        results = [
+            (
+                root_config['general']['name'],
+                pool.apply_async(apply_root_ops, (root_config, lock, ops, local_data))
+            )
+            for root_config, lock, ops, local_data, _ in planned
+        ]
+
+        for name, result in results:
+            try:
+                result.get()
+            except (PkgDownloadError, PkgExtractionError):
+                logger.log_err(f'The upgrade of root `{name}` failed, its changes were reverted.')
+                failed.append(name)
+            except TransactionPendingError:
+                failed.append(name)
+
+    if len(failed) > 0:
+        raise PkgExtractionError
 
-    update_pkgs(config, logger, local_data, ops['up'])
-    write_index_data(local_data, config['general']['dbpath'] + '/local')
+    logger.log_success(f'{len(planned)} root(s) were successfully upgraded !')
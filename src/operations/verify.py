@@ -0,0 +1,50 @@
+''' This module is a simple function running the "verify" operation. '''
+
+import sys
+import tomllib
+
+from utils.logger import get_logger
+from utils.verify import verify_pkgs
+
+def verify(config: dict, pkgs: list[str]):
+    '''
+    Verifies that the installed files of the given packages (all of them if none is
+    given) were not changed.
+
+    :param dict config: SPKM Configuration
+    :param list[str] pkgs: Package names
+
+    :return: None
+    '''
+
+    logger = get_logger(config)
+
+    with open(config['general']['dbpath'] + '/local', 'rb') as local:
+        local_data = tomllib.load(local)
+
+    if len(pkgs) == 0:
+        pkgs = list(local_data)
+
+    not_installed_pkgs = [pkg for pkg in pkgs if pkg not in local_data]
+
+    if len(not_installed_pkgs) > 0:
+        logger.log_err('The following package(s) are not installed:')
+        for pkg in not_installed_pkgs:
+            logger.log_err(pkg, err_content=True)
+
+        sys.exit(1)
+
+    with logger.timed('verify', packages=len(pkgs)):
+        problems = verify_pkgs(config, list(dict.fromkeys(pkgs)))
+
+    if all(len(pkg_problems) == 0 for pkg_problems in problems.values()):
+        logger.log_success(f'{len(problems)} package(s) verified, no problem found !')
+        return
+
+    logger.log_err('The following problem(s) were found:')
+
+    for pkg, pkg_problems in problems.items():
+        for file, problem in pkg_problems:
+            logger.log_err(f'{pkg}: {file} {problem}', err_content=True)
+
+    sys.exit(1)
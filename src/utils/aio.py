@@ -0,0 +1,61 @@
+''' This module is the asynchronous I/O core, running I/O operations concurrently. '''
+
+import asyncio
+import subprocess
+
+from typing import Any, Callable
+
+# Default number of I/O operations in flight at once
+
+IO_LIMIT = 4
+
+class IOScheduler:
+    '''
+    A class running I/O operations from an event loop, with a bounded number of them
+    in flight. Blocking operations (downloads, copies, hashing) run in threads and
+    commands run in subprocesses, so that the loop keeps overlapping them.
+
+    A scheduler belongs to the event loop it is first used in.
+
+    Attributes:
+        limit (int): Maximum number of operations in flight
+        semaphore (asyncio.Semaphore): Semaphore bounding the operations in flight
+    '''
+
+    def __init__(self, config: dict):
+        self.limit = max(config['general'].get('io_limit', IO_LIMIT), 1)
+        self.semaphore = asyncio.Semaphore(self.limit)
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        '''
+        Runs a blocking function in a thread.
+
+        :param Callable func: Function to run
+        :param args: Positional arguments of the function
+        :param kwargs: Keyword arguments of the function
+
+        :return: Result of the function
+        :rtype: Any
+        '''
+
+        async with self.semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def exec(self, *command: str) -> int:
+        '''
+        Runs a command in a subprocess, discarding its output.
+
+        :param str command: Command and its arguments
+
+        :return: Exit code of the command
+        :rtype: int
+        '''
+
+        async with self.semaphore:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+
+            return await process.wait()
@@ -0,0 +1,234 @@
+''' This module is a checksum helper, used to verify package archives. '''
+
+import os
+import json
+import queue
+import hashlib
+import threading
+
+from typing import Callable, Literal
+
+from utils.config import get_shared_dbpath
+
+# Supported digests, from the strongest to the weakest one
+
+DIGESTS = ('blake2b', 'sha256', 'md5')
+
+def get_pkg_digest(digests: dict) -> tuple[str, str] | Literal[False]:
+    '''Gets the strongest digest available for a package (or a delta).
+
+    :param dict digests: Digests, indexed by algorithm
+
+    :return: Digest algorithm and expected digest, or False if none is known
+    :rtype: tuple | bool
+    '''
+
+    for algo in DIGESTS:
+        if algo in digests:
+            return algo, digests[algo]
+
+    return False
+
+def hash_file(path: str, algo: str) -> str:
+    '''Hashes a file.
+
+    :param str path: File path
+    :param str algo: Digest algorithm
+
+    :return: Hex digest of the file
+    :rtype: str
+    '''
+
+    with open(path, 'rb') as file:
+        return hashlib.file_digest(file, algo).hexdigest()
+
+class ChunkHasher(threading.Thread):
+    '''
+    A thread hashing chunks of data fed from another thread, so that
+    hashing does not slow down the reading loop.
+
+    Attributes:
+        hash: Hash object being updated
+        chunks (queue.Queue): Chunks waiting to be hashed, with their release callbacks
+    '''
+
+    def __init__(self, algo: str):
+        super().__init__(daemon=True)
+        self.hash = hashlib.new(algo)
+        self.chunks: queue.Queue = queue.Queue(maxsize=8)
+        self.start()
+
+    def run(self):
+        while (item := self.chunks.get()) is not None:
+            chunk, release = item
+            self.hash.update(chunk)
+
+            if release is not None:
+                release()
+
+    def update(self, chunk, release: Callable | None = None):
+        '''
+        Queues a chunk to hash.
+
+        :param chunk: Data to hash (bytes-like object)
+        :param Callable release: Called once the chunk was hashed, so its buffer can be reused
+
+        :return: None
+        '''
+
+        self.chunks.put((chunk, release))
+
+    def hexdigest(self) -> str:
+        '''
+        Waits for all the queued chunks to be hashed and returns the digest.
+
+        :return: Hex digest
+        :rtype: str
+        '''
+
+        self.chunks.put(None)
+        self.join()
+
+        return self.hash.hexdigest()
+
+class DigestCache:
+    '''
+    A persisted (size, mtime, ctime, inode) -> digest cache, avoiding rehashing unchanged
+    files. The ctime and inode catch files replaced by others with the same size and
+    mtime, which extracting archives produces.
+
+    Attributes:
+        path (str): Path of the cache file
+        entries (dict): Cached entries, indexed by file path
+        lock (threading.Lock): Lock protecting the entries
+    '''
+
+    def __init__(self, config: dict, name: str = 'digests', shared: bool = True):
+        dbpath = get_shared_dbpath(config) if shared else config['general']['dbpath']
+
+        self.path = dbpath + '/' + name
+        self.entries: dict = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as cache:
+                try:
+                    self.entries = json.load(cache)
+                except json.JSONDecodeError:
+                    self.entries = {}
+
+    def store(self, path: str, algo: str, digest: str):
+        '''
+        Stores the digest of a file.
+
+        :param str path: File path
+        :param str algo: Digest algorithm
+        :param str digest: Hex digest of the file
+
+        :return: None
+        '''
+
+        stat = os.stat(path)
+
+        with self.lock:
+            entry = self.entries.get(path)
+
+            if entry is None or not self.is_fresh(entry, stat):
+                entry = {
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime_ns,
+                    'ctime': stat.st_ctime_ns,
+                    'ino': stat.st_ino,
+                    'digests': {}
+                }
+                self.entries[path] = entry
+
+            entry['digests'][algo] = digest
+
+    @staticmethod
+    def is_fresh(entry: dict, stat: os.stat_result) -> bool:
+        '''
+        Checks if a cache entry still describes a file.
+
+        :param dict entry: Cache entry
+        :param os.stat_result stat: Current file status
+
+        :return: Is the entry up to date?
+        :rtype: bool
+        '''
+
+        return (entry['size'] == stat.st_size
+                and entry['mtime'] == stat.st_mtime_ns
+                and entry.get('ctime') == stat.st_ctime_ns
+                and entry.get('ino') == stat.st_ino)
+
+    def lookup(self, path: str, algo: str) -> str | None:
+        '''
+        Gets the cached digest of a file, without hashing it.
+
+        :param str path: File path
+        :param str algo: Digest algorithm
+
+        :return: Hex digest of the file, None if it is not cached or changed
+        :rtype: str | None
+        '''
+
+        stat = os.stat(path)
+
+        with self.lock:
+            entry = self.entries.get(path)
+
+            if entry is not None and self.is_fresh(entry, stat) and algo in entry['digests']:
+                return entry['digests'][algo]
+
+        return None
+
+    def get(self, path: str, algo: str) -> str:
+        '''
+        Gets the digest of a file, only hashing it if it changed since the last time.
+
+        :param str path: File path
+        :param str algo: Digest algorithm
+
+        :return: Hex digest of the file
+        :rtype: str
+        '''
+
+        digest = self.lookup(path, algo)
+
+        if digest is not None:
+            return digest
+
+        digest = hash_file(path, algo)
+        self.store(path, algo, digest)
+
+        return digest
+
+    def forget(self, path: str):
+        '''
+        Removes a file from the cache.
+
+        :param str path: File path
+
+        :return: None
+        '''
+
+        with self.lock:
+            self.entries.pop(path, None)
+
+    def save(self):
+        '''
+        Writes the cache to the disk.
+
+        :return: None
+        '''
+
+        # Several caches on the same file may be saved at once (see `upgrade_roots`)
+
+        tmp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+        with self.lock:
+            with open(tmp_path, 'w', encoding='utf-8') as cache:
+                json.dump(self.entries, cache)
+
+            os.replace(tmp_path, self.path)
@@ -16,3 +16,16 @@ def get_config() -> dict:
 
     with open(os.environ['SPKM_CONF'], 'rb') as conf_file:
         return tomllib.load(conf_file)
+
+def get_shared_dbpath(config: dict) -> str:
+    '''
+    Gets the directory of the data shared by every root upgraded with the same
+    configuration: synced repos, archive digests and mirror rankings.
+
+    :param dict config: SPKM Configuration
+
+    :return: Directory path
+    :rtype: str
+    '''
+
+    return config['general'].get('shared_dbpath', config['general']['dbpath'])
@@ -1,47 +1,178 @@
 ''' This module is here to mostly help reading data. '''
 
 import os
+import json
 import tomllib
 
 from typing import Literal
 
-def get_pkg_data(config: dict, pkg: str) -> dict | Literal[False]:
-    '''Gets specified package information if the given package exists.
+from utils.package import Package
+from utils.config import get_shared_dbpath
+from utils.graph import DepGraph, build_graph
+from utils.search import build_search_index
+from utils.version import version_key
+
+# Repo indexes already loaded, indexed by repo name
+
+repo_indexes: dict[str, dict] = {}
+
+# Package records already loaded, indexed by package name
+
+packages: dict[str, Package] = {}
+
+def build_repo_index(config: dict, repo: dict, repo_dir: str | None = None) -> dict:
+    '''Builds the index of a synced repo, mapping each package to its group, version and
+    version sort key (see `utils.version`), along with its search index and its
+    dependency graph.
 
     :param dict config: SPKM Configuration
-    :param str pkg: Package name
+    :param dict repo: Repo configuration
+    :param str repo_dir: Repo directory, if it is not swapped in yet
 
-    :return: The repo containing the package or False
-    :rtype: tuple | bool
+    :return: Repo index
+    :rtype: dict
     '''
 
-    for repo in config['repos']:
-        repo_dir = config['general']['dbpath'] + '/dist/' + repo['name']
-        for group in os.listdir(repo_dir):
-            pkg_dir = repo_dir + '/' + group + '/' + pkg
-            if not os.path.exists(pkg_dir):
-                continue
+    if repo_dir is None:
+        repo_dir = get_shared_dbpath(config) + '/dist/' + repo['name']
+    index = {}
+    details = {}
+    deps = {}
 
-            with open(pkg_dir + '/package.toml', 'rb') as base_toml:
+    for group in os.listdir(repo_dir):
+        if not os.path.isdir(repo_dir + '/' + group):
+            continue
+
+        for pkg in os.listdir(repo_dir + '/' + group):
+            with open(repo_dir + '/' + group + '/' + pkg + '/package.toml', 'rb') as base_toml:
                 base_toml_data = tomllib.load(base_toml)
 
-            with open(pkg_dir + '/infos.toml', 'rb') as infos_toml:
+            index[pkg] = {
+                'group': group,
+                'version': base_toml_data['version'],
+                'release': str(base_toml_data['release']),
+                'key': version_key(base_toml_data['version'], base_toml_data['release'])
+            }
+
+            if 'triggers' in base_toml_data:
+                index[pkg]['triggers'] = base_toml_data['triggers']
+
+            details[pkg] = base_toml_data | {'group': group}
+
+            with open(repo_dir + '/' + group + '/' + pkg + '/infos.toml', 'rb') as infos_toml:
                 infos_toml_data = tomllib.load(infos_toml)
 
-            pkg_data = base_toml_data
+            deps[pkg] = (
+                [dep['name'] for dep in infos_toml_data.get('run', [])],
+                [dep['name'] for dep in infos_toml_data.get('reverse-deps', [])]
+            )
+
+    # Keys are sorted so that an unchanged repo gets the same index (see `utils.plan`)
+
+    with open(repo_dir + '/index.json.tmp', 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file, sort_keys=True)
+
+    os.replace(repo_dir + '/index.json.tmp', repo_dir + '/index.json')
+
+    build_search_index(repo_dir, repo['name'], details)
+    build_graph(repo_dir, repo['name'], deps)
 
-            if 'run' in infos_toml_data:
-                pkg_data['dependencies'] = infos_toml_data['run']
-            else:
-                pkg_data['dependencies'] = []
+    repo_indexes[repo['name']] = index
+    packages.clear()
+
+    return index
+
+def get_repo_index(config: dict, repo: dict) -> dict:
+    '''Gets the index of a synced repo, building it if needed.
+
+    :param dict config: SPKM Configuration
+    :param dict repo: Repo configuration
+
+    :return: Repo index
+    :rtype: dict
+    '''
 
-            if 'reverse-deps' in infos_toml_data:
-                pkg_data['reverse-deps'] = infos_toml_data['reverse-deps']
+    if repo['name'] in repo_indexes:
+        return repo_indexes[repo['name']]
 
-            pkg_data['size'] = infos_toml_data['size']
-            pkg_data['md5'] = infos_toml_data['md5']
+    repo_dir = get_shared_dbpath(config) + '/dist/' + repo['name']
+    index_path = repo_dir + '/index.json'
 
-            return {'repo': repo, 'group': group, 'pkg_info': pkg_data}
+    # The repo was never synced
+
+    if not os.path.isdir(repo_dir):
+        return {}
+
+    if not all(
+            os.path.exists(repo_dir + '/' + file)
+            for file in ('index.json', 'search.json', 'search.docs', 'graph.json')
+        ):
+        return build_repo_index(config, repo)
+
+    with open(index_path, 'r', encoding='utf-8') as index_file:
+        index = json.load(index_file)
+
+    # Indexes built by older versions lack the version sort keys
+
+    if len(index) > 0 and 'key' not in next(iter(index.values())):
+        return build_repo_index(config, repo)
+
+    repo_indexes[repo['name']] = index
+
+    return repo_indexes[repo['name']]
+
+def get_graph(config: dict) -> DepGraph:
+    '''Gets the dependency graph of the synced repos, building their indexes if needed.
+
+    :param dict config: SPKM Configuration
+
+    :return: Dependency graph
+    :rtype: DepGraph
+    '''
+
+    for repo in config['repos']:
+        get_repo_index(config, repo)
+
+    return DepGraph(config)
+
+def get_pkg_data(config: dict, pkg: str) -> Package | Literal[False]:
+    '''Gets specified package information if the given package exists.
+
+    Records are interned: the same record is returned until the repos are synced again.
+
+    :param dict config: SPKM Configuration
+    :param str pkg: Package name
+
+    :return: The package record or False
+    :rtype: Package | bool
+    '''
+
+    if pkg in packages:
+        return packages[pkg]
+
+    for repo in config['repos']:
+        index = get_repo_index(config, repo)
+
+        if pkg in index:
+            entry = index[pkg]
+            pkg_dir = (get_shared_dbpath(config) + '/dist/' + repo['name'] + '/' +
+                        entry['group'] + '/' + pkg)
+
+            with open(pkg_dir + '/infos.toml', 'rb') as infos_toml:
+                infos_toml_data = tomllib.load(infos_toml)
+
+            packages[pkg] = Package(
+                pkg,
+                entry['version'],
+                entry['release'],
+                entry['group'],
+                repo,
+                pkg_dir,
+                infos_toml_data,
+                tuple(entry['key'])
+            )
+
+            return packages[pkg]
 
     return False
 
@@ -63,19 +194,98 @@ def is_pkg_installed(config: dict, pkg: str) -> str | Literal[False]:
 
     return False
 
-def write_index_data(data: dict, filepath: str):
+def get_newer_pkgs(config: dict, keys: dict[str, tuple]) -> dict[str, dict]:
+    '''Gets the packages of the repos newer than the given versions.
+
+    :param dict config: SPKM Configuration
+    :param dict keys: Version sort keys, indexed by package name
+
+    :return: Repo index entries of the newer packages, indexed by package name
+    :rtype: dict[str, dict]
+    '''
+
+    newer = {}
+    found = set()
+
+    for repo in config['repos']:
+        index = get_repo_index(config, repo)
+
+        for pkg, key in keys.items():
+            if pkg in found or pkg not in index:
+                continue
+
+            found.add(pkg)
+
+            if tuple(index[pkg]['key']) > key:
+                newer[pkg] = index[pkg] | {'repo': repo['name']}
+
+    return newer
+
+def load_seen_versions(config: dict) -> dict:
+    '''Loads the repo versions seen when the system was last upgraded.
+
+    :param dict config: SPKM Configuration
+
+    :return: Versions (`version-release`), indexed by repo name then by package name
+    :rtype: dict
+    '''
+
+    seen_path = config['general']['dbpath'] + '/seen'
+
+    if not os.path.exists(seen_path):
+        return {}
+
+    with open(seen_path, 'r', encoding='utf-8') as seen:
+        try:
+            return json.load(seen)
+        except json.JSONDecodeError:
+            return {}
+
+def save_seen_versions(config: dict):
+    '''Records the current repo versions as seen.
+
+    :param dict config: SPKM Configuration
+
+    :return: None
+    '''
+
+    seen = {}
+
+    for repo in config['repos']:
+        index = get_repo_index(config, repo)
+        seen[repo['name']] = {
+            pkg: index[pkg]['version'] + '-' + index[pkg]['release'] for pkg in index
+        }
+
+    seen_path = config['general']['dbpath'] + '/seen'
+
+    with open(seen_path + '.tmp', 'w', encoding='utf-8') as seen_file:
+        json.dump(seen, seen_file)
+
+    os.replace(seen_path + '.tmp', seen_path)
+
+def write_index_data(data: dict, filepath: str, sync: bool = False):
     ''' Writes index data to a file.
 
+    The file is replaced atomically, so that readers never see a partial index.
+
     :param dict data: Data to write
     :param str filepath: Path to the index file
-    
+    :param bool sync: Should the data reach the disk before the file is replaced?
+
     :return: None
     '''
 
-    with open(filepath, 'w', encoding='utf-8') as file:
+    with open(filepath + '.tmp', 'w', encoding='utf-8') as file:
         for key in data:
             file.write('[' + key + ']\n')
             for data_key in data[key]:
                 file.write(data_key + ' = ' + f'\'{data[key][data_key]}\'\n')
 
             file.write('\n')
+
+        if sync:
+            file.flush()
+            os.fsync(file.fileno())
+
+    os.replace(filepath + '.tmp', filepath)
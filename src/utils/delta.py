@@ -0,0 +1,72 @@
+''' This module handles delta archives, used to update packages without downloading them fully. '''
+
+import os
+import shutil
+import subprocess
+
+from typing import Literal
+
+from utils.package import Package
+
+def get_delta(pkg: Package, old: Package) -> dict | Literal[False]:
+    '''Gets the delta of a package applying to the installed one, if it is worth it.
+    A delta applies to a version and a release, the first release when it gives none.
+
+    :param Package pkg: Package record
+    :param Package old: Installed package record
+
+    :return: Delta information or False if there is no interesting delta
+    :rtype: dict | bool
+    '''
+
+    # Deltas are rebuilt with zstd
+
+    if shutil.which('zstd') is None:
+        return False
+
+    for delta in pkg.deltas:
+        if (delta['version'] == old.version and str(delta.get('release', 1)) == str(old.release)
+                and delta['size'] < pkg.size):
+            return delta
+
+    return False
+
+def get_delta_filename(pkg: Package, old_version: str) -> str:
+    '''Gets the file name of a delta archive.
+
+    :param Package pkg: Package record
+    :param str old_version: Version the delta applies to
+
+    :return: Delta archive name
+    :rtype: str
+    '''
+
+    return pkg.name + '-' + old_version + '-' + pkg.version + '.tar.zst.delta'
+
+def apply_delta(old_archive: str, delta: str, new_archive: str) -> bool:
+    '''Rebuilds an archive from the previous one and a delta (zstd `--patch-from`).
+
+    :param str old_archive: Previous archive path
+    :param str delta: Delta archive path
+    :param str new_archive: Rebuilt archive path
+
+    :return: Was the archive rebuilt?
+    :rtype: bool
+    '''
+
+    ret_code = subprocess.call(
+        [
+            'zstd', '-q', '-f', '-d', '--long=31',
+            '--patch-from=' + old_archive, delta, '-o', new_archive
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    if ret_code != 0:
+        if os.path.exists(new_archive):
+            os.remove(new_archive)
+
+        return False
+
+    return True
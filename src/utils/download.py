@@ -1,10 +1,53 @@
 ''' This module is a download helper. '''
 
 import sys
-import hashlib
-import datetime
+import time
+import queue
+import threading
+import http.client
 
-from urllib.request import urlopen
+from typing import Callable
+from urllib.request import Request, urlopen
+
+from utils.checksum import ChunkHasher
+from utils.exceptions import PkgDownloadError
+
+# Bounds of the adaptive chunk size
+
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 2 * 1024 * 1024
+
+# A read should take about this long (in seconds), the chunk size is adapted accordingly
+
+TARGET_READ_TIME = 0.1
+
+# Number of preallocated buffers shared between the reading loop and the hashing thread
+
+BUFFERS = 3
+
+# Minimum delay (in seconds) between two progress bar renderings
+
+RENDER_INTERVAL = 0.1
+
+# Smoothing factor of the speed moving average
+
+SPEED_SMOOTHING = 0.3
+
+def format_size(size: float, unit_size: float) -> str:
+    '''
+    Formats a size (or a rate) in K or M depending on the given unit size.
+
+    :param float size: Size in bytes
+    :param float unit_size: Size used to choose the unit
+
+    :return: Formatted size
+    :rtype: str
+    '''
+
+    if int(unit_size / 1024 / 1024) > 0:
+        return str(int(size / 1024 / 1024)) + 'M'
+
+    return str(int(size / 1024)) + 'K'
 
 def print_progress(dl: int, total_length: int, speed: float, display_name: str) -> None:
     '''
@@ -18,107 +61,368 @@ def print_progress(dl: int, total_length: int, speed: float, display_name: str)
     :return: None
     '''
 
-    total_length_kb = int(total_length / 1024)
-    total_length_mb = int(total_length / 1024 / 1024)
+    total_length_display = format_size(total_length, total_length)
+    dl_display = format_size(dl, total_length)
+    speed_display = format_size(speed, speed) + '/s'
+
+    done = int(50 * min(dl, total_length) / total_length)
+
+    # Display the progress bar
+
+    sys.stdout.write(
+        f"\x1b[1K\r{display_name} [%s%s] "
+        f"({dl_display}/{total_length_display} - {speed_display})"
+        % ('=' * done, ' ' * (50-done))
+    )
+    sys.stdout.flush()
+
+class Progress:
+    '''
+    A class tracking a download progress and rendering it at a limited rate.
+
+    Attributes:
+        total_length (int): Size of the file
+        display_name (str): Name of the file to display
+        tty (bool): Is the progress bar rendered (on a terminal)?
+        dl (int): Current downloaded size
+        speed (float): Smoothed downloading rate
+        start_time (float): Start of the download
+        last_time (float): Time of the last speed sample
+        last_dl (int): Downloaded size at the last speed sample
+        group (ProgressGroup | None): Progress of the concurrent downloads, rendered instead
+    '''
+
+    def __init__(self, total_length: int, display_name: str, render: bool = True,
+        group: 'ProgressGroup | None' = None):
+        self.total_length = total_length
+        self.display_name = display_name
+        self.tty = render and group is None and sys.stdout.isatty()
+        self.dl = 0
+        self.speed = 0.0
+        self.start_time = time.monotonic()
+        self.last_time = self.start_time
+        self.last_dl = 0
+        self.group = group
 
-    speed_kb = int(speed / 1024)
-    speed_mb = int(speed / 1024 / 1024)
+        if group is not None:
+            group.add(total_length)
 
-    total_length_display = ''
+    def render(self, speed: float):
+        '''
+        Renders the progress bar.
 
-    if total_length_mb > 0:
-        total_length_display = str(total_length_mb) + 'M'
-    else:
-        total_length_display = str(total_length_kb) + 'K'
+        :param float speed: Downloading rate to display
 
-    dl_kb = int(dl / 1024)
-    dl_mb = dl / 1024 / 1024
+        :return: None
+        '''
 
-    dl_display = ''
-    speed_display = ''
+        print_progress(self.dl, self.total_length, speed, self.display_name)
 
-    # Set a convenient display for download size display and speed rate
+    def restart(self):
+        '''
+        Forgets the downloaded data, when the download starts over.
 
-    if total_length_mb > 0:
-        dl_display = str(int(dl_mb)) + 'M'
-    else:
-        dl_display = str(int(dl_kb)) + 'K'
+        :return: None
+        '''
 
-    if speed_mb > 0:
-        speed_display = str(speed_mb) + 'M/s'
-    else:
-        speed_display = str(speed_kb) + 'K/s'
+        if self.group is not None:
+            self.group.forget(self.dl)
 
-    done = int(50 * dl / total_length)
+        self.dl = 0
 
-    # Display the progress bar
+    def update(self, length: int):
+        '''
+        Accounts for some downloaded data, rendering the progress bar if needed.
 
-    sys.stdout.write(
-        f"\x1b[1K\r{display_name} [%s%s] "
-        f"({dl_display}/{total_length_display} - {speed_display})"
-        % ('=' * done, ' ' * (50-done))
-    )
-    sys.stdout.flush()
+        :param int length: Length of the downloaded data
+
+        :return: None
+        '''
+
+        if self.group is not None:
+            self.group.update(length)
 
-def download(url: str, file: str, total_length: int = 0, display_name: str = '') -> str:
+        self.dl += length
+
+        now = time.monotonic()
+        elapsed = now - self.last_time
+
+        if elapsed < RENDER_INTERVAL:
+            return
+
+        sample = (self.dl - self.last_dl) / elapsed
+
+        if self.speed == 0:
+            self.speed = sample
+        else:
+            self.speed = SPEED_SMOOTHING * sample + (1 - SPEED_SMOOTHING) * self.speed
+
+        self.last_time = now
+        self.last_dl = self.dl
+
+        if self.tty and self.total_length != 0:
+            self.render(self.speed)
+
+    def finish(self):
+        '''
+        Renders the final state of the download on a terminal.
+
+        :return: None
+        '''
+
+        if self.group is not None:
+            self.group.complete()
+
+        if self.total_length == 0 or not self.tty:
+            return
+
+        elapsed = time.monotonic() - self.start_time
+        speed = self.dl / elapsed if elapsed > 0 else 0
+
+        self.render(speed)
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+
+class ProgressGroup(Progress):
     '''
-    Downloads a file.
+    A class tracking the overall progress of concurrent downloads, rendered as a
+    single progress bar. Downloads join the group when they start.
 
-    :param str url: URL of the file to download
+    Attributes:
+        count (int): Number of downloads
+        done (int): Number of finished downloads
+        lock (threading.Lock): Lock protecting the progress
+    '''
+
+    def __init__(self, display_name: str, render: bool = True):
+        super().__init__(0, display_name, render)
+
+        self.count = 0
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def add(self, total_length: int):
+        '''
+        Accounts for a new download.
+
+        :param int total_length: Size of the file
+
+        :return: None
+        '''
+
+        with self.lock:
+            self.total_length += total_length
+            self.count += 1
+
+    def forget(self, length: int):
+        '''
+        Forgets some downloaded data, when a download starts over.
+
+        :param int length: Length of the downloaded data
+
+        :return: None
+        '''
+
+        with self.lock:
+            self.dl -= length
+            self.last_dl -= length
+
+    def update(self, length: int):
+        with self.lock:
+            super().update(length)
+
+    def complete(self):
+        '''
+        Accounts for a finished download.
+
+        :return: None
+        '''
+
+        with self.lock:
+            self.done += 1
+
+            if self.tty and self.total_length != 0:
+                self.render(self.speed)
+
+    def render(self, speed: float):
+        print_progress(
+            self.dl, self.total_length, speed, f'{self.display_name} {self.done}/{self.count}'
+        )
+
+    def finish(self):
+        with self.lock:
+            super().finish()
+
+class RateLimiter:
+    '''
+    A class capping the bandwidth used by all the downloads of the process.
+
+    Attributes:
+        rate (float): Maximum rate in bytes per second (0 means unlimited)
+        next_time (float): Time at which the next chunk may be read
+        lock (threading.Lock): Lock protecting next_time
+    '''
+
+    def __init__(self, rate: float = 0):
+        self.rate = rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, length: int):
+        '''
+        Accounts for some downloaded data, sleeping if the rate is exceeded.
+
+        :param int length: Length of the downloaded data
+
+        :return: None
+        '''
+
+        if self.rate <= 0:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            self.next_time = max(self.next_time, now) + length / self.rate
+            delay = self.next_time - now
+
+        if delay > 0:
+            time.sleep(delay)
+
+# Shared by every download so that the cap is global
+
+limiter = RateLimiter()
+
+def download(urls: str | list[str], file: str, total_length: int = 0, display_name: str = '',
+    algo: str = 'md5', timeout: float | None = None,
+    on_result: Callable[[str, int, float, bool], None] | None = None,
+    render: bool = True, group: ProgressGroup | None = None) -> str:
+    '''
+    Downloads a file, failing over to the next URL on errors or stalls.
+
+    :param str | list[str] urls: URL (or mirror URLs, by order of preference) of the file
     :param str file: Destination path
     :param int total_length: Size of the file
     :param str display_name: Name to display while downloading
+    :param str algo: Digest algorithm
+    :param float timeout: Delay after which a silent connection is considered stalled
+    :param Callable on_result: Called with (url, size, duration, success) after each attempt
+    :param bool render: Should the progress bar be rendered on a terminal?
+    :param ProgressGroup group: Progress of the concurrent downloads, rendered instead
 
-    :return: MD5 hash of the downloaded file
+    :return: Hex digest of the downloaded file
     :rtype: str
     '''
 
+    if isinstance(urls, str):
+        urls = [urls]
+
     if display_name == '':
-        display_name = url
+        display_name = urls[0]
+
+    # Hash the file in a separate thread, off the read path
+
+    hasher = ChunkHasher(algo)
+
+    # Buffers are preallocated and handed back by the hashing thread once hashed
+
+    free_buffers: queue.Queue = queue.Queue()
+    for _ in range(BUFFERS):
+        free_buffers.put(memoryview(bytearray(MAX_CHUNK_SIZE)))
+
+    progress = Progress(total_length, display_name, render, group)
+
+    with open(file, 'wb') as f:
+        for i, url in enumerate(urls):
+            request = Request(url)
+
+            # Resume the transfer where the previous mirror stopped
+
+            if progress.dl > 0:
+                request.add_header('Range', f'bytes={progress.dl}-')
 
-    # Initialize md5 hash
+            start_dl = progress.dl
+            start_time = time.monotonic()
 
-    hash_md5 = hashlib.md5()
+            try:
+                with urlopen(request, timeout=timeout) as req:
+                    if progress.dl > 0 and getattr(req, 'status', None) != 206:
+                        # The mirror cannot resume, start over
 
-    # Initialize request
+                        hasher.hexdigest()
+                        hasher = ChunkHasher(algo)
+                        f.seek(0)
+                        f.truncate()
+                        progress.restart()
+                        start_dl = 0
+
+                    read_file(req, f, hasher, free_buffers, progress)
+            except (OSError, http.client.HTTPException) as exc:
+                if on_result is not None:
+                    on_result(url, progress.dl - start_dl, time.monotonic() - start_time, False)
+
+                if i + 1 == len(urls):
+                    hasher.hexdigest()
+                    raise PkgDownloadError(f'Could not download {display_name}') from exc
+
+                continue
+
+            if on_result is not None:
+                on_result(url, progress.dl - start_dl, time.monotonic() - start_time, True)
+
+            break
+
+    progress.finish()
+
+    return hasher.hexdigest()
+
+def read_file(req, f, hasher: ChunkHasher, free_buffers: queue.Queue, progress: Progress):
+    '''
+    Reads a response into a file, hashing its content.
+
+    :param req: Response to read
+    :param f: Destination file
+    :param ChunkHasher hasher: Hasher of the file
+    :param queue.Queue free_buffers: Buffers available for reading
+    :param Progress progress: Download progress
+
+    :return: None
+    '''
 
-    with urlopen(url) as req:
-        chunk_size = 2 * 1024 * 1024
-        dl = 0
+    chunk_size = MIN_CHUNK_SIZE * 4
 
-        start_time = datetime.datetime.now()
-        end_time = start_time
-        diff = end_time - start_time
+    while True:
+        buffer = free_buffers.get()
 
-        # Download the file
+        start_time = time.monotonic()
 
-        with open(file, 'wb') as f:
-            while True:
-                start_time = datetime.datetime.now()
+        try:
+            length = req.readinto(buffer[:chunk_size])
+        except BaseException:
+            free_buffers.put(buffer)
+            raise
 
-                if diff.total_seconds() > 0:
-                    speed = chunk_size / diff.total_seconds()
-                else:
-                    speed = 0
+        read_time = time.monotonic() - start_time
 
-                dl += chunk_size
+        if not length:
+            free_buffers.put(buffer)
 
-                dl = min(dl, total_length)
+            # The connection was closed before the announced length was read
 
-                chunk = req.read(chunk_size)
-                if not chunk:
-                    break
+            if getattr(req, 'length', None):
+                raise http.client.IncompleteRead(b'', req.length)
 
-                f.write(chunk)
+            break
 
-                if total_length != 0:
-                    print_progress(dl, total_length, speed, display_name)
+        f.write(buffer[:length])
 
-                end_time = datetime.datetime.now()
-                diff = end_time - start_time
+        hasher.update(buffer[:length], lambda buffer=buffer: free_buffers.put(buffer))
 
-                # Update md5 hash
+        progress.update(length)
+        limiter.consume(length)
 
-                hash_md5.update(chunk)
+        # Adapt the chunk size to the connection speed
 
-    return hash_md5.hexdigest()
+        if length == chunk_size and read_time < TARGET_READ_TIME / 2:
+            chunk_size = min(chunk_size * 2, MAX_CHUNK_SIZE)
+        elif read_time > TARGET_READ_TIME * 2:
+            chunk_size = max(chunk_size // 2, MIN_CHUNK_SIZE)
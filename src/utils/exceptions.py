@@ -8,3 +8,9 @@ class PkgDownloadError(Exception):
 
 class PkgExtractionError(Exception):
     ''' Raised when an error occured during the extracting process. '''
+
+class DbLockedError(Exception):
+    ''' Raised when the database is locked by another SPKM instance. '''
+
+class TransactionPendingError(Exception):
+    ''' Raised when the last transaction was interrupted before being committed or reverted. '''
@@ -0,0 +1,153 @@
+''' This module is here to help handling installed files. '''
+
+import os
+import errno
+import shutil
+
+def read_tree(config: dict, pkg: str) -> list[str]:
+    '''Reads the list of files installed by a package.
+
+    :param dict config: SPKM Configuration
+    :param str pkg: Package name
+
+    :return: Files and directories, relative to the root
+    :rtype: list[str]
+    '''
+
+    with open(
+            config['general']['dbpath'] + '/trees/' + pkg + '.tree', 'r',
+            encoding='utf-8'
+        ) as tree:
+        return [line.strip() for line in tree.readlines() if line.strip() != '']
+
+def is_dir(path: str) -> bool:
+    '''Checks if a path is a real directory (and not a symlink to one).
+
+    :param str path: Path
+
+    :return: Is it a directory?
+    :rtype: bool
+    '''
+
+    return os.path.isdir(path) and not os.path.islink(path)
+
+def move_file(src: str, dest: str):
+    '''Moves a file, with a rename when both paths are on the same filesystem.
+
+    :param str src: Source path
+    :param str dest: Destination path
+
+    :return: None
+    '''
+
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+    try:
+        os.rename(src, dest)
+    except OSError:
+        shutil.move(src, dest)
+
+def replace_file(src: str, dest: str):
+    '''Replaces a file by another one, atomically even when both paths are on
+    different filesystems: the file is then copied next to its destination first.
+
+    :param str src: Source path
+    :param str dest: Destination path
+
+    :return: None
+    '''
+
+    try:
+        os.replace(src, dest)
+        return
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+
+    if os.path.lexists(dest + '.tmp'):
+        os.remove(dest + '.tmp')
+
+    shutil.copy2(src, dest + '.tmp', follow_symlinks=False)
+    os.replace(dest + '.tmp', dest)
+    os.remove(src)
+
+def link_file(src: str, dest: str):
+    '''Replaces a file by a hard link to another one, atomically.
+
+    The files then share their content, which is only safe for files always
+    replaced as a whole (like the indexes) and never modified in place.
+
+    :param str src: Source path
+    :param str dest: Destination path
+
+    :return: None
+    '''
+
+    # Renaming a link over the same file does nothing, the temporary link would stay
+
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return
+
+    if os.path.lexists(dest + '.tmp'):
+        os.remove(dest + '.tmp')
+
+    os.link(src, dest + '.tmp')
+    os.replace(dest + '.tmp', dest)
+
+def sync_dir(path: str):
+    '''Makes the changes to the entries of a directory (created, renamed or removed
+    files) durable.
+
+    :param str path: Directory path
+
+    :return: None
+    '''
+
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def del_files(config: dict, files: list) -> list[str]:
+    '''
+    Deletes the files given in the files list, leaving directories in place.
+
+    :param dict config: SPKM Configuration
+    :param list files: Files and directories to delete
+
+    :return: Directories to remove once empty
+    :rtype: list[str]
+    '''
+
+    dirs_to_remove = []
+
+    for line in files:
+        line = line.strip()
+
+        if not os.path.lexists(config['general']['root'] + '/' + line):
+            continue
+
+        if not is_dir(config['general']['root'] + '/' + line):
+            os.remove(config['general']['root'] + '/' + line)
+        else:
+            dirs_to_remove.append(line)
+
+    return dirs_to_remove
+
+def prune_dirs(config: dict, dirs: list[str]):
+    '''
+    Removes the given directories if they are empty, deepest ones first.
+
+    :param dict config: SPKM Configuration
+    :param list[str] dirs: Directories to remove
+
+    :return: None
+    '''
+
+    for directory in sorted(set(dirs), key=lambda directory: directory.count('/'), reverse=True):
+        path = config['general']['root'] + '/' + directory
+
+        if is_dir(path) and len(os.listdir(path)) == 0:
+            os.rmdir(path)
@@ -0,0 +1,222 @@
+''' This module handles the prebuilt dependency graph of the repos. '''
+
+import os
+import json
+
+from utils.config import get_shared_dbpath
+
+# Dependency graphs already loaded, indexed by repo name
+
+graphs: dict[str, dict] = {}
+
+def build_graph(repo_dir: str, repo_name: str, deps: dict[str, tuple[list, list]]):
+    '''
+    Builds the dependency graph of a repo in compressed sparse row form: the targets
+    of the edges of package `i` are `targets[offsets[i]:offsets[i + 1]]`.
+
+    Packages of the repo come first in the names, followed by the dependencies
+    provided by other repos, which have no edges in this graph.
+
+    :param str repo_dir: Synced repo directory
+    :param str repo_name: Repo name
+    :param dict deps: (dependencies, reverse dependencies) of each package, indexed by name
+
+    :return: None
+    '''
+
+    names = list(deps)
+    ids = {name: i for i, name in enumerate(names)}
+
+    graph: dict = {'names': names, 'count': len(names)}
+
+    for field, column in (('deps', 0), ('rdeps', 1)):
+        offsets = [0]
+        targets = []
+
+        for name in names[:graph['count']]:
+            for target in deps[name][column]:
+                if target not in ids:
+                    ids[target] = len(names)
+                    names.append(target)
+
+                targets.append(ids[target])
+
+            offsets.append(len(targets))
+
+        graph[field + '_offsets'] = offsets
+        graph[field] = targets
+
+    with open(repo_dir + '/graph.json.tmp', 'w', encoding='utf-8') as graph_file:
+        json.dump(graph, graph_file)
+
+    os.replace(repo_dir + '/graph.json.tmp', repo_dir + '/graph.json')
+
+    graph['ids'] = {name: i for i, name in enumerate(names[:graph['count']])}
+    graphs[repo_name] = graph
+
+def load_graph(config: dict, repo: dict) -> dict:
+    '''
+    Loads the dependency graph of a repo.
+
+    :param dict config: SPKM Configuration
+    :param dict repo: Repo configuration
+
+    :return: Dependency graph (empty if the repo was never synced)
+    :rtype: dict
+    '''
+
+    if repo['name'] not in graphs:
+        graph_path = get_shared_dbpath(config) + '/dist/' + repo['name'] + '/graph.json'
+
+        if not os.path.exists(graph_path):
+            return {
+                'names': [], 'count': 0, 'ids': {},
+                'deps_offsets': [0], 'deps': [], 'rdeps_offsets': [0], 'rdeps': []
+            }
+
+        with open(graph_path, 'r', encoding='utf-8') as graph_file:
+            graph = json.load(graph_file)
+
+        graph['ids'] = {name: i for i, name in enumerate(graph['names'][:graph['count']])}
+        graphs[repo['name']] = graph
+
+    return graphs[repo['name']]
+
+class DepGraph:
+    '''
+    A class representing the dependency graph of all the repos. A package belongs to
+    the first repo providing it, like in `utils.db.get_pkg_data`.
+
+    Attributes:
+        graphs (list[dict]): Dependency graphs of the repos, by priority
+    '''
+
+    def __init__(self, config: dict):
+        self.graphs = [load_graph(config, repo) for repo in config['repos']]
+
+    def __contains__(self, name: str) -> bool:
+        return any(name in graph['ids'] for graph in self.graphs)
+
+    def get_edges(self, name: str, field: str) -> list[str]:
+        '''
+        Gets the edges of a package.
+
+        :param str name: Package name
+        :param str field: Either `deps` or `rdeps`
+
+        :return: Names of the targets (empty if the package does not exist)
+        :rtype: list[str]
+        '''
+
+        for graph in self.graphs:
+            i = graph['ids'].get(name)
+
+            if i is not None:
+                offsets = graph[field + '_offsets']
+                return [graph['names'][j] for j in graph[field][offsets[i]:offsets[i + 1]]]
+
+        return []
+
+    def get_deps(self, name: str) -> list[str]:
+        '''
+        Gets the runtime dependencies of a package.
+
+        :param str name: Package name
+
+        :return: Dependency names
+        :rtype: list[str]
+        '''
+
+        return self.get_edges(name, 'deps')
+
+    def get_reverse_deps(self, name: str) -> list[str]:
+        '''
+        Gets the packages depending on a package.
+
+        :param str name: Package name
+
+        :return: Package names
+        :rtype: list[str]
+        '''
+
+        return self.get_edges(name, 'rdeps')
+
+    def get_names(self) -> list[str]:
+        '''
+        Gets the names of all the packages.
+
+        :return: Package names
+        :rtype: list[str]
+        '''
+
+        names = {}
+
+        for graph in self.graphs:
+            names.update(dict.fromkeys(graph['ids']))
+
+        return list(names)
+
+    def get_closure(self, names: list[str], reverse: bool = False) -> list[str]:
+        '''
+        Gets the packages reachable from the given ones, themselves included.
+
+        :param list[str] names: Package names
+        :param bool reverse: Follow the reverse dependencies instead?
+
+        :return: Package names
+        :rtype: list[str]
+        '''
+
+        field = 'rdeps' if reverse else 'deps'
+        seen = dict.fromkeys(names)
+        queue = list(names)
+
+        while len(queue) > 0:
+            for target in self.get_edges(queue.pop(), field):
+                if target not in seen:
+                    seen[target] = None
+                    queue.append(target)
+
+        return list(seen)
+
+def what_if(graph: DepGraph, local_data: dict, world_data: dict, adds: list[str],
+    drops: list[str]) -> dict:
+    '''
+    Finds what would be installed and deleted if packages were added to or dropped
+    from the world, following the rules of `operations.upgrade.get_ops`.
+
+    :param DepGraph graph: Dependency graph
+    :param dict local_data: `local` index file data
+    :param dict world_data: Current world
+    :param list[str] adds: Packages to add to the world
+    :param list[str] drops: Packages to drop from the world
+
+    :return: Package names to `add` and to `del`, and the `missing` ones
+    :rtype: dict
+    '''
+
+    world = (set(world_data) | set(adds)) - set(drops)
+
+    pulled = {}
+    missing = []
+
+    for pkg in sorted(world):
+        if pkg in local_data:
+            continue
+
+        if pkg not in graph:
+            missing.append(pkg)
+            continue
+
+        for name in graph.get_deps(pkg) + [pkg]:
+            if name not in graph:
+                missing.append(name)
+            elif name not in local_data:
+                pulled[name] = None
+
+    removed = [
+        pkg for pkg in local_data
+        if pkg not in world and not any(dep in world for dep in graph.get_reverse_deps(pkg))
+    ]
+
+    return {'add': list(pulled), 'del': removed, 'missing': sorted(set(missing))}
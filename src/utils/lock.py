@@ -0,0 +1,96 @@
+''' This module handles the lock preventing concurrent changes to the database. '''
+
+import os
+import time
+import fcntl
+
+from utils.exceptions import DbLockedError
+
+# Delay between two attempts to take the lock, in seconds
+
+POLL_INTERVAL = 0.1
+
+class DbLock:
+    '''
+    A class representing the exclusive lock taken on `dbpath` by operations changing
+    the system. Read-only operations do not take it: every index is replaced
+    atomically, so they always read a consistent snapshot.
+
+    The lock is an `flock` on `dbpath/lock`, it is released when the process exits.
+
+    Attributes:
+        config (dict): SPKM Configuration
+        timeout (float): Seconds to wait for the lock, possibly infinite
+        fd (int | None): Lock file descriptor while the lock is held
+    '''
+
+    def __init__(self, config: dict, timeout: float = 0):
+        self.config = config
+        self.timeout = timeout
+        self.fd = None
+
+    def acquire(self):
+        '''
+        Takes the lock, waiting for it up to the timeout.
+
+        :return: None
+        '''
+
+        os.makedirs(self.config['general']['dbpath'], exist_ok=True)
+
+        fd = os.open(self.config['general']['dbpath'] + '/lock', os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError as err:
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    raise DbLockedError(
+                        'The database is locked by another SPKM instance '
+                        f'(PID {self.get_owner()}).'
+                    ) from err
+
+                time.sleep(POLL_INTERVAL)
+
+        # Record the owner, to help finding it
+
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+
+        self.fd = fd
+
+    def get_owner(self) -> str:
+        '''
+        Gets the PID of the process holding the lock.
+
+        :return: PID, empty if unknown
+        :rtype: str
+        '''
+
+        try:
+            with open(self.config['general']['dbpath'] + '/lock', 'r', encoding='utf-8') as lock:
+                return lock.read().strip()
+        except OSError:
+            return ''
+
+    def release(self):
+        '''
+        Releases the lock.
+
+        :return: None
+        '''
+
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self) -> 'DbLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
@@ -1,23 +1,239 @@
 '''This module is a simple Logger to log messages to stdout.'''
 
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+
+from contextlib import contextmanager
+from typing import Iterator, TextIO
+
+# Log levels, by increasing severity
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+# Number of buffered lines written at once when stdout is not a terminal
+
+BUFFER_SIZE = 64
+
+# Loggers already created, indexed by configuration
+
+loggers: dict[int, 'Logger'] = {}
+
+# Outputs already created, indexed by stream
+
+outputs: dict[int, 'Output'] = {}
+
+class Output:
+    '''
+    A class buffering the text written to a stream, shared by all the loggers
+    writing to it so that their messages stay in order.
+
+    Attributes:
+        stream (TextIO): Output stream
+        interactive (bool): Is the output stream a terminal?
+        buffer (list[str]): Lines not written yet
+        broken (bool): Is the reader of the stream gone?
+        lock (threading.Lock): Lock protecting the buffer
+    '''
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self.interactive = stream.isatty()
+        self.buffer: list[str] = []
+        self.broken = False
+        self.lock = threading.Lock()
+
+        atexit.register(self.flush)
+
+    def write(self, text: str):
+        '''
+        Writes some text to the stream, through the buffer.
+
+        :param str text: Text to write
+
+        :return: None
+        '''
+
+        with self.lock:
+            self.buffer.append(text)
+
+            if self.interactive or len(self.buffer) >= BUFFER_SIZE:
+                self.write_buffer()
+
+    def flush(self):
+        '''
+        Writes the buffered text to the stream.
+
+        :return: None
+        '''
+
+        with self.lock:
+            # The stream may be closed already when called at exit
+
+            if self.stream.closed:
+                return
+
+            self.write_buffer()
+
+    def write_buffer(self):
+        '''
+        Writes the buffered text to the stream. The caller holds the lock.
+
+        When the reader of the stream is gone (`spkm graph | head`), the text is
+        dropped, and so is the text written afterwards.
+
+        :return: None
+        '''
+
+        text = ''.join(self.buffer)
+        self.buffer = []
+
+        if self.broken:
+            return
+
+        try:
+            self.stream.write(text)
+            self.stream.flush()
+        except BrokenPipeError:
+            self.broken = True
+
+            # Python flushes stdout again at exit, which would fail the same way
+
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, self.stream.fileno())
+            os.close(devnull)
+
 class Logger:
     '''
     A class representing a Logger.
 
+    Messages are buffered and written by batches when stdout is not a terminal.
+    With the `json` output, every message is written as a JSON event on its own line.
+
     Attributes:
         config (dict): SPKM Configuration
+        output (Output): Buffered output stream
+        interactive (bool): Is the output stream a terminal?
+        json (bool): Are messages written as JSON events?
+        level (int): Minimum level of the logged messages
+        root (str | None): Name of the root the messages are about (see `upgrade_roots`)
         cyan (str): Cyan color code
         red (str): Red color code
         green (str): Green color code
+        yellow (str): Yellow color code
         reset (str): Reset color code
     '''
 
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, stream: TextIO | None = None):
         self.config = config
-        self.cyan = '\033[94m'
-        self.red = '\033[31m'
-        self.green = '\033[92m'
-        self.reset = '\033[00m'
+
+        stream = stream if stream is not None else sys.stdout
+
+        if id(stream) not in outputs:
+            outputs[id(stream)] = Output(stream)
+
+        self.output = outputs[id(stream)]
+        self.interactive = self.output.interactive
+        self.json = config['general'].get('output', 'text') == 'json'
+        self.level = LEVELS[config['general'].get('log_level', 'info')]
+        self.root = config['general'].get('name')
+
+        colors = config['general'].get('colors', True) and self.interactive and not self.json
+
+        self.cyan = '\033[94m' if colors else ''
+        self.red = '\033[31m' if colors else ''
+        self.green = '\033[92m' if colors else ''
+        self.yellow = '\033[93m' if colors else ''
+        self.reset = '\033[00m' if colors else ''
+
+    def write(self, text: str):
+        '''
+        Writes some text to the output stream, through the buffer.
+
+        :param str text: Text to write
+
+        :return: None
+        '''
+
+        self.output.write(text)
+
+    def flush(self):
+        '''
+        Writes the buffered text to the output stream.
+
+        :return: None
+        '''
+
+        self.output.flush()
+
+    def is_enabled(self, level: str) -> bool:
+        '''
+        Checks if the messages of a level are logged.
+
+        :param str level: Level name
+
+        :return: Are they logged?
+        :rtype: bool
+        '''
+
+        return LEVELS[level] >= self.level
+
+    def log_event(self, event: str, message: str | None = None, level: str = 'info', **fields):
+        '''
+        Logs an event: a JSON object with the `json` output, its message otherwise.
+
+        :param str event: Event name
+        :param str message: Message to display, None to only log the event as JSON
+        :param str level: Level name
+        :param fields: Event data
+
+        :return: None
+        '''
+
+        if not self.is_enabled(level):
+            return
+
+        if self.json:
+            data = {'time': round(time.time(), 3), 'level': level, 'event': event}
+
+            if self.root is not None:
+                data['root'] = self.root
+
+            if message is not None:
+                data['message'] = message
+
+            self.write(json.dumps(data | fields) + '\n')
+        elif message is not None:
+            self.write((f'[{self.root}] ' if self.root is not None else '') + message + '\n')
+
+    @contextmanager
+    def timed(self, event: str, **fields) -> Iterator[dict]:
+        '''
+        Times an operation and logs it as an event with its duration once done.
+        Without the `json` output, the duration is only logged at the debug level.
+
+        :param str event: Event name
+        :param fields: Event data, which the operation can complete
+
+        :return: Event data
+        :rtype: Iterator[dict]
+        '''
+
+        start = time.monotonic()
+
+        try:
+            yield fields
+        finally:
+            fields['duration'] = round(time.monotonic() - start, 4)
+
+            if self.json:
+                self.log_event(event, **fields)
+            else:
+                details = ', '.join(f'{key}={value}' for key, value in fields.items())
+                self.log_debug(f'{event} ({details})')
 
     def log_header(self, header: str):
         '''
@@ -28,15 +244,11 @@ class Logger:
         :return: None
         '''
 
-        msg = self.cyan
-
-        if self.config['general']['colors'] is False:
-            msg += self.reset
+        if self.json:
+            self.log_event('header', header)
+            return
 
-        msg += f'SPKM - {header}{self.reset}'
-
-        print(msg)
-        print()
+        self.log_event('header', f'{self.cyan}SPKM - {header}{self.reset}\n')
 
     def log_err(self, err: str, err_content = False):
         '''
@@ -48,14 +260,30 @@ class Logger:
         :return: None
         '''
 
-        msg = self.red
+        if self.json:
+            self.log_event('log', err, 'error')
+            return
+
+        self.log_event(
+            'log',
+            f'{self.red}{"ERROR " if not err_content else ""}- {err}{self.reset}',
+            'error'
+        )
+
+    def log_warning(self, warning: str):
+        '''
+        Logs a warning to stdout.
+
+        :param str warning: Warning message
 
-        if self.config['general']['colors'] is False:
-            msg += self.reset
+        :return: None
+        '''
 
-        msg += f'{"ERROR " if not err_content else ""}- {err}{self.reset}'
+        if self.json:
+            self.log_event('log', warning, 'warning')
+            return
 
-        print(msg)
+        self.log_event('log', f'{self.yellow}WARNING - {warning}{self.reset}', 'warning')
 
     def log_info(self, info: str):
         '''
@@ -66,14 +294,22 @@ class Logger:
         :return: None
         '''
 
-        msg = self.cyan
+        if self.json:
+            self.log_event('log', info)
+            return
+
+        self.log_event('log', f'{self.cyan}INFO - {info}{self.reset}')
+
+    def log_debug(self, debug: str):
+        '''
+        Logs a debugging message to stdout.
 
-        if self.config['general']['colors'] is False:
-            msg += self.reset
+        :param str debug: Debugging message
 
-        msg += f'INFO - {info}{self.reset}'
+        :return: None
+        '''
 
-        print(msg)
+        self.log_event('log', debug if self.json else f'DEBUG - {debug}', 'debug')
 
     def log_success(self, success: str):
         '''
@@ -84,50 +320,87 @@ class Logger:
         :return: None
         '''
 
-        msg = self.green
+        if self.json:
+            self.log_event('log', success)
+            return
 
-        if self.config['general']['colors'] is False:
-            msg += self.reset
+        self.log_event('log', f'{self.green}SUCCESS - {success}{self.reset}')
 
-        msg += f'SUCCESS - {success}{self.reset}'
+    def log_op(self, action: str, symbol: str, color: str, text: str, **fields):
+        '''
+        Logs an incoming operation on a package to stdout.
 
-        print(msg)
+        :param str action: Either `add`, `del` or `up`
+        :param str symbol: Symbol of the operation
+        :param str color: Color of the symbol
+        :param str text: Package, as displayed
+        :param fields: Package name and versions, for the `json` output
 
-    def log_add(self, pkg: str):
+        :return: None
+        '''
+
+        if self.json:
+            self.log_event('plan', action=action, **fields)
+            return
+
+        self.log_event('plan', '[' + color + symbol + self.reset + '] ' + text)
+
+    def log_add(self, pkg: str, version: str | None = None):
         '''
         Logs a package add to stdout.
 
         :param str pkg: Package name
-        
+        :param version: Added version, if known
+        :type version: str | None
+
         :return: None
         '''
 
-        colors = self.config['general']['colors']
-        print('[' + self.cyan + (self.reset if not colors else '') + '+' + self.reset + '] ' + pkg)
+        if version is None:
+            self.log_op('add', '+', self.cyan, pkg, name=pkg)
+        else:
+            self.log_op('add', '+', self.cyan, f'{pkg}-{version}', name=pkg, version=version)
 
-    def log_del(self, pkg: str):
+    def log_del(self, pkg: str, version: str | None = None):
         '''
         Logs a package deletion to stdout.
 
         :param str pkg: Package name
-        
+        :param version: Deleted version, if known
+        :type version: str | None
+
         :return: None
         '''
 
-        colors = self.config['general']['colors']
-        print('[' + self.red + (self.reset if not colors else '') + 'D' + self.reset + '] ' + pkg)
+        if version is None:
+            self.log_op('del', 'D', self.red, pkg, name=pkg)
+        else:
+            self.log_op('del', 'D', self.red, f'{pkg}-{version}', name=pkg, version=version)
 
-    def log_up(self, pkg: str):
+    def log_up(self, pkg: str, old_version: str | None = None, new_version: str | None = None):
         '''
         Logs a package update to stdout.
 
         :param str pkg: Package name
+        :param old_version: Installed version, if known
+        :type old_version: str | None
+        :param new_version: Incoming version, if known
+        :type new_version: str | None
 
         :return: None
         '''
 
-        colors = self.config['general']['colors']
-        print('[' + self.green + (self.reset if not colors else '') + 'U' + self.reset + '] ' + pkg)
+        if old_version is None or new_version is None:
+            self.log_op('up', 'U', self.green, pkg, name=pkg)
+            return
+
+        self.log_op(
+            'up',
+            'U',
+            self.green,
+            f'{pkg}-{old_version} => {pkg}-{new_version}',
+            **{'name': pkg, 'from': old_version, 'to': new_version}
+        )
 
     def log(self, content: str):
         '''
@@ -138,5 +411,51 @@ class Logger:
         :return: None
         '''
 
-        print(content)
-        print()
+        self.log_event('output', content if self.json else content + '\n')
+
+    def newline(self):
+        '''
+        Separates two blocks of output (nothing is written with the `json` output).
+
+        :return: None
+        '''
+
+        if not self.json:
+            self.write('\n')
+
+    def confirm(self, question: str) -> bool:
+        '''
+        Asks the user for a confirmation. The question is written to stderr with the
+        `json` output, to keep stdout parseable.
+
+        :param str question: Question to ask
+
+        :return: Did the user confirm?
+        :rtype: bool
+        '''
+
+        self.flush()
+
+        prompt_stream = sys.stderr if self.json else self.output.stream
+        prompt_stream.write(question + ' (Y/N) ')
+        prompt_stream.flush()
+
+        answer = sys.stdin.readline()
+
+        return answer.strip().lower() == 'y'
+
+def get_logger(config: dict, stream: TextIO | None = None) -> Logger:
+    '''
+    Gets the logger of a configuration, shared by all the operations.
+
+    :param dict config: SPKM Configuration
+    :param TextIO stream: Output stream, used when the logger is created (stdout by default)
+
+    :return: SPKM Logger
+    :rtype: Logger
+    '''
+
+    if id(config) not in loggers:
+        loggers[id(config)] = Logger(config, stream)
+
+    return loggers[id(config)]
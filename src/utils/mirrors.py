@@ -0,0 +1,329 @@
+''' This module handles repo mirrors: ranking them and fetching files from them. '''
+
+import os
+import json
+import time
+import atexit
+import shutil
+import threading
+
+from urllib.request import Request, urlopen
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.checksum import hash_file
+from utils.config import get_shared_dbpath
+from utils.download import ProgressGroup, download, format_size, limiter
+from utils.logger import get_logger
+from utils.exceptions import PkgDownloadError
+
+# Default delay (in seconds) after which mirrors are probed again
+
+MIRROR_TTL = 24 * 60 * 60
+
+# Default delay (in seconds) after which a silent connection is considered stalled
+
+TIMEOUT = 30
+
+# Smoothing factor of the mirrors' measured throughput
+
+THROUGHPUT_SMOOTHING = 0.3
+
+# Size used to turn a mirror throughput into an expected transfer time
+
+REFERENCE_SIZE = 1024 * 1024
+
+rankings_lock = threading.Lock()
+
+# Mirror measurements already loaded, indexed by file path
+
+rankings_cache: dict[str, dict] = {}
+
+# Configurations whose measurements changed since they were saved, indexed by file path
+
+unsaved_rankings: dict[str, dict] = {}
+
+def get_repo_mirrors(repo: dict) -> list[str]:
+    '''
+    Gets the mirrors of a repo, as given in the configuration.
+
+    :param dict repo: Repo configuration
+
+    :return: Mirror URLs
+    :rtype: list[str]
+    '''
+
+    if isinstance(repo['url'], list):
+        return repo['url']
+
+    return [repo['url']]
+
+def load_rankings(config: dict) -> dict:
+    '''
+    Loads the persisted mirror measurements, once per run. The caller holds the lock.
+
+    :param dict config: SPKM Configuration
+
+    :return: Measurements, indexed by repo name then by mirror URL
+    :rtype: dict
+    '''
+
+    path = get_shared_dbpath(config) + '/mirrors'
+
+    if path not in rankings_cache:
+        rankings_cache[path] = {}
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as rankings:
+                try:
+                    rankings_cache[path] = json.load(rankings)
+                except json.JSONDecodeError:
+                    pass
+
+    return rankings_cache[path]
+
+def save_rankings(config: dict, rankings: dict):
+    '''
+    Persists the mirror measurements.
+
+    :param dict config: SPKM Configuration
+    :param dict rankings: Measurements, indexed by repo name then by mirror URL
+
+    :return: None
+    '''
+
+    path = get_shared_dbpath(config) + '/mirrors'
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    os.makedirs(get_shared_dbpath(config), exist_ok=True)
+
+    # Background downloads save their measurements without holding the database lock
+
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(rankings, file)
+
+    os.replace(tmp_path, path)
+
+    unsaved_rankings.pop(path, None)
+
+def save_unsaved_rankings():
+    '''
+    Persists the measurements recorded by the transfers, once at the end of the run.
+
+    :return: None
+    '''
+
+    with rankings_lock:
+        for config in list(unsaved_rankings.values()):
+            save_rankings(config, load_rankings(config))
+
+atexit.register(save_unsaved_rankings)
+
+def probe_mirror(mirror: str, repo: dict, timeout: float) -> float:
+    '''
+    Measures the latency of a mirror.
+
+    :param str mirror: Mirror URL
+    :param dict repo: Repo configuration
+    :param float timeout: Maximum delay to wait for an answer
+
+    :return: Latency in seconds (infinite if the mirror is unreachable)
+    :rtype: float
+    '''
+
+    if os.path.exists(mirror):
+        return 0
+
+    start_time = time.monotonic()
+
+    try:
+        with urlopen(Request(mirror + '/' + repo['name'] + '.db', method='HEAD'), timeout=timeout):
+            pass
+    except OSError:
+        return float('inf')
+
+    return time.monotonic() - start_time
+
+def mirror_score(measures: dict) -> float:
+    '''
+    Computes the expected time to fetch a reference file from a mirror.
+
+    :param dict measures: Mirror measurements
+
+    :return: Score (lower is better)
+    :rtype: float
+    '''
+
+    score = measures.get('latency', 0)
+
+    if measures.get('throughput', 0) > 0:
+        score += REFERENCE_SIZE / measures['throughput']
+
+    # Each consecutive failure pushes the mirror down the ranking
+
+    return score * (1 + measures.get('failures', 0)) + measures.get('failures', 0)
+
+def rank_mirrors(config: dict, repo: dict) -> list[str]:
+    '''
+    Ranks the mirrors of a repo, probing them if the measurements are outdated.
+
+    :param dict config: SPKM Configuration
+    :param dict repo: Repo configuration
+
+    :return: Mirror URLs, from the best to the worst one
+    :rtype: list[str]
+    '''
+
+    mirrors = get_repo_mirrors(repo)
+
+    if len(mirrors) == 1:
+        return mirrors
+
+    ttl = config['general'].get('mirror_ttl', MIRROR_TTL)
+    timeout = config['general'].get('timeout', TIMEOUT)
+
+    with rankings_lock:
+        rankings = load_rankings(config)
+        measures = rankings.setdefault(repo['name'], {})
+
+        to_probe = [
+            mirror for mirror in mirrors
+            if mirror not in measures or time.time() - measures[mirror].get('probed', 0) > ttl
+        ]
+
+        if len(to_probe) > 0:
+            with ThreadPoolExecutor(max_workers=len(to_probe)) as executor:
+                latencies = executor.map(
+                    lambda mirror: probe_mirror(mirror, repo, timeout),
+                    to_probe
+                )
+
+                for mirror, latency in zip(to_probe, latencies):
+                    measures.setdefault(mirror, {})
+                    measures[mirror]['latency'] = min(latency, timeout)
+                    measures[mirror]['failures'] = 0 if latency != float('inf') else 1
+                    measures[mirror]['probed'] = time.time()
+
+            save_rankings(config, rankings)
+
+    return sorted(mirrors, key=lambda mirror: mirror_score(measures[mirror]))
+
+def record_transfer(config: dict, repo: dict, mirror: str, size: int, duration: float,
+    success: bool):
+    '''
+    Records the outcome of a transfer from a mirror, saved at the end of the run.
+
+    :param dict config: SPKM Configuration
+    :param dict repo: Repo configuration
+    :param str mirror: Mirror URL
+    :param int size: Transferred size
+    :param float duration: Transfer duration
+    :param bool success: Did the transfer succeed?
+
+    :return: None
+    '''
+
+    if len(get_repo_mirrors(repo)) == 1:
+        return
+
+    with rankings_lock:
+        rankings = load_rankings(config)
+        measures = rankings.setdefault(repo['name'], {}).setdefault(mirror, {})
+
+        if success:
+            measures['failures'] = 0
+        else:
+            measures['failures'] = measures.get('failures', 0) + 1
+
+        # Small transfers say more about the latency than about the throughput
+
+        if size >= REFERENCE_SIZE and duration > 0:
+            throughput = size / duration
+
+            if measures.get('throughput', 0) == 0:
+                measures['throughput'] = throughput
+            else:
+                measures['throughput'] = (THROUGHPUT_SMOOTHING * throughput
+                                            + (1 - THROUGHPUT_SMOOTHING) * measures['throughput'])
+
+        unsaved_rankings[get_shared_dbpath(config) + '/mirrors'] = config
+
+def fetch(config: dict, repo: dict, path: str, dest_path: str, total_length: int = 0,
+    display_name: str = '', algo: str = 'md5', render: bool = True,
+    group: ProgressGroup | None = None) -> str:
+    '''
+    Fetches a file from the best mirror of a repo, failing over to the other ones.
+
+    :param dict config: SPKM Configuration
+    :param dict repo: Repo configuration
+    :param str path: File path, relative to the repo root
+    :param str dest_path: Destination path
+    :param int total_length: Size of the file
+    :param str display_name: Name to display while downloading
+    :param str algo: Digest algorithm
+    :param bool render: Should the progress bar be rendered on a terminal?
+    :param ProgressGroup group: Progress of the concurrent downloads, rendered instead
+
+    :return: Hex digest of the fetched file
+    :rtype: str
+    '''
+
+    limiter.rate = config['general'].get('bandwidth_limit', 0) * 1024
+
+    logger = get_logger(config)
+    mirrors = rank_mirrors(config, repo)
+
+    if display_name == '':
+        display_name = path
+
+    start = time.monotonic()
+
+    # No need to download a file from a local mirror, just need to copy it. A local
+    # mirror lacking the file is failed over like a remote one.
+
+    for mirror in mirrors:
+        if os.path.exists(mirror):
+            if not os.path.exists(mirror + '/' + path):
+                record_transfer(config, repo, mirror, 0, 0, False)
+                continue
+
+            shutil.copy(mirror + '/' + path, dest_path)
+            digest = hash_file(dest_path, algo)
+            break
+    else:
+        urls = {mirror + '/' + path: mirror for mirror in mirrors if not os.path.exists(mirror)}
+
+        if len(urls) == 0:
+            raise PkgDownloadError(f'Could not find {path} in any mirror')
+
+        digest = download(
+            list(urls),
+            dest_path,
+            total_length,
+            display_name,
+            algo,
+            config['general'].get('timeout', TIMEOUT),
+            lambda url, size, duration, success: record_transfer(
+                config, repo, urls[url], size, duration, success
+            ),
+            render = render and not logger.json,
+            group = group
+        )
+
+    # The progress bar already displays the transfer on a terminal
+
+    rendered = logger.interactive and (group.tty if group is not None else render)
+
+    size = os.path.getsize(dest_path)
+    duration = time.monotonic() - start
+    speed = size / duration if duration > 0 else 0
+
+    logger.log_event(
+        'download',
+        None if rendered else
+        f'{display_name} ({format_size(size, size)} - {format_size(speed, speed)}/s)',
+        file=display_name,
+        size=size,
+        duration=round(duration, 4)
+    )
+
+    return digest
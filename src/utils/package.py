@@ -0,0 +1,115 @@
+''' This module defines the compact package records used while planning operations. '''
+
+import sys
+import tomllib
+
+from utils.checksum import DIGESTS
+from utils.version import version_key
+
+class Package:
+    '''
+    A class representing a package of a repo. Records are interned (see
+    `utils.db.get_pkg_data`), their names are interned strings and the repo
+    configuration is shared, so comparing and storing them is cheap.
+
+    Attributes:
+        name (str): Package name
+        version (str): Package version
+        release (str): Package release
+        key (tuple): Version sort key (see `utils.version`)
+        group (str): Group of the package in its repo
+        repo (dict): Repo configuration
+        path (str): Metadata directory of the package
+        dependencies (tuple[str, ...]): Runtime dependencies
+        reverse_deps (tuple[str, ...]): Packages depending on this one
+        size (int): Archive size
+        digests (dict): Archive digests, indexed by algorithm
+        deltas (tuple[dict, ...]): Available delta archives
+        details (dict | None): `package.toml` data, loaded on demand
+    '''
+
+    __slots__ = ('name', 'version', 'release', 'key', 'group', 'repo', 'path', 'dependencies',
+                 'reverse_deps', 'size', 'digests', 'deltas', 'details')
+
+    def __init__(self, name: str, version: str, release: str, group: str, repo: dict,
+        path: str, infos: dict, key: tuple | None = None):
+        self.name = sys.intern(name)
+        self.version = sys.intern(version)
+        self.release = sys.intern(str(release))
+        self.key = key if key is not None else version_key(version, release)
+        self.group = sys.intern(group)
+        self.repo = repo
+        self.path = path
+        self.dependencies = tuple(sys.intern(dep['name']) for dep in infos.get('run', []))
+        self.reverse_deps = tuple(
+            sys.intern(dep['name']) for dep in infos.get('reverse-deps', [])
+        )
+        self.size = infos['size']
+        self.digests = {algo: infos[algo] for algo in DIGESTS if algo in infos}
+        self.deltas = tuple(infos.get('deltas', []))
+        self.details = None
+
+    def get_details(self) -> dict:
+        '''
+        Gets the `package.toml` data of the package, loading it the first time.
+
+        :return: Package details
+        :rtype: dict
+        '''
+
+        if self.details is None:
+            with open(self.path + '/package.toml', 'rb') as base_toml:
+                self.details = tomllib.load(base_toml)
+
+        return self.details
+
+    @property
+    def description(self) -> str:
+        ''' Description of the package. '''
+
+        return self.get_details().get('description', '')
+
+    @property
+    def packager(self) -> str:
+        ''' Packager of the package. '''
+
+        return self.get_details().get('packager', '')
+
+    def with_version(self, version: str, release: str) -> 'Package':
+        '''
+        Gets a copy of the record describing another version of the package,
+        typically the installed one.
+
+        :param str version: Package version
+        :param str release: Package release
+
+        :return: Package record
+        :rtype: Package
+        '''
+
+        pkg = object.__new__(Package)
+
+        for slot in Package.__slots__:
+            setattr(pkg, slot, getattr(self, slot))
+
+        pkg.version = sys.intern(version)
+        pkg.release = sys.intern(str(release))
+        pkg.key = version_key(version, release)
+
+        return pkg
+
+    def __eq__(self, other) -> bool:
+        if self is other:
+            return True
+
+        if not isinstance(other, Package):
+            return NotImplemented
+
+        return (self.name == other.name and self.version == other.version
+                and self.release == other.release)
+
+    def __hash__(self) -> int:
+        return hash(self.name)
+
+    def __repr__(self) -> str:
+        return f'Package({self.name}-{self.version}-{self.release})'
@@ -0,0 +1,201 @@
+''' This module caches upgrade plans, so that they are only computed once. '''
+
+import os
+import json
+import time
+import hashlib
+import tomllib
+
+from typing import Literal
+
+from utils.db import get_pkg_data
+from utils.config import get_shared_dbpath
+
+def file_fingerprint(path: str) -> str:
+    '''Gets the fingerprint of a file from its content.
+
+    :param str path: File path
+
+    :return: Digest of the file, empty if it does not exist
+    :rtype: str
+    '''
+
+    if not os.path.exists(path):
+        return ''
+
+    with open(path, 'rb') as file:
+        return hashlib.file_digest(file, 'blake2b').hexdigest()
+
+def get_fingerprint(config: dict) -> dict:
+    '''Gets the fingerprints of every file an upgrade plan depends on.
+
+    :param dict config: SPKM Configuration
+
+    :return: Fingerprints, indexed by file
+    :rtype: dict
+    '''
+
+    dbpath = config['general']['dbpath']
+
+    # Plans are computed against `world.new` when it exists
+
+    world = 'world.new' if os.path.exists(dbpath + '/world.new') else 'world'
+
+    fingerprint = {
+        'local': file_fingerprint(dbpath + '/local'),
+        world: file_fingerprint(dbpath + '/' + world),
+        'seen': file_fingerprint(dbpath + '/seen'),
+        'allow_downgrade': config['general'].get('allow_downgrade', False)
+    }
+
+    for repo in config['repos']:
+        fingerprint['dist/' + repo['name']] = file_fingerprint(
+            get_shared_dbpath(config) + '/dist/' + repo['name'] + '/index.json'
+        )
+
+    return fingerprint
+
+def serialize_ops(ops: dict) -> dict:
+    '''Converts incoming operations into plain data.
+
+    :param dict ops: Incoming operations
+
+    :return: Operations, packages being `[name, version, release]` lists
+    :rtype: dict
+    '''
+
+    return {
+        'dels': [[pkg.name, pkg.version, pkg.release] for pkg in ops['dels']],
+        'adds': [[pkg.name, pkg.version, pkg.release] for pkg in ops['adds']],
+        'up': [
+            [old.name, old.version, old.release, new.version, new.release]
+            for old, new in ops['up']
+        ]
+    }
+
+def deserialize_ops(config: dict, plan: dict) -> dict | Literal[False]:
+    '''Converts a recorded plan back into incoming operations.
+
+    :param dict config: SPKM Configuration
+    :param dict plan: Recorded plan
+
+    :return: Incoming operations or False if a package is not available anymore
+    :rtype: dict | bool
+    '''
+
+    ops: dict[str, list] = {'up': [], 'adds': [], 'dels': []}
+
+    for name, version, release in plan['ops']['dels']:
+        pkg_data = get_pkg_data(config, name)
+
+        if pkg_data is False:
+            return False
+
+        ops['dels'].append(pkg_data.with_version(version, release))
+
+    for name, version, release in plan['ops']['adds']:
+        pkg_data = get_pkg_data(config, name)
+
+        if pkg_data is False or (pkg_data.version, pkg_data.release) != (version, release):
+            return False
+
+        ops['adds'].append(pkg_data)
+
+    for name, old_version, old_release, version, release in plan['ops']['up']:
+        pkg_data = get_pkg_data(config, name)
+
+        if pkg_data is False or (pkg_data.version, pkg_data.release) != (version, release):
+            return False
+
+        ops['up'].append((pkg_data.with_version(old_version, old_release), pkg_data))
+
+    return ops
+
+def save_plan(config: dict, ops: dict, fingerprint: dict, fetched: bool = False) -> dict:
+    '''Records an upgrade plan.
+
+    :param dict config: SPKM Configuration
+    :param dict ops: Incoming operations
+    :param dict fingerprint: Fingerprints of the files the plan was computed from
+    :param bool fetched: Were the archives of the upgrade fetched?
+
+    :return: The recorded plan
+    :rtype: dict
+    '''
+
+    plan_path = config['general']['dbpath'] + '/plan'
+    plan = {
+        'created': time.time(),
+        'fingerprint': fingerprint,
+        'fetched': fetched,
+        'ops': serialize_ops(ops)
+    }
+
+    with open(plan_path + '.tmp', 'w', encoding='utf-8') as plan_file:
+        json.dump(plan, plan_file)
+
+    os.replace(plan_path + '.tmp', plan_path)
+
+    return plan
+
+def load_plan(config: dict, fingerprint: dict) -> dict | Literal[False]:
+    '''Loads the recorded upgrade plan if it is still valid.
+
+    :param dict config: SPKM Configuration
+    :param dict fingerprint: Fingerprints of the current files
+
+    :return: The plan or False if there is no valid plan
+    :rtype: dict | bool
+    '''
+
+    plan_path = config['general']['dbpath'] + '/plan'
+
+    if not os.path.exists(plan_path):
+        return False
+
+    with open(plan_path, 'r', encoding='utf-8') as plan_file:
+        try:
+            plan = json.load(plan_file)
+        except json.JSONDecodeError:
+            return False
+
+    if plan.get('fingerprint') != fingerprint:
+        return False
+
+    return plan
+
+def get_cached_ops(config: dict, fingerprint: dict) -> tuple | Literal[False]:
+    '''Gets the incoming operations from the recorded plan if it is still valid.
+
+    :param dict config: SPKM Configuration
+    :param dict fingerprint: Fingerprints of the current files
+
+    :return: Incoming operations, local index data and the plan, or False
+    :rtype: tuple | bool
+    '''
+
+    plan = load_plan(config, fingerprint)
+
+    if plan is False:
+        return False
+
+    ops = deserialize_ops(config, plan)
+
+    if ops is False:
+        return False
+
+    with open(config['general']['dbpath'] + '/local', 'rb') as local:
+        local_data = tomllib.load(local)
+
+    return ops, local_data, plan
+
+def drop_plan(config: dict):
+    '''Drops the recorded upgrade plan, once applied.
+
+    :param dict config: SPKM Configuration
+
+    :return: None
+    '''
+
+    if os.path.exists(config['general']['dbpath'] + '/plan'):
+        os.remove(config['general']['dbpath'] + '/plan')
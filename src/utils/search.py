@@ -0,0 +1,345 @@
+''' This module handles the full-text package search index. '''
+
+import os
+import re
+import json
+import heapq
+import bisect
+
+from utils.config import get_shared_dbpath
+
+# Weight of a match in each field of a package
+
+FIELD_WEIGHTS = {'name': 10, 'group': 3, 'packager': 2, 'description': 1}
+
+# Score factor of each kind of match
+
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.7
+FUZZY_MATCH = 0.4
+
+# Search indexes already loaded, indexed by repo name
+
+search_indexes: dict[str, dict] = {}
+
+def tokenize(text: str) -> list[str]:
+    '''
+    Splits a text into lowercase tokens.
+
+    :param str text: Text to split
+
+    :return: Tokens
+    :rtype: list[str]
+    '''
+
+    return [token for token in re.split(r'[^a-z0-9]+', text.lower()) if token != '']
+
+def build_search_index(repo_dir: str, repo_name: str, pkgs: dict[str, dict]):
+    '''
+    Builds the inverted index of a repo over package names, descriptions, groups
+    and packagers.
+
+    :param str repo_dir: Synced repo directory
+    :param str repo_name: Repo name
+    :param dict pkgs: `package.toml` data with the group of each package, indexed by name
+
+    :return: None
+    '''
+
+    offsets = []
+    postings: dict[str, dict[int, int]] = {}
+
+    # Documents are numbered in name order, so that ties are ranked without loading them,
+    # and written one per line to be read only when they are part of the results
+
+    with open(repo_dir + '/search.docs.tmp', 'wb') as docs_file:
+        for doc_id, name in enumerate(sorted(pkgs)):
+            pkg = pkgs[name]
+
+            offsets.append(docs_file.tell())
+            docs_file.write(json.dumps([
+                name,
+                pkg['version'],
+                pkg['group'],
+                pkg.get('description', ''),
+                pkg.get('packager', '')
+            ]).encode() + b'\n')
+
+            for field, weight in FIELD_WEIGHTS.items():
+                text = name if field == 'name' else pkg.get(field, '')
+
+                for token in tokenize(text):
+                    token_postings = postings.setdefault(token, {})
+                    token_postings[doc_id] = max(token_postings.get(doc_id, 0), weight)
+
+    # Postings are stored sorted by token, as space-separated documents grouped by weight,
+    # only decoded when a token matches
+
+    index: dict = {'offsets': offsets, 'postings': {}}
+
+    for token in sorted(postings):
+        by_weight: dict[int, list[str]] = {}
+
+        for doc_id, weight in postings[token].items():
+            by_weight.setdefault(weight, []).append(str(doc_id))
+
+        index['postings'][token] = {
+            str(weight): ' '.join(doc_ids) for weight, doc_ids in by_weight.items()
+        }
+
+    with open(repo_dir + '/search.json.tmp', 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file)
+
+    os.replace(repo_dir + '/search.docs.tmp', repo_dir + '/search.docs')
+    os.replace(repo_dir + '/search.json.tmp', repo_dir + '/search.json')
+
+    index['tokens'] = list(index['postings'])
+    index['docs_path'] = repo_dir + '/search.docs'
+    search_indexes[repo_name] = index
+
+def load_search_index(config: dict, repo: dict) -> dict:
+    '''
+    Loads the search index of a repo.
+
+    :param dict config: SPKM Configuration
+    :param dict repo: Repo configuration
+
+    :return: Search index (empty if the repo was never synced)
+    :rtype: dict
+    '''
+
+    if repo['name'] not in search_indexes:
+        repo_dir = get_shared_dbpath(config) + '/dist/' + repo['name']
+
+        if not os.path.exists(repo_dir + '/search.json'):
+            return {'offsets': [], 'tokens': [], 'postings': {}, 'docs_path': None}
+
+        with open(repo_dir + '/search.json', 'r', encoding='utf-8') as index_file:
+            index = json.load(index_file)
+
+        index['tokens'] = list(index['postings'])
+        index['docs_path'] = repo_dir + '/search.docs'
+        search_indexes[repo['name']] = index
+
+    return search_indexes[repo['name']]
+
+def load_docs(index: dict, doc_ids: list[int]) -> list[list[str]]:
+    '''
+    Reads some documents of a search index.
+
+    :param dict index: Search index
+    :param list[int] doc_ids: Documents to read
+
+    :return: Name, version, group, description and packager of each document
+    :rtype: list[list[str]]
+    '''
+
+    docs = []
+
+    with open(index['docs_path'], 'rb') as docs_file:
+        for doc_id in doc_ids:
+            docs_file.seek(index['offsets'][doc_id])
+            docs.append(json.loads(docs_file.readline()))
+
+    return docs
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    '''
+    Computes the Levenshtein distance between two strings, giving up above a limit.
+
+    :param str a: First string
+    :param str b: Second string
+    :param int limit: Maximum distance of interest
+
+    :return: Distance (limit + 1 if it is greater than the limit)
+    :rtype: int
+    '''
+
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+
+        if min(current) > limit:
+            return limit + 1
+
+        previous = current
+
+    return previous[-1]
+
+def find_tokens(index: dict, term: str, fuzzy: bool) -> dict[str, float]:
+    '''
+    Finds the tokens of a search index matching a search term.
+
+    :param dict index: Search index
+    :param str term: Lowercase search term
+    :param bool fuzzy: Are approximate matches allowed?
+
+    :return: Score factors, indexed by token
+    :rtype: dict[str, float]
+    '''
+
+    tokens = index['tokens']
+    matches: dict[str, float] = {}
+
+    # Exact and prefix matches are a range of the sorted tokens
+
+    start = bisect.bisect_left(tokens, term)
+    for token in tokens[start:]:
+        if not token.startswith(term):
+            break
+
+        matches[token] = EXACT_MATCH if token == term else PREFIX_MATCH
+
+    if len(matches) == 0 and fuzzy and len(term) > 2:
+        limit = 1 if len(term) < 6 else 2
+
+        # Candidates share the first letter of the term
+
+        start = bisect.bisect_left(tokens, term[0])
+        end = bisect.bisect_left(tokens, chr(ord(term[0]) + 1))
+
+        for token in tokens[start:end]:
+            if edit_distance(term, token, limit) <= limit:
+                matches[token] = FUZZY_MATCH
+
+    return matches
+
+def count_postings(index: dict, matches: dict[str, float]) -> int:
+    '''
+    Estimates the number of documents matching some tokens, without decoding their postings.
+
+    :param dict index: Search index
+    :param dict matches: Score factors, indexed by token
+
+    :return: Number of postings
+    :rtype: int
+    '''
+
+    return sum(
+        doc_ids.count(' ') + 1
+        for token in matches
+        for doc_ids in index['postings'][token].values()
+    )
+
+def match_term(
+        index: dict,
+        matches: dict[str, float],
+        candidates: set[int] | None
+    ) -> dict[int, float]:
+    '''
+    Finds the documents matching the tokens of a search term.
+
+    :param dict index: Search index
+    :param dict matches: Score factors, indexed by token
+    :param candidates: Documents matching the previous terms, None for all documents
+    :type candidates: set[int] | None
+
+    :return: Scores, indexed by document
+    :rtype: dict[int, float]
+    '''
+
+    scores: dict[int, float] = {}
+
+    for token, factor in matches.items():
+        for weight, doc_ids in index['postings'][token].items():
+            score = int(weight) * factor
+            docs = map(int, doc_ids.split(' '))
+
+            if candidates is not None:
+                docs = candidates.intersection(docs)
+
+            for doc_id in docs:
+                if score > scores.get(doc_id, 0):
+                    scores[doc_id] = score
+
+    return scores
+
+def search_repo(index: dict, terms: list[str], fuzzy: bool) -> dict[int, float]:
+    '''
+    Finds the documents of a search index matching all the given terms.
+
+    :param dict index: Search index
+    :param list[str] terms: Lowercase search terms
+    :param bool fuzzy: Are approximate matches allowed?
+
+    :return: Scores, indexed by document
+    :rtype: dict[int, float]
+    '''
+
+    term_matches = [find_tokens(index, term, fuzzy) for term in terms]
+
+    # Posting lists are intersected from the rarest term, so that the more common
+    # ones only have to look up a few candidates
+
+    term_matches.sort(key=lambda matches: count_postings(index, matches))
+
+    scores: dict[int, float] | None = None
+
+    for matches in term_matches:
+        term_scores = match_term(index, matches, None if scores is None else set(scores))
+
+        if scores is None:
+            scores = term_scores
+        else:
+            scores = {doc_id: scores[doc_id] + score for doc_id, score in term_scores.items()}
+
+        if len(scores) == 0:
+            break
+
+    return scores or {}
+
+def search(config: dict, terms: list[str], fuzzy: bool = True, limit: int = 0) -> list[dict]:
+    '''
+    Searches the synced repos for packages matching all the given terms.
+
+    :param dict config: SPKM Configuration
+    :param list[str] terms: Search terms
+    :param bool fuzzy: Are approximate matches allowed?
+    :param int limit: Maximum number of results (0 for no limit)
+
+    :return: Matching packages, from the most relevant one
+    :rtype: list[dict]
+    '''
+
+    terms = [token for term in terms for token in tokenize(term)]
+    results = []
+
+    for repo in config['repos']:
+        index = load_search_index(config, repo)
+        scores = search_repo(index, terms, fuzzy)
+
+        if len(scores) == 0:
+            continue
+
+        # Only the best documents are read, ties being ranked by name like the documents
+
+        ranked = ((-round(score, 2), doc_id) for doc_id, score in scores.items())
+        ranked = heapq.nsmallest(limit, ranked) if limit > 0 else sorted(ranked)
+
+        docs = load_docs(index, [doc_id for _, doc_id in ranked])
+
+        for (score, _), (name, version, group, description, packager) in zip(ranked, docs):
+            results.append({
+                'name': name,
+                'version': version,
+                'repo': repo['name'],
+                'group': group,
+                'description': description,
+                'packager': packager,
+                'score': -score
+            })
+
+    results.sort(key=lambda result: (-result['score'], result['name']))
+
+    return results[:limit] if limit > 0 else results
@@ -0,0 +1,422 @@
+''' This module handles transactions, so that upgrades can be reverted quickly. '''
+
+import os
+import json
+import shutil
+import threading
+
+from typing import Literal, TextIO
+
+from utils.db import write_index_data
+from utils.exceptions import TransactionPendingError
+from utils.files import (del_files, is_dir, link_file, move_file, prune_dirs, read_tree,
+                            sync_dir)
+
+# Index files restored when a transaction is reverted
+
+SNAPSHOT_FILES = ('local', 'world', 'world.new', 'seen')
+
+class Transaction:
+    '''
+    A class recording the changes made to the system during an upgrade. Replaced and
+    deleted files are moved into a backup area instead of being deleted, so that
+    reverting the transaction is a batch of renames.
+
+    Index changes are kept in memory and written at checkpoints, which make them and
+    the journal durable. The journal is also made durable before each batch of moved
+    files (see `sync`).
+
+    Attributes:
+        config (dict): SPKM Configuration
+        path (str): Transaction directory
+        entries (list): Journal entries
+        indexes (dict): Index data not written yet, indexed by index name
+        journal (TextIO | None): Journal file, opened on the first entry
+        lock (threading.Lock): Lock protecting the journal
+    '''
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.path = config['general']['dbpath'] + '/transaction'
+        self.entries: list = []
+        self.indexes: dict[str, dict] = {}
+        self.journal: TextIO | None = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, config: dict) -> 'Transaction | Literal[False]':
+        '''
+        Loads the last transaction.
+
+        :param dict config: SPKM Configuration
+
+        :return: The last transaction or False if there is none
+        :rtype: Transaction | bool
+        '''
+
+        transaction = cls(config)
+
+        if not os.path.exists(transaction.path + '/journal'):
+            return False
+
+        with open(transaction.path + '/journal', 'r', encoding='utf-8') as journal:
+            for line in journal:
+                # A line may have been partially written if spkm was interrupted
+
+                try:
+                    transaction.entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+
+        return transaction
+
+    def begin(self):
+        '''
+        Starts a new transaction, dropping the previous one and snapshotting the indexes.
+        The indexes are always replaced as a whole, so the snapshot is made of hard links.
+
+        The previous transaction is only dropped once committed or reverted, as its
+        backup area holds the only copy of the files it replaced.
+
+        :return: None
+        '''
+
+        previous = Transaction.load(self.config)
+
+        if previous is not False and previous.is_pending():
+            raise TransactionPendingError
+
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+        os.makedirs(self.path + '/backup')
+        os.makedirs(self.path + '/snapshot')
+
+        for index in SNAPSHOT_FILES:
+            if os.path.exists(self.config['general']['dbpath'] + '/' + index):
+                link_file(
+                    self.config['general']['dbpath'] + '/' + index,
+                    self.path + '/snapshot/' + index
+                )
+
+        self.entries = []
+        self.indexes = {}
+
+        self.journal = open(self.path + '/journal', 'w', encoding='utf-8')
+
+        # The snapshot has to be durable before the indexes change
+
+        sync_dir(self.path + '/snapshot')
+        sync_dir(self.path)
+
+    def record(self, entry: dict):
+        '''
+        Appends an entry to the journal.
+
+        :param dict entry: Journal entry
+
+        :return: None
+        '''
+
+        with self.lock:
+            self.entries.append(entry)
+
+            if self.journal is None:
+                self.journal = open(self.path + '/journal', 'a', encoding='utf-8')
+
+            # Entries reach the system right away, to survive a crash of spkm, and the
+            # disk before the files they describe are moved
+
+            self.journal.write(json.dumps(entry) + '\n')
+            self.journal.flush()
+
+    def set_index(self, index: str, data: dict):
+        '''
+        Records the new data of an index, written at the next checkpoint.
+
+        :param str index: Index name (`local`, `world`...)
+        :param dict data: Index data
+
+        :return: None
+        '''
+
+        with self.lock:
+            self.indexes[index] = data
+
+    def write_indexes(self):
+        '''
+        Writes the pending index changes and makes the indexes durable. The caller
+        holds the lock.
+
+        :return: None
+        '''
+
+        for index, data in self.indexes.items():
+            write_index_data(data, self.config['general']['dbpath'] + '/' + index, sync=True)
+
+        self.indexes = {}
+
+        # Makes the renamed indexes durable, with the worlds swapped by `apply_ops`
+
+        sync_dir(self.config['general']['dbpath'])
+
+    def sync_journal(self):
+        '''
+        Makes the journal durable. The caller holds the lock.
+
+        :return: None
+        '''
+
+        if self.journal is not None:
+            os.fsync(self.journal.fileno())
+
+    def sync(self):
+        '''
+        Makes the journal durable, once per batch of packages, before their files are
+        moved.
+
+        :return: None
+        '''
+
+        with self.lock:
+            self.sync_journal()
+
+    def checkpoint(self):
+        '''
+        Writes the pending index changes and makes the journal durable.
+
+        :return: None
+        '''
+
+        with self.lock:
+            self.write_indexes()
+            self.sync_journal()
+
+    def close(self):
+        '''
+        Closes the journal file.
+
+        :return: None
+        '''
+
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+
+    def added(self, pkg: str):
+        '''
+        Records the addition of a package.
+
+        :param str pkg: Package name
+
+        :return: None
+        '''
+
+        self.record({'action': 'add', 'name': pkg})
+
+    def record_backup(self, pkg: str, action: str) -> dict:
+        '''
+        Records the backup of an installed package, done by `backup_pkg` once the
+        journal is durable.
+
+        :param str pkg: Package name
+        :param str action: Either `del` or `up`
+
+        :return: Journal entry, with the directories of the package
+        :rtype: dict
+        '''
+
+        root = self.config['general']['root']
+
+        dirs = []
+        files = []
+
+        for line in read_tree(self.config, pkg):
+            if not os.path.lexists(root + '/' + line):
+                continue
+
+            if is_dir(root + '/' + line):
+                dirs.append(line)
+            else:
+                files.append(line)
+
+        # The entry is recorded first, so that the files moved before an interruption
+        # are moved back
+
+        entry = {'action': action, 'name': pkg, 'files': files}
+        self.record(entry)
+
+        return entry | {'dirs': dirs}
+
+    def backup_pkg(self, entry: dict) -> list[str]:
+        '''
+        Moves the files of an installed package into the backup area.
+
+        :param dict entry: Journal entry, as returned by `record_backup`
+
+        :return: Directories of the package, to remove once empty
+        :rtype: list[str]
+        '''
+
+        root = self.config['general']['root']
+        pkg = entry['name']
+        backup = self.path + '/backup/' + pkg
+
+        for file in entry['files']:
+            move_file(root + '/' + file, backup + '/' + file)
+
+        # The tree is moved last: it marks the backup as complete
+
+        for suffix in ('.hashes', '.tree'):
+            if os.path.exists(self.config['general']['dbpath'] + '/trees/' + pkg + suffix):
+                move_file(
+                    self.config['general']['dbpath'] + '/trees/' + pkg + suffix,
+                    backup + suffix
+                )
+
+        return entry['dirs']
+
+    def get_changed_dirs(self) -> set[str]:
+        '''
+        Gets the directories whose entries were changed by the transaction.
+
+        :return: Directory paths
+        :rtype: set[str]
+        '''
+
+        root = self.config['general']['root']
+        dirs = {self.config['general']['dbpath'] + '/trees', self.path + '/backup'}
+
+        for entry in self.entries:
+            if entry['action'] in ('up', 'del'):
+                backup = self.path + '/backup/' + entry['name']
+
+                for file in entry['files']:
+                    dirs.add(os.path.dirname(root + '/' + file))
+                    dirs.add(os.path.dirname(backup + '/' + file))
+
+            if entry['action'] in ('add', 'up'):
+                for line in read_tree(self.config, entry['name']):
+                    dirs.add(os.path.dirname(root + '/' + line.rstrip('/')))
+
+        return {path for path in dirs if os.path.isdir(path)}
+
+    def commit(self):
+        '''
+        Writes the pending index changes and marks the transaction as successfully
+        applied, making the changed directories, the indexes and the journal durable.
+
+        :return: None
+        '''
+
+        # The renamed files have to be durable before the transaction is marked
+        # as committed, as it can no longer be reverted
+
+        for path in self.get_changed_dirs():
+            sync_dir(path)
+
+        with self.lock:
+            self.write_indexes()
+
+        self.record({'action': 'commit'})
+
+        with self.lock:
+            self.sync_journal()
+
+        self.close()
+
+    def is_pending(self) -> bool:
+        '''
+        Checks if the transaction was interrupted, neither committed nor reverted.
+
+        :return: Is it pending?
+        :rtype: bool
+        '''
+
+        return len(self.entries) == 0 or self.entries[-1]['action'] not in ('commit', 'rollback')
+
+    def is_reverted(self) -> bool:
+        '''
+        Checks if the transaction was already reverted.
+
+        :return: Was it reverted?
+        :rtype: bool
+        '''
+
+        return len(self.entries) > 0 and self.entries[-1]['action'] == 'rollback'
+
+    def rollback(self) -> set[str]:
+        '''
+        Reverts the transaction: removes the added files, moves the backed up ones
+        back and restores the indexes. The pending index changes are dropped.
+
+        :return: Files removed or restored, relative to the root
+        :rtype: set[str]
+        '''
+
+        with self.lock:
+            self.indexes = {}
+
+        root = self.config['general']['root']
+        trees = self.config['general']['dbpath'] + '/trees/'
+
+        dirs = []
+        files = set()
+
+        for entry in reversed(self.entries):
+            if entry['action'] not in ('add', 'up', 'del'):
+                continue
+
+            pkg = entry['name']
+            backup = self.path + '/backup/' + pkg
+
+            # The tree of an updated package is the new one only once the old one was
+            # backed up, otherwise the backup was interrupted
+
+            installed = (entry['action'] == 'add' or
+                            entry['action'] == 'up' and os.path.exists(backup + '.tree'))
+
+            if installed and os.path.exists(trees + pkg + '.tree'):
+                tree = read_tree(self.config, pkg)
+                files.update(line.rstrip('/') for line in tree)
+                dirs.extend(del_files(self.config, tree))
+                os.remove(trees + pkg + '.tree')
+
+                if os.path.exists(trees + pkg + '.hashes'):
+                    os.remove(trees + pkg + '.hashes')
+
+            if entry['action'] in ('up', 'del'):
+                files.update(entry['files'])
+
+                for file in entry['files']:
+                    if os.path.lexists(backup + '/' + file):
+                        move_file(backup + '/' + file, root + '/' + file)
+
+                for suffix in ('.tree', '.hashes'):
+                    if os.path.exists(backup + suffix):
+                        move_file(backup + suffix, trees + pkg + suffix)
+
+        prune_dirs(self.config, dirs)
+
+        # The snapshot is kept, in case the rollback is interrupted
+
+        for index in SNAPSHOT_FILES:
+            if os.path.exists(self.path + '/snapshot/' + index):
+                link_file(
+                    self.path + '/snapshot/' + index,
+                    self.config['general']['dbpath'] + '/' + index
+                )
+            elif os.path.exists(self.config['general']['dbpath'] + '/' + index):
+                os.remove(self.config['general']['dbpath'] + '/' + index)
+
+        sync_dir(self.config['general']['dbpath'])
+
+        self.record({'action': 'rollback'})
+
+        with self.lock:
+            self.sync_journal()
+
+        self.close()
+
+        return files
@@ -0,0 +1,226 @@
+''' This module handles triggers, commands regenerating derived state after a transaction. '''
+
+import os
+import re
+import fnmatch
+import tomllib
+import subprocess
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils.db import get_repo_index
+from utils.files import read_tree
+from utils.logger import Logger
+from utils.transaction import Transaction
+
+def get_triggers(config: dict, local_data: dict) -> dict[str, dict]:
+    '''
+    Gets the triggers declared by the installed packages.
+
+    A trigger is declared in `package.toml`:
+
+        [[triggers]]
+        name = 'ldconfig'
+        paths = ['usr/lib/*.so*', 'lib/*.so*']
+        exec = 'ldconfig'
+        after = []
+
+    :param dict config: SPKM Configuration
+    :param dict local_data: `local` index file data
+
+    :return: Triggers, indexed by name
+    :rtype: dict[str, dict]
+    '''
+
+    triggers = {}
+
+    for repo in config['repos']:
+        index = get_repo_index(config, repo)
+
+        for pkg in local_data:
+            if pkg in index and 'triggers' in index[pkg]:
+                for trigger in index[pkg]['triggers']:
+                    triggers.setdefault(trigger['name'], trigger)
+
+    return triggers
+
+def get_transaction_files(config: dict, transaction: Transaction) -> set[str]:
+    '''
+    Gets the files added, replaced or removed by a transaction.
+
+    :param dict config: SPKM Configuration
+    :param Transaction transaction: Applied transaction
+
+    :return: Files, relative to the root
+    :rtype: set[str]
+    '''
+
+    files = set()
+
+    for entry in transaction.entries:
+        if entry['action'] in ('up', 'del'):
+            files.update(entry['files'])
+
+        if entry['action'] in ('add', 'up'):
+            files.update(file.rstrip('/') for file in read_tree(config, entry['name']))
+
+    return files
+
+def match_triggers(triggers: dict[str, dict], files: set[str]) -> list[str]:
+    '''
+    Finds the triggers whose path patterns match at least one of the given files.
+
+    :param dict triggers: Triggers, indexed by name
+    :param set[str] files: Files, relative to the root
+
+    :return: Names of the matching triggers
+    :rtype: list[str]
+    '''
+
+    matching = []
+
+    for name, trigger in triggers.items():
+        # All the patterns of a trigger are matched at once
+
+        pattern = re.compile('|'.join(fnmatch.translate(path) for path in trigger['paths']))
+
+        if any(pattern.match(file) for file in files):
+            matching.append(name)
+
+    return matching
+
+def run_trigger(config: dict, logger: Logger, trigger: dict) -> bool:
+    '''
+    Runs a trigger, inside the root directory.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM Logger
+    :param dict trigger: Trigger
+
+    :return: Did it succeed?
+    :rtype: bool
+    '''
+
+    logger.log_info(f'Running trigger `{trigger["name"]}`...')
+
+    command = ['/bin/sh', '-c', trigger['exec']]
+
+    if os.path.realpath(config['general']['root']) != '/':
+        command = ['chroot', config['general']['root']] + command
+
+    with logger.timed('trigger', name=trigger['name']) as event:
+        try:
+            process = subprocess.run(command, capture_output=True, text=True,
+                                        errors='replace', check=False)
+            ret_code = process.returncode
+        except OSError:
+            process = None
+            ret_code = -1
+
+        event['status'] = ret_code
+
+    # The output goes through the logger, to keep the `json` output parseable
+
+    if process is not None:
+        for stream, level in (('stdout', 'info'), ('stderr', 'warning')):
+            for line in getattr(process, stream).splitlines():
+                logger.log_event('trigger-output', line, level, name=trigger['name'],
+                                    stream=stream)
+
+    if ret_code != 0:
+        logger.log_err(f'Trigger `{trigger["name"]}` failed.')
+        return False
+
+    return True
+
+def run_triggers(config: dict, logger: Logger, local_data: dict, files: set[str]) -> int:
+    '''
+    Runs, once each, the triggers matching the files changed by a transaction.
+
+    Triggers run in parallel, except those declaring that they have to run `after`
+    other ones.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM Logger
+    :param dict local_data: `local` index file data
+    :param set[str] files: Changed files, relative to the root
+
+    :return: Number of failed triggers
+    :rtype: int
+    '''
+
+    triggers = get_triggers(config, local_data)
+
+    if len(triggers) == 0:
+        return 0
+
+    names = set(match_triggers(triggers, files))
+
+    # Count, for each trigger, the triggers to run before it
+
+    waiting: dict[str, int] = {name: 0 for name in names}
+    next_triggers: dict[str, list[str]] = {name: [] for name in names}
+
+    for name in names:
+        for before in triggers[name].get('after', []):
+            if before in names and before != name:
+                waiting[name] += 1
+                next_triggers[before].append(name)
+
+    failures = 0
+    started: set[str] = set()
+    ready = [name for name in names if waiting[name] == 0]
+
+    with ThreadPoolExecutor(max_workers=max(config['general']['threads'], 1)) as executor:
+        running = {}
+
+        while len(names) > 0:
+            # A cycle between triggers, run the remaining ones anyway
+
+            if len(ready) == 0 and len(running) == 0:
+                ready = list(names)
+
+            for name in ready:
+                started.add(name)
+                running[executor.submit(run_trigger, config, logger, triggers[name])] = name
+            ready = []
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = running.pop(future)
+                names.discard(name)
+
+                if not future.result():
+                    failures += 1
+
+                for next_trigger in next_triggers[name]:
+                    waiting[next_trigger] -= 1
+
+                    if waiting[next_trigger] == 0 and next_trigger not in started:
+                        ready.append(next_trigger)
+
+    return failures
+
+def run_rollback_triggers(config: dict, logger: Logger, files: set[str]) -> int:
+    '''
+    Runs the triggers matching the files removed or restored by a rollback, as declared
+    by the packages installed once it is done.
+
+    :param dict config: SPKM Configuration
+    :param Logger logger: SPKM Logger
+    :param set[str] files: Files removed or restored, relative to the root
+
+    :return: Number of failed triggers
+    :rtype: int
+    '''
+
+    local_data = {}
+
+    # The `local` index was restored from the snapshot
+
+    if os.path.exists(config['general']['dbpath'] + '/local'):
+        with open(config['general']['dbpath'] + '/local', 'rb') as local:
+            local_data = tomllib.load(local)
+
+    return run_triggers(config, logger, local_data, files)
@@ -0,0 +1,197 @@
+''' This module handles the manifests of installed files, used to verify the system. '''
+
+import os
+import json
+import stat
+
+from typing import Literal
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.checksum import DigestCache, hash_file
+from utils.files import read_tree
+
+# Digest of the installed files
+
+FILE_DIGEST = 'blake2b'
+
+# Name of the manifest written at the root of staged packages
+
+MANIFEST = '.PKGHASHES'
+
+def build_manifest(directory: str, files: list[str]) -> dict[str, dict]:
+    '''
+    Describes the given files: their type, and the size and digest of regular files
+    or the target of symlinks.
+
+    :param str directory: Directory containing the files
+    :param list[str] files: Files, relative to the directory
+
+    :return: File descriptions, indexed by file
+    :rtype: dict[str, dict]
+    '''
+
+    manifest = {}
+
+    for file in files:
+        file = file.rstrip('/')
+        path = directory + '/' + file
+
+        if not os.path.lexists(path):
+            continue
+
+        mode = os.lstat(path).st_mode
+
+        if stat.S_ISLNK(mode):
+            manifest[file] = {'type': 'link', 'target': os.readlink(path)}
+        elif stat.S_ISDIR(mode):
+            manifest[file] = {'type': 'dir'}
+        else:
+            manifest[file] = {
+                'type': 'file',
+                'size': os.path.getsize(path),
+                FILE_DIGEST: hash_file(path, FILE_DIGEST)
+            }
+
+    return manifest
+
+def write_manifest(directory: str, files: list[str]):
+    '''
+    Writes the manifest of a staged package.
+
+    :param str directory: Staging directory
+    :param list[str] files: Files of the package
+
+    :return: None
+    '''
+
+    with open(directory + '/' + MANIFEST, 'w', encoding='utf-8') as manifest:
+        json.dump(build_manifest(directory, files), manifest)
+
+def read_manifest(config: dict, pkg: str) -> dict[str, dict] | Literal[False]:
+    '''
+    Reads the manifest recorded when a package was extracted.
+
+    :param dict config: SPKM Configuration
+    :param str pkg: Package name
+
+    :return: File descriptions or False if the package has no manifest
+    :rtype: dict | bool
+    '''
+
+    manifest_path = config['general']['dbpath'] + '/trees/' + pkg + '.hashes'
+
+    if not os.path.exists(manifest_path):
+        return False
+
+    with open(manifest_path, 'r', encoding='utf-8') as manifest:
+        return json.load(manifest)
+
+def check_file(root: str, file: str, record: dict) -> str | None:
+    '''
+    Checks the existence, type, size and symlink target of an installed file.
+
+    :param str root: Root directory
+    :param str file: File, relative to the root
+    :param dict record: File description
+
+    :return: Problem found, None if there is none (the digest is not checked)
+    :rtype: str | None
+    '''
+
+    path = root + '/' + file
+
+    if not os.path.lexists(path):
+        return 'missing'
+
+    file_stat = os.lstat(path)
+
+    if stat.S_ISLNK(file_stat.st_mode):
+        file_type = 'link'
+    elif stat.S_ISDIR(file_stat.st_mode):
+        file_type = 'dir'
+    else:
+        file_type = 'file'
+
+    if file_type != record['type']:
+        return f'is a {file_type} instead of a {record["type"]}'
+
+    if file_type == 'link' and os.readlink(path) != record['target']:
+        return 'symlink target changed'
+
+    if file_type == 'file' and file_stat.st_size != record['size']:
+        return 'size changed'
+
+    return None
+
+def verify_pkgs(config: dict, pkgs: list[str]) -> dict[str, list[tuple[str, str]]]:
+    '''
+    Verifies that the files of installed packages still match their manifests.
+
+    Only the files which changed since they were last hashed (see `DigestCache`) are
+    hashed again, across a process pool.
+
+    :param dict config: SPKM Configuration
+    :param list[str] pkgs: Package names
+
+    :return: (file, problem) tuples, indexed by package name
+    :rtype: dict[str, list[tuple[str, str]]]
+    '''
+
+    root = config['general']['root']
+    digests = DigestCache(config, 'verify', shared=False)
+
+    problems: dict[str, list[tuple[str, str]]] = {pkg: [] for pkg in pkgs}
+    to_hash = []
+
+    for pkg in pkgs:
+        manifest = read_manifest(config, pkg)
+
+        # Packages extracted by older versions only have their tree
+
+        if manifest is False:
+            for file in read_tree(config, pkg):
+                if not os.path.lexists(root + '/' + file.rstrip('/')):
+                    problems[pkg].append((file.rstrip('/'), 'missing'))
+
+            continue
+
+        for file, record in manifest.items():
+            problem = check_file(root, file, record)
+
+            if problem is not None:
+                problems[pkg].append((file, problem))
+            elif record['type'] == 'file':
+                to_hash.append((pkg, file, record[FILE_DIGEST]))
+
+    # Hash the changed files in worker processes, the cache stays in this one
+
+    stale = []
+
+    for pkg, file, expected in to_hash:
+        digest = digests.lookup(root + '/' + file, FILE_DIGEST)
+
+        if digest is None:
+            stale.append((pkg, file, expected))
+        elif digest != expected:
+            problems[pkg].append((file, 'modified'))
+
+    if len(stale) > 0:
+        paths = [root + '/' + file for _, file, _ in stale]
+
+        with ProcessPoolExecutor(max_workers=max(config['general']['threads'], 1)) as executor:
+            results = executor.map(
+                hash_file,
+                paths,
+                [FILE_DIGEST] * len(paths),
+                chunksize=max(len(paths) // (config['general']['threads'] * 4), 1)
+            )
+
+            for (pkg, file, expected), path, digest in zip(stale, paths, results):
+                digests.store(path, FILE_DIGEST, digest)
+
+                if digest != expected:
+                    problems[pkg].append((file, 'modified'))
+
+        digests.save()
+
+    return problems
@@ -0,0 +1,84 @@
+''' This module compares package versions, through precomputed sort keys. '''
+
+import re
+
+# Pre-release tags, from the oldest one, sorting before the version they precede
+
+PRE_RELEASE_TAGS = ('dev', 'alpha', 'beta', 'pre', 'rc')
+
+# Ranks of the version elements: a pre-release sorts before the end of a version,
+# which sorts before a letter suffix (`1.1.1a`), which sorts before a number
+
+PRE_RELEASE = 0
+END = 1
+ALPHA = 2
+NUMERIC = 3
+
+SEGMENT_RE = re.compile(r'~|[0-9]+|[a-zA-Z]+')
+
+def parse_segments(version: str) -> list:
+    '''
+    Splits a version into (rank, value) elements, flattened.
+
+    :param str version: Version without epoch
+
+    :return: Flat list of ranks and values
+    :rtype: list
+    '''
+
+    elements = []
+
+    for segment in SEGMENT_RE.findall(version):
+        if segment == '~':
+            elements += [PRE_RELEASE, -1]
+        elif segment.isdigit():
+            elements += [NUMERIC, int(segment)]
+        elif segment.lower() in PRE_RELEASE_TAGS:
+            elements += [PRE_RELEASE, PRE_RELEASE_TAGS.index(segment.lower())]
+        else:
+            elements += [ALPHA, segment.lower()]
+
+    return elements + [END, 0]
+
+def version_key(version: str, release: str | int = 0) -> tuple:
+    '''
+    Gets the sort key of a version and its release: newer versions have greater keys.
+
+    The key is a flat tuple (epoch, then (rank, value) pairs for the version and the
+    release), so that it can be stored as a JSON list and compared again once
+    converted back with `tuple`.
+
+    :param str version: Version, optionally prefixed by an epoch (`1:2.0`)
+    :param str release: Release
+
+    :return: Sort key
+    :rtype: tuple
+    '''
+
+    epoch = 0
+
+    if ':' in version:
+        epoch_str, version = version.split(':', 1)
+
+        if epoch_str.isdigit():
+            epoch = int(epoch_str)
+
+    return (epoch, *parse_segments(version), *parse_segments(str(release)))
+
+def vercmp(version_a: str, release_a: str | int, version_b: str, release_b: str | int) -> int:
+    '''
+    Compares two versions.
+
+    :param str version_a: First version
+    :param str release_a: Release of the first version
+    :param str version_b: Second version
+    :param str release_b: Release of the second version
+
+    :return: -1 if the first version is older, 1 if it is newer, 0 if they are equal
+    :rtype: int
+    '''
+
+    key_a = version_key(version_a, release_a)
+    key_b = version_key(version_b, release_b)
+
+    return (key_a > key_b) - (key_a < key_b)
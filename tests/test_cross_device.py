@@ -0,0 +1,127 @@
+''' Tests of package installations with the root and dbpath on different filesystems. '''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/src')
+
+# pylint: disable=wrong-import-position
+
+from operations.upgrade import commit_pkg_archive, get_staging_dir
+from utils.files import replace_file
+from utils.verify import MANIFEST
+
+def get_other_filesystem() -> str | None:
+    '''
+    Finds a writable directory on another filesystem than the temporary directory.
+
+    :return: Directory path, None if there is none
+    :rtype: str | None
+    '''
+
+    tmp_dev = os.stat(tempfile.gettempdir()).st_dev
+
+    for path in ('/dev/shm', '/run/user/' + str(os.getuid()), '/run', '/var/tmp'):
+        if (os.path.isdir(path) and os.access(path, os.W_OK) and
+                os.stat(path).st_dev != tmp_dev):
+            return path
+
+    return None
+
+class CrossDeviceTest(unittest.TestCase):
+    '''
+    Installs staged packages into a root on another filesystem than dbpath.
+    '''
+
+    def setUp(self):
+        other = get_other_filesystem()
+
+        if other is None:
+            self.skipTest('No writable directory on another filesystem')
+
+        self.root = tempfile.mkdtemp(dir=other)
+        self.dbpath = tempfile.mkdtemp()
+
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.addCleanup(shutil.rmtree, self.dbpath, True)
+
+        self.config = {'general': {'root': self.root, 'dbpath': self.dbpath}}
+
+        os.makedirs(self.dbpath + '/trees')
+
+    def stage(self, pkg_name: str, files: dict[str, str]) -> list[str]:
+        '''
+        Stages the files of a package.
+
+        :param str pkg_name: Package name
+        :param dict files: File contents, indexed by path
+
+        :return: Staged files and directories
+        :rtype: list[str]
+        '''
+
+        staging_dir = get_staging_dir(self.config, pkg_name)
+        tree = []
+
+        for file, content in files.items():
+            os.makedirs(os.path.dirname(staging_dir + '/' + file), exist_ok=True)
+
+            with open(staging_dir + '/' + file, 'w', encoding='utf-8') as staged:
+                staged.write(content)
+
+            tree.append(file)
+
+        tree = sorted({os.path.dirname(file) + '/' for file in files}) + tree
+
+        with open(staging_dir + '/.PKGTREE', 'w', encoding='utf-8') as pkgtree:
+            pkgtree.write('\n'.join(tree) + '\n')
+
+        with open(staging_dir + '/' + MANIFEST, 'w', encoding='utf-8') as manifest:
+            manifest.write('{}')
+
+        return tree
+
+    def test_commit_pkg_archive(self):
+        '''
+        The staged files reach the root and the tree reaches dbpath.
+        '''
+
+        tree = self.stage('pkg', {'usr/bin/tool': 'new tool', 'usr/lib/libtool.so': 'lib'})
+
+        os.makedirs(self.root + '/usr/bin')
+
+        with open(self.root + '/usr/bin/tool', 'w', encoding='utf-8') as tool:
+            tool.write('old tool')
+
+        commit_pkg_archive(self.config, 'pkg', tree)
+
+        with open(self.root + '/usr/bin/tool', 'r', encoding='utf-8') as tool:
+            self.assertEqual(tool.read(), 'new tool')
+
+        self.assertTrue(os.path.exists(self.root + '/usr/lib/libtool.so'))
+        self.assertTrue(os.path.exists(self.dbpath + '/trees/pkg.tree'))
+        self.assertTrue(os.path.exists(self.dbpath + '/trees/pkg.hashes'))
+        self.assertFalse(os.path.exists(get_staging_dir(self.config, 'pkg')))
+
+    def test_replace_file(self):
+        '''
+        A file is replaced across filesystems, symlinks being kept as such.
+        '''
+
+        src = self.dbpath + '/link'
+        os.symlink('target', src)
+
+        with open(self.root + '/link', 'w', encoding='utf-8') as dest:
+            dest.write('old')
+
+        replace_file(src, self.root + '/link')
+
+        self.assertEqual(os.readlink(self.root + '/link'), 'target')
+        self.assertFalse(os.path.lexists(src))
+        self.assertFalse(os.path.lexists(self.root + '/link.tmp'))
+
+if __name__ == '__main__':
+    unittest.main()